@@ -0,0 +1,260 @@
+"""
+benchmarks.fleet
+~~~~~~~~~~~~~~~~
+
+Synthetic, but realistically shaped, fleets of boto objects for the
+benchmarks, and a fake connection serving them through the pool,
+optionally throttling requests like the real API does.
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import datetime
+import random
+import threading
+import time
+
+from boto.ec2.instance import Instance, InstanceState, Reservation
+from boto.exception import EC2ResponseError
+from boto.ec2.securitygroup import SecurityGroup
+from boto.resultset import ResultSet
+from boto.vpc.vpc import VPC
+
+ENVIRONMENTS = (('production', 50), ('staging', 25), ('dev', 25))
+STATES = (
+    (InstanceState(16, 'running'), 80),
+    (InstanceState(80, 'stopped'), 12),
+    (InstanceState(48, 'terminated'), 4),
+    (InstanceState(0, 'pending'), 2),
+    (InstanceState(64, 'stopping'), 1),
+    (InstanceState(32, 'shutting-down'), 1),
+)
+INSTANCE_TYPES = (
+    ('m3.medium', 20), ('m3.large', 25), ('m3.xlarge', 10),
+    ('c3.large', 15), ('c3.2xlarge', 8), ('r3.large', 10),
+    ('r3.2xlarge', 5), ('t1.micro', 5), ('i2.xlarge', 2),
+)
+ZONES = ('us-east-1a', 'us-east-1b', 'us-east-1c', 'us-east-1d')
+ROLES = tuple('%s-%s' % (kind, n) for kind in (
+    'web', 'api', 'worker', 'db', 'cache', 'queue', 'search', 'batch',
+    'proxy', 'admin') for n in xrange(6))
+TEAMS = tuple('team-%02d' % n for n in xrange(25))
+COST_CENTERS = tuple('cc-%d' % n for n in xrange(1000, 1010))
+
+
+def weighted(rng, choices):
+    "Pick from (value, weight) pairs"
+    total = sum(weight for _, weight in choices)
+    n = rng.uniform(0, total)
+    for value, weight in choices:
+        n -= weight
+        if n <= 0:
+            return value
+    return choices[-1][0]
+
+
+class Fleet(object):
+    """
+    A synthetic account: ``size`` instances in reservations of one to
+    four, plus one VPC per 500 instances and one security group per 20.
+
+    Tags follow what real accounts tend to look like: a unique Name,
+    a few environments, dozens of roles and teams, owners growing with
+    the fleet, and tags that aren't set on every instance.
+    Generation is seeded, so the same size always gives the same fleet.
+    """
+
+    def __init__(self, size, seed=0):
+        self.size = size
+        rng = random.Random(seed)
+        self.vpcs = [self._vpc(rng, n) for n in xrange(max(2, size // 500))]
+        self.security_groups = [
+            self._security_group(rng, n) for n in xrange(max(4, size // 20))
+        ]
+        owners = ['user-%d' % n for n in xrange(max(10, size // 50))]
+        images = ['ami-%08x' % rng.getrandbits(32) for _ in xrange(50)]
+        launched = datetime.datetime(2014, 1, 1)
+
+        self.reservations = []
+        self.instances = []
+        while len(self.instances) < size:
+            reservation = Reservation()
+            reservation.id = 'r-%08x' % rng.getrandbits(32)
+            count = min(rng.randint(1, 4), size - len(self.instances))
+            for _ in xrange(count):
+                instance = self._instance(
+                    rng, len(self.instances), owners, images, launched)
+                reservation.instances.append(instance)
+                self.instances.append(instance)
+            self.reservations.append(reservation)
+
+    def _vpc(self, rng, n):
+        vpc = VPC()
+        vpc.id = 'vpc-%08x' % rng.getrandbits(32)
+        vpc.state = 'available'
+        vpc.cidr_block = '10.%d.0.0/16' % (n % 256)
+        vpc.is_default = n == 0
+        vpc.instance_tenancy = 'default'
+        vpc.dhcp_options_id = 'dopt-%08x' % rng.getrandbits(32)
+        vpc.tags = {'Name': 'vpc-%s-%d' % (weighted(rng, ENVIRONMENTS), n)}
+        return vpc
+
+    def _security_group(self, rng, n):
+        group = SecurityGroup()
+        group.id = 'sg-%08x' % rng.getrandbits(32)
+        role, env = rng.choice(ROLES), weighted(rng, ENVIRONMENTS)
+        group.name = '%s-%s-%d' % (role, env, n)
+        group.description = 'Access for %s in %s' % (role, env)
+        group.vpc_id = rng.choice(self.vpcs).id
+        group.owner_id = '123456789012'
+        group.tags = {'env': env, 'role': role}
+        return group
+
+    def _instance(self, rng, n, owners, images, launched):
+        instance = Instance()
+        instance.id = 'i-%08x' % rng.getrandbits(32)
+        instance._state = weighted(rng, STATES)
+        instance.instance_type = weighted(rng, INSTANCE_TYPES)
+        instance.image_id = rng.choice(images)
+        instance._placement.zone = rng.choice(ZONES)
+        instance.key_name = 'key-%d' % rng.randint(0, 9)
+        instance.root_device_type = 'ebs' if rng.random() < 0.9 \
+            else 'instance-store'
+        instance.architecture = 'x86_64'
+        instance.platform = 'windows' if rng.random() < 0.05 else None
+        instance.launch_time = (launched + datetime.timedelta(
+            seconds=rng.randint(0, 180 * 86400))).isoformat() + '.000Z'
+
+        vpc = rng.choice(self.vpcs)
+        instance.vpc_id = vpc.id
+        instance.subnet_id = 'subnet-%s-%s' % (
+            vpc.id[4:], instance.placement[-1])
+        octets = (n // 65536 % 256, n // 256 % 256, n % 256)
+        instance.private_ip_address = '10.%d.%d.%d' % octets
+        instance.private_dns_name = 'ip-10-%d-%d-%d.ec2.internal' % octets
+        if rng.random() < 0.4:
+            public = tuple(rng.randint(1, 254) for _ in xrange(4))
+            instance.ip_address = '%d.%d.%d.%d' % public
+            instance.public_dns_name = \
+                'ec2-%d-%d-%d-%d.compute-1.amazonaws.com' % public
+        else:
+            instance.ip_address = None
+            instance.public_dns_name = ''
+        instance.groups = rng.sample(self.security_groups, rng.randint(1, 3))
+
+        role, env = rng.choice(ROLES), weighted(rng, ENVIRONMENTS)
+        tags = {
+            'Name': '%s-%s-%05d' % (role, env, n),
+            'env': env,
+            'role': role,
+            'team': rng.choice(TEAMS),
+        }
+        if rng.random() < 0.7:
+            tags['owner'] = rng.choice(owners)
+        if rng.random() < 0.5:
+            tags['cost-center'] = rng.choice(COST_CENTERS)
+        instance.tags = tags
+        return instance
+
+
+class FakeConnection(object):
+    """
+    Stands in for both the EC2 and VPC connections, serving a Fleet.
+    Filters are ignored: returning a superset is always allowed, since
+    everything is checked locally anyway.
+    """
+
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def get_all_instances(self, filters=None):
+        return self.fleet.reservations
+
+    def get_all_reservations(self, filters=None, max_results=None,
+                             next_token=None):
+        start = int(next_token or 0)
+        stop = start + (max_results or len(self.fleet.reservations))
+        page = ResultSet()
+        page.extend(self.fleet.reservations[start:stop])
+        if stop < len(self.fleet.reservations):
+            page.next_token = str(stop)
+        return page
+
+    def get_all_security_groups(self, filters=None):
+        return self.fleet.security_groups
+
+    def get_all_vpcs(self, filters=None):
+        return self.fleet.vpcs
+
+    def close(self):
+        pass
+
+
+THROTTLED = ('<Response><Errors><Error><Code>RequestLimitExceeded</Code>'
+             '<Message>Request limit exceeded.</Message></Error></Errors>'
+             '</Response>')
+
+
+class Limiter(object):
+    """
+    The server side of a throttling endpoint: a token bucket per
+    region, rejecting requests with RequestLimitExceeded once it's
+    empty, and taking ``latency`` seconds to answer the others.
+    """
+
+    def __init__(self, rate, burst, latency=0.005):
+        self.rate = rate
+        self.burst = burst
+        self.latency = latency
+        self.rejected = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def request(self, region_name):
+        with self._lock:
+            now = time.time()
+            tokens, updated = self._buckets.get(region_name,
+                                                (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[region_name] = tokens, now
+                self.rejected += 1
+                raise EC2ResponseError(503, 'Service Unavailable',
+                                       THROTTLED)
+            self._buckets[region_name] = tokens - 1, now
+        time.sleep(self.latency)
+
+
+class ThrottlingConnection(FakeConnection):
+    "A FakeConnection whose requests go through a Limiter"
+
+    def __init__(self, fleet, limiter, region_name):
+        super(ThrottlingConnection, self).__init__(fleet)
+        self.limiter = limiter
+        self.region_name = region_name
+
+    def __getattribute__(self, name):
+        attr = super(ThrottlingConnection, self).__getattribute__(name)
+        if not name.startswith('get_all_'):
+            return attr
+
+        def request(*args, **kwargs):
+            self.limiter.request(self.region_name)
+            return attr(*args, **kwargs)
+        return request
+
+
+def serve(fleet, limiter=None):
+    """
+    Make every new pooled connection serve the given fleet, throttled
+    by a Limiter if one is given
+    """
+    from ec2.connection import pool
+
+    def connect(**params):
+        if limiter is None:
+            return FakeConnection(fleet)
+        return ThrottlingConnection(fleet, limiter, params['region_name'])
+    pool.clear()
+    pool.connectors = {'ec2': connect, 'vpc': connect}
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+benchmarks.imports
+~~~~~~~~~~~~~~~~~~
+
+Measures how long ``import ec2`` takes in a fresh interpreter, and
+fails when it's slower than a limit, to guard against something slow
+being imported eagerly again.
+
+    $ python benchmarks/imports.py --max-ms 20
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import json
+import optparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+SCRIPT = '''
+import time
+start = time.time()
+import ec2
+print time.time() - start
+'''
+
+
+def measure(repeat):
+    "Seconds taken by ``import ec2``, once per fresh interpreter"
+    # Compile first, so the first run isn't the only one paying for it
+    subprocess.check_call([sys.executable, '-m', 'compileall', '-q',
+                           os.path.join(ROOT, 'ec2')])
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    timings = []
+    for _ in xrange(repeat):
+        output = subprocess.Popen(
+            [sys.executable, '-c', SCRIPT], cwd=ROOT, env=env,
+            stdout=subprocess.PIPE).communicate()[0]
+        timings.append(float(output))
+    return sorted(timings)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--repeat', type='int', default=20,
+                      help='interpreters to start [%default]')
+    parser.add_option('--max-ms', type='float', default=20,
+                      help='exit with 1 if the median is slower [%default]')
+    parser.add_option('--output', metavar='FILE',
+                      help='write the results as JSON')
+    options, _ = parser.parse_args(argv)
+
+    timings = measure(options.repeat)
+    middle = len(timings) // 2
+    if len(timings) % 2:
+        median = timings[middle]
+    else:
+        median = (timings[middle - 1] + timings[middle]) / 2
+    result = {
+        'name': 'import ec2',
+        'repeat': options.repeat,
+        'min': timings[0],
+        'median': median,
+        'max': timings[-1],
+    }
+    sys.stderr.write('import ec2  min %.2fms  median %.2fms  max %.2fms\n' % (
+        timings[0] * 1000, median * 1000, timings[-1] * 1000))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    if median * 1000 > options.max_ms:
+        sys.stderr.write('SLOWER than %.1fms\n' % options.max_ms)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+"""
+benchmarks.run
+~~~~~~~~~~~~~~
+
+Measures latency, throughput and peak memory of cache builds, every
+lookup type, multi-predicate filters and the Compare operators, over
+synthetic fleets of increasing size. Concurrent paged fetches are
+also run against a fake endpoint that throttles, under different
+client side rate limits.
+
+    $ python benchmarks/run.py --sizes 1000,10000 --output results.json
+    $ python benchmarks/run.py --compare results.json
+
+Each case runs in its own forked process, so its peak memory isn't
+hidden by whatever ran before it.
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import json
+import optparse
+import os
+import platform
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import ec2  # noqa
+from ec2.helpers import Compare  # noqa
+from fleet import Fleet, Limiter, serve  # noqa
+
+DEFAULT_SIZES = (1000, 10000, 50000, 200000)
+
+#: One lookup per comparison, against attributes and tags
+LOOKUPS = (
+    ('exact attribute', {'state': 'running'}),
+    ('exact name tag', {'name': 'web-0-production-00042'}),
+    ('exact tag', {'env': 'staging'}),
+    ('iexact', {'role__iexact': 'WEB-0'}),
+    ('like', {'name__like': r'^api-\d-staging-'}),
+    ('ilike', {'name__ilike': r'^API-\d-STAGING-'}),
+    ('contains', {'private_dns_name__contains': '-10-'}),
+    ('icontains', {'team__icontains': 'TEAM-1'}),
+    ('startswith', {'instance_type__startswith': 'm3.'}),
+    ('istartswith', {'name__istartswith': 'DB-'}),
+    ('endswith', {'placement__endswith': 'a'}),
+    ('iendswith', {'name__iendswith': '7'}),
+    ('isnull', {'owner__isnull': True}),
+)
+
+#: What the fake endpoint allows per region: (rate, burst)
+ENDPOINT_LIMIT = (200, 20)
+
+#: Client side limits to fetch from it under, as Throttle.configure()
+#: arguments. Retries are raised so that every case can finish.
+THROTTLES = (
+    ('no client limit', {'rate': None, 'retries': 10}),
+    ('limits too high', {'rate': 1000, 'burst': 100, 'retries': 10}),
+    ('matching limits', {'rate': 200, 'burst': 20, 'retries': 10}),
+)
+
+#: Threads fetching every page at once, and pages each of them fetches
+FETCHERS = 8
+PAGES = 10
+
+MULTI_PREDICATE = {
+    'state': 'running',
+    'env': 'production',
+    'role__startswith': 'web-',
+    'instance_type__istartswith': 'M3.',
+}
+
+#: Predicates with no index to answer them, so filtering scans the
+#: cache or, with columnar enabled, goes through the column store
+COLUMNAR_PREDICATE = {
+    'env__iexact': 'PRODUCTION',
+    'role__startswith': 'web-',
+    'instance_type__istartswith': 'M3.',
+    'placement__endswith': 'a',
+}
+
+
+class Case(object):
+    """
+    A single measurement. ``setup`` runs once and ``before`` runs
+    ahead of every repeat, neither of them timed. ``rows`` is how many
+    objects each run goes through, for throughput.
+    """
+
+    def __init__(self, name, fn, rows, setup=None, before=None):
+        self.name = name
+        self.fn = fn
+        self.rows = rows
+        self.setup = setup
+        self.before = before
+
+
+def clear():
+    for cls in (ec2.instances, ec2.security_groups, ec2.vpcs):
+        cls.clear()
+
+
+def cases(fleet):
+    "Every Case for a fleet"
+    instances = len(fleet.instances)
+    warm = ec2.instances.all
+
+    yield Case('instances.all cold', ec2.instances.all, instances,
+               before=clear)
+    yield Case('instances.all warm', ec2.instances.all, instances,
+               setup=warm)
+    yield Case('security_groups.all cold', ec2.security_groups.all,
+               len(fleet.security_groups), before=clear)
+    yield Case('vpcs.all cold', ec2.vpcs.all, len(fleet.vpcs), before=clear)
+
+    for name, kwargs in LOOKUPS:
+        yield Case('filter %s' % name,
+                   lambda kwargs=kwargs: list(ec2.instances.filter(**kwargs)),
+                   instances, setup=warm)
+    yield Case('filter multi-predicate',
+               lambda: list(ec2.instances.filter(**MULTI_PREDICATE)),
+               instances, setup=warm)
+    plan = ec2.instances.compile(**MULTI_PREDICATE)
+    yield Case('filter multi-predicate compiled',
+               lambda: list(ec2.instances.filter(plan)),
+               instances, setup=warm)
+
+    def substring_indexed():
+        warm()
+        ec2.instances.substring_indexed = ('name',)
+        ec2.instances.substring_index('name', fold=True)
+    for search in ('W', 'WEB-3', 'WEB-3-PRODUCTION-0004'):
+        yield Case('filter icontains indexed %r' % search,
+                   lambda search=search: list(
+                       ec2.instances.filter(name__icontains=search)),
+                   instances, setup=substring_indexed)
+
+    def indexed(key):
+        def setup():
+            warm()
+            ec2.instances.index(key)
+        return setup
+    target = fleet.instances[len(fleet.instances) // 2]
+    yield Case('get id', lambda: ec2.instances.get(id=target.id), instances,
+               setup=indexed('id'))
+    yield Case('get name',
+               lambda: ec2.instances.get(name=target.tags['Name']),
+               instances, setup=indexed('name'))
+    yield Case('security_groups filter',
+               lambda: list(ec2.security_groups.filter(
+                   name__startswith='web-', vpc_id=fleet.vpcs[0].id)),
+               len(fleet.security_groups), setup=ec2.security_groups.all)
+
+    # The Compare operators on their own, over every instance
+    for name, kwargs in LOOKUPS:
+        (key, value), = kwargs.items()
+        key, comp = ec2.helpers.split_lookup(key)
+        operator = getattr(Compare, comp)
+        yield Case('Compare.%s %s' % (comp, key),
+                   lambda operator=operator, key=key, value=value: [
+                       operator(key, value, i) for i in ec2.instances.all()],
+                   instances, setup=warm)
+
+    def throttled(limits):
+        def setup():
+            serve(fleet, Limiter(*ENDPOINT_LIMIT))
+            ec2.throttle.throttle.configure(**limits)
+            ec2.instances.page_size = max(
+                1, len(fleet.reservations) // PAGES + 1)
+        return setup
+
+    def paged_fan_out():
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(FETCHERS)
+        try:
+            pool.map(lambda _: list(ec2.instances.iterator()),
+                     xrange(FETCHERS))
+        finally:
+            pool.close()
+    for name, limits in THROTTLES:
+        yield Case('paged fan-out throttled, %s' % name, paged_fan_out,
+                   instances * FETCHERS, setup=throttled(limits))
+
+    try:
+        import numpy  # noqa
+    except ImportError:
+        return
+
+    def columnar():
+        warm()
+        ec2.instances.columnar = True
+        # Build every column the predicates need ahead of time
+        list(ec2.instances.filter(**COLUMNAR_PREDICATE))
+    yield Case('filter unindexed multi-predicate',
+               lambda: list(ec2.instances.filter(**COLUMNAR_PREDICATE)),
+               instances, setup=warm)
+    yield Case('columnar multi-predicate',
+               lambda: list(ec2.instances.filter(**COLUMNAR_PREDICATE)),
+               instances, setup=columnar)
+
+
+def peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on OS X, kilobytes everywhere else
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+def median(timings):
+    "The median of sorted timings"
+    middle = len(timings) // 2
+    if len(timings) % 2:
+        return timings[middle]
+    return (timings[middle - 1] + timings[middle]) / 2
+
+
+def measure(case, repeat):
+    "Time a case in this process, returning its result dict"
+    if case.setup is not None:
+        case.setup()
+    baseline = peak_rss_kb()
+    timings = []
+    for _ in xrange(repeat):
+        if case.before is not None:
+            case.before()
+        start = time.time()
+        case.fn()
+        timings.append(time.time() - start)
+    timings.sort()
+    middle = median(timings)
+    return {
+        'name': case.name,
+        'rows': case.rows,
+        'repeat': repeat,
+        'min': timings[0],
+        'median': middle,
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'throughput': case.rows / middle if middle else None,
+        'peak_memory_kb': peak_rss_kb() - baseline,
+    }
+
+
+def run_forked(case, repeat):
+    "measure() in a child process, so memory peaks don't leak between cases"
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        try:
+            result = measure(case, repeat)
+        except Exception as e:
+            result = {'name': case.name, 'error': repr(e)}
+        os.write(write, json.dumps(result))
+        os._exit(0)
+    os.close(write)
+    chunks = []
+    while True:
+        chunk = os.read(read, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read)
+    os.waitpid(pid, 0)
+    return json.loads(''.join(chunks))
+
+
+def run(sizes, repeat, pattern=None):
+    ec2.credentials.ACCESS_KEY_ID = 'benchmark'
+    ec2.credentials.SECRET_ACCESS_KEY = 'benchmark'
+    results = []
+    for size in sizes:
+        started = time.time()
+        fleet = Fleet(size)
+        serve(fleet)
+        sys.stderr.write('%d instances generated in %.1fs\n' % (
+            size, time.time() - started))
+        for case in cases(fleet):
+            if pattern and pattern not in case.name:
+                continue
+            result = run_forked(case, repeat)
+            result['size'] = size
+            results.append(result)
+            report(result)
+    return {
+        'version': ec2.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+
+
+def report(result):
+    if 'error' in result:
+        sys.stderr.write('%7d  %-40s  %s\n' % (
+            result['size'], result['name'], result['error']))
+        return
+    sys.stderr.write('%7d  %-40s  %9.3fms  %12.0f rows/s  %8d KB\n' % (
+        result['size'], result['name'], result['median'] * 1000,
+        result['throughput'] or 0, result['peak_memory_kb']))
+
+
+def compare(baseline, current, threshold):
+    """
+    Cases whose median got slower than the baseline by more than the
+    threshold, as (name, size, before, after) tuples
+    """
+    before = dict(((r['name'], r['size']), r) for r in baseline['results']
+                  if 'median' in r)
+    regressions = []
+    for result in current['results']:
+        old = before.get((result['name'], result['size']))
+        if old is None or 'median' not in result:
+            continue
+        if result['median'] > old['median'] * threshold:
+            regressions.append((result['name'], result['size'],
+                                old['median'], result['median']))
+    return regressions
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                      help='comma separated fleet sizes [%default]')
+    parser.add_option('--repeat', type='int', default=5,
+                      help='runs per case [%default]')
+    parser.add_option('--only', metavar='TEXT',
+                      help='only run cases with TEXT in their name')
+    parser.add_option('--output', metavar='FILE',
+                      help='write the results as JSON')
+    parser.add_option('--compare', metavar='FILE',
+                      help='exit with 1 if anything regressed since FILE')
+    parser.add_option('--threshold', type='float', default=1.25,
+                      help='slowdown counted as a regression [%default]')
+    options, _ = parser.parse_args(argv)
+
+    sizes = [int(size) for size in options.sizes.split(',')]
+    results = run(sizes, options.repeat, options.only)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, options.threshold)
+        for name, size, before, after in regressions:
+            sys.stderr.write('REGRESSION %7d  %-40s  %.3fms -> %.3fms\n' % (
+                size, name, before * 1000, after * 1000))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,15 +6,22 @@ ec2
 :license: BSD, see LICENSE for more details.
 """
 
-try:
-    __version__ = __import__('pkg_resources') \
-        .get_distribution('ec2').version
-except Exception:  # pragma: no cover
-    __version__ = 'unknown'
+# Kept here rather than looked up through pkg_resources, which takes
+# longer to import than the rest of the package. setup.py reads it.
+__version__ = '0.4.0'
 
 __author__ = 'Matt Robenolt <matt@ydekproductions.com>'
 __license__ = 'BSD'
-__all__ = ('credentials', 'instances', 'security_groups', 'vpcs')
+__all__ = ('credentials', 'instances', 'security_groups', 'vpcs',
+           'subnets', 'volumes', 'network_interfaces', 'images',
+           'SnapshotStore', 'SharedSnapshotStore', 'Session', 'Refresher',
+           'Throttle')
 
 from .connection import credentials  # noqa
-from .types import instances, security_groups, vpcs  # noqa
+from .types import (instances, security_groups, vpcs, subnets,  # noqa
+                    volumes, network_interfaces, images)
+from .snapshots import SnapshotStore  # noqa
+from .shared import SharedSnapshotStore  # noqa
+from .session import Session  # noqa
+from .refresher import Refresher  # noqa
+from .throttle import Throttle  # noqa
@@ -6,16 +6,97 @@ ec2.base
 :license: BSD, see LICENSE for more details.
 """
 
-from ec2.helpers import make_compare
+import logging
+import threading
+import time
+
+from ec2.columns import ColumnStore
+from ec2.connection import (credentials, get_connection, get_regions,
+                            get_vpc_connection)
+from ec2.futures import Future, Page, submit
+from ec2.helpers import (Plan, in_values, index_tags, interner, tag_map,
+                         wildcard_escape)
+from ec2.indexes import HashIndex, PrefixIndex, TrigramIndex
+from ec2.instrumentation import emit, listeners, timed
+from ec2.query import QuerySet
+from ec2.records import Projector, record_class
+from ec2.shared import MappedRows
+
+logger = logging.getLogger('ec2')
+
+
+class RegionError(Exception):
+    """
+    Raised when a query across several regions failed in some of
+    them. Results from every other region are still available.
+    """
+
+    def __init__(self, errors, results):
+        #: Maps each region that failed to its exception
+        self.errors = errors
+        #: Merged results from the regions that succeeded
+        self.results = results
+        super(RegionError, self).__init__(
+            'Query failed in %s' % ', '.join(sorted(errors)))
+
+
+class Delta(object):
+    "What an incremental refresh() changed in the cache"
+
+    def __init__(self, added, removed, modified, previous=()):
+        #: New objects
+        self.added = added
+        #: Cached objects that no longer exist
+        self.removed = removed
+        #: New copies of objects whose compact_fields or tags changed
+        self.modified = modified
+        #: The copies they replaced, in the same order
+        self.previous = list(previous)
+
+    @property
+    def changed(self):
+        """
+        (old, new) copies of every modified object, such as to spot
+        state transitions or tag changes
+        """
+        return zip(self.previous, self.modified)
+
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.modified)
+
+    def __repr__(self):
+        return '<Delta: %d added, %d removed, %d modified>' % (
+            len(self.added), len(self.removed), len(self.modified))
 
 
 class _EC2MetaClass(type):
     "Metaclass for all EC2 filter type classes"
 
     def __new__(cls, name, bases, attrs):
-        # Append MultipleObjectsReturned and DoesNotExist exceptions
-        for contrib in ('MultipleObjectsReturned', 'DoesNotExist'):
-            attrs[contrib] = type(contrib, (Exception,), {})
+        # Append MultipleObjectsReturned, DoesNotExist and RegionError
+        # exceptions, subclassing the ones from any base class so
+        # region bound copies raise something callers already catch
+        for contrib, default in (('MultipleObjectsReturned', Exception),
+                                 ('DoesNotExist', Exception),
+                                 ('RegionError', RegionError)):
+            parents = tuple(
+                getattr(base, contrib) for base in bases
+                if hasattr(base, contrib)
+            )
+            attrs[contrib] = type(contrib, parents or (default,), {})
+        # Cache bookkeeping is per class, never shared with a base class
+        attrs['_cache'] = None
+        attrs['_indexes'] = {}
+        attrs['_cached_at'] = None
+        attrs['_lock'] = threading.RLock()
+        attrs['_refreshing'] = False
+        attrs['_stats'] = {'hits': 0, 'misses': 0, 'refreshes': 0}
+        attrs['_regions'] = {}
+        attrs['_pending'] = None
+        attrs['_record_type'] = None
+        attrs['_pushdowns'] = 0
+        # Separate from _lock, which is held for the whole of a fetch
+        attrs['_pending_lock'] = threading.Lock()
         return super(_EC2MetaClass, cls).__new__(cls, name, bases, attrs)
 
 
@@ -24,37 +105,773 @@ class objects_base(object):
 
     __metaclass__ = _EC2MetaClass
 
+    #: Which boto connection the API calls go through, 'ec2' or 'vpc'
+    service = 'ec2'
+
+    #: Maps lookup keys to the API's server side filter names. When the
+    #: cache is cold, filter() sends whatever it can as ``filters=`` and
+    #: only fetches the objects that could possibly match.
+    api_filters = {}
+
+    #: Set to False to always fetch and cache everything on filter()
+    pushdown = True
+
+    #: Queries pushed down on a cold cache before the next one fetches
+    #: and caches everything instead, since a type queried over and
+    #: over is cheaper to serve from the cache. None to never stop.
+    pushdown_limit = 2
+
+    #: Number of results to ask for per page in iterator()
+    page_size = 1000
+
+    #: Most values the API takes for a single filter. Longer ``__in``
+    #: lookups are split into chunks, which are fetched in parallel.
+    max_filter_values = 200
+
+    #: Seconds before the cache is considered stale, None to keep it
+    #: forever. Stale results are still served while a single
+    #: background thread fetches fresh ones.
+    ttl = None
+
+    #: Set to True for background refreshes to only fetch what changed,
+    #: see refresh()
+    incremental = False
+
+    #: An optional ec2.snapshots.SnapshotStore, letting new processes
+    #: load recent results from local disk instead of the API
+    snapshots = None
+
+    #: Region to query, None for credentials.REGION_NAME
+    region_name = None
+
+    #: The ec2.Session this type is bound to, see Session.bind(). None
+    #: for the module level types, using ec2.credentials.
+    session = None
+
+    #: Number of regions queried at once when passing ``regions=``
+    max_workers = 8
+
+    #: Set to True to keep compact ec2.records.Record objects holding
+    #: just compact_fields, instead of full boto objects
+    compact = False
+    compact_fields = ('id',)
+
+    #: Maps compact_fields boto objects don't have to functions of the
+    #: boto object computing them
+    derived_fields = {}
+
+    #: Maps relation names to ec2.related.Related, for select_related()
+    related = {}
+
+    #: Set to True to filter the cache through a numpy backed
+    #: ec2.columns.ColumnStore, matching each distinct value once
+    #: instead of every object one by one
+    columnar = False
+
+    #: Keys kept sorted in a PrefixIndex, so startswith, istartswith
+    #: and like lookups beginning with a literal prefix don't scan
+    #: every cached object
+    prefix_indexed = ('name',)
+
+    #: Keys with a TrigramIndex, so contains and icontains lookups
+    #: only check values sharing the searched text's trigrams. They use
+    #: a fair bit of memory, so none are kept by default.
+    substring_indexed = ()
+
     @classmethod
-    def all(cls):
+    def all(cls, regions=None):
         """
         Wrapper around _all() to cache and return all results of something
 
+        Pass a list of region names, or 'all', to query each region
+        concurrently and merge the results.
+
         >>> ec2.instances.all()
         [ ... ]
+        >>> ec2.instances.all(regions=['us-east-1', 'us-west-2'])
+        [ ... ]
+        """
+        if regions is not None:
+            return cls._fan_out(regions, 'all')
+        cache = cls._cache
+        if cache is None:
+            with cls._lock:
+                # Another thread may have filled it while we waited
+                if cls._cache is None:
+                    cls._stats['misses'] += 1
+                    if listeners:
+                        emit('cache_miss', cls)
+                    cls._store(*cls._fetch())
+                return cls._cache
+        cls._stats['hits'] += 1
+        if listeners:
+            emit('cache_hit', cls)
+        if cls.ttl is not None and cls.age() > cls.ttl:
+            cls._refresh_in_background()
+        return cache
+
+    @classmethod
+    def _cached(cls):
+        """
+        The cached results, filling them like all() if needed. A query
+        counts its cache hit once, so this doesn't count another one.
+        """
+        cache = cls._cache
+        if cache is None:
+            return cls.all()
+        return cache
+
+    @classmethod
+    def _fetch(cls, use_snapshot=True):
+        """
+        Return (objects, fetched_at), from the snapshot store when it
+        has a recent enough copy, otherwise from _all()
+        """
+        store = cls.snapshots
+        if store is None:
+            return cls._query(), time.time()
+        with store.lock(cls):
+            snapshot = store.load(cls)
+            # Even when refreshing, a snapshot another process fetched
+            # since this one last did is as good as a new fetch
+            if snapshot is not None and (
+                    use_snapshot or cls._cached_at is None or
+                    snapshot[1] > cls._cached_at):
+                return snapshot
+            objects, fetched_at = cls._query(), time.time()
+            try:
+                store.save(cls, objects, fetched_at)
+            except Exception:
+                logger.exception('Unable to save %s snapshot', cls.__name__)
+        return objects, fetched_at
+
+    @classmethod
+    def _load_snapshot(cls):
+        """
+        Fill a cold cache from the snapshot store, if it has a recent
+        enough snapshot. Returns whether the cache is filled.
         """
-        if not hasattr(cls, '_cache'):
-            cls._cache = cls._all()
-        return cls._cache
+        store = cls.snapshots
+        if store is None:
+            return False
+        with cls._lock:
+            if cls._cache is not None:
+                return True
+            snapshot = store.load(cls)
+            if snapshot is None:
+                return False
+            cls._stats['misses'] += 1
+            if listeners:
+                emit('cache_miss', cls)
+            cls._store(*snapshot)
+        return True
+
+    @classmethod
+    def _query(cls, filters=None):
+        "Call _all(), reporting it to any instrumentation listeners"
+        if not listeners:
+            return cls._all(filters=filters)
+        with timed('fetch', cls, filters=filters) as data:
+            objects = cls._all(filters=filters)
+            data['count'] = len(objects)
+        return objects
 
     @classmethod
-    def get(cls, **kwargs):
+    def _store(cls, objects, fetched_at=None):
+        "Swap in a new snapshot of results"
+        with cls._lock:
+            cls._cache = cls._prepare(objects)
+            cls._indexes = {}
+            cls._cached_at = fetched_at or time.time()
+
+    @classmethod
+    def _prepare(cls, objects):
+        "Index tags, and note which region each object came from"
+        if isinstance(objects, MappedRows):
+            # Already done for each row, as it's read
+            return objects
+        region_name = cls.region_name or cls._credentials()['region_name']
+        project = cls._projector() if cls.compact else None
+        # Lowercased tag names are shared between objects, like the
+        # strings in records
+        intern = project.intern if project is not None else interner()
+        connection = None
+        prepared = []
+        for obj in objects:
+            if project is not None:
+                obj = project(obj)
+            elif hasattr(obj, 'connection'):
+                # Not the pooled connection it was fetched with, which
+                # another thread may be using by now
+                if connection is None:
+                    connection = cls._connection()
+                obj.connection = connection
+            obj.region_name = region_name
+            prepared.append(index_tags(obj, intern))
+        return prepared
+
+    @classmethod
+    def _connection(cls):
+        """
+        The long lived connection cached boto objects are attached to,
+        see ec2.connection.get_connection()
+        """
+        if cls.service == 'vpc':
+            return get_vpc_connection(cls.region_name, cls.session)
+        return get_connection(cls.region_name, cls.session)
+
+    @classmethod
+    def _credentials(cls):
+        "The credentials dict of the session, or ec2.credentials"
+        if cls.session is not None:
+            return cls.session.credentials()
+        return credentials()
+
+    @classmethod
+    def _projector(cls):
+        "A Projector for compact_fields, reusing the Record type"
+        record_type = cls._record_type
+        fields = tuple(cls.compact_fields)
+        if record_type is None or record_type._fields != fields:
+            record_type = record_class(cls, fields)
+            record_type._fields = fields
+            cls._record_type = record_type
+        return Projector(record_type, cls.derived_fields)
+
+    @classmethod
+    def describe(cls, id):
+        """
+        Fetch one full boto object by id straight from the API,
+        bypassing the cache. Also what Record.full() uses.
+
+        >>> ec2.instances.describe('i-abc123')
+        <Instance: ...>
+        """
+        for obj in cls._query(filters={cls.api_filters['id']: id}):
+            if obj.id == id:
+                obj.connection = cls._connection()
+                return index_tags(obj)
+        raise cls.DoesNotExist
+
+    @classmethod
+    def in_region(cls, region_name):
+        """
+        A copy of this type bound to a single region, with its own
+        cache. The copy is created once and reused.
+
+        >>> ec2.instances.in_region('us-west-2').filter(state='running')
+        [ ... ]
+        """
+        with cls._lock:
+            try:
+                return cls._regions[region_name]
+            except KeyError:
+                bound = type(cls)(cls.__name__, (cls,), {
+                    '__doc__': cls.__doc__,
+                    '__module__': cls.__module__,
+                    'region_name': region_name,
+                })
+                cls._regions[region_name] = bound
+                return bound
+
+    @classmethod
+    def _fan_out(cls, regions, method, *args, **kwargs):
+        """
+        Call a method on the region bound copy of this type for every
+        region, on a bounded thread pool, and merge the results.
+        Raises RegionError if any region failed.
+        """
+        from multiprocessing.pool import ThreadPool
+
+        if regions == 'all':
+            regions = get_regions(cls.session)
+        if not regions:
+            return []
+
+        def run(region_name):
+            try:
+                bound = cls.in_region(region_name)
+                # Evaluate lazy results here, not back in the caller
+                return list(getattr(bound, method)(*args, **kwargs)), None
+            except Exception as e:
+                return None, e
+
+        pool = ThreadPool(min(cls.max_workers, len(regions)))
+        try:
+            outcomes = pool.map(run, regions)
+        finally:
+            pool.close()
+            pool.join()
+
+        results, errors = [], {}
+        for region_name, (objects, error) in zip(regions, outcomes):
+            if error is not None:
+                errors[region_name] = error
+            else:
+                results.extend(objects)
+        if errors:
+            raise cls.RegionError(errors, results)
+        return results
+
+    @classmethod
+    def refresh(cls, incremental=False, delta=False):
+        """
+        Fetch everything again and swap it in. Unlike clear(), the old
+        results keep being served until the new ones are ready.
+
+        With incremental=True, only what may have changed since the
+        last fetch is asked for and patched into the cache and its
+        indexes, and a Delta of the changes is returned instead.
+        With delta=True, everything is fetched again, but it's also
+        compared against the cache and a Delta is returned.
+
+        >>> ec2.instances.refresh(incremental=True)
+        <Delta: 2 added, 1 removed, 5 modified>
+        """
+        with timed('refresh', cls, incremental=incremental):
+            if incremental or delta:
+                result = cls._refresh_changes(incremental)
+            else:
+                cls._store(*cls._fetch(use_snapshot=False))
+                result = cls._cache
+        cls._stats['refreshes'] += 1
+        return result
+
+    @classmethod
+    def _refresh_changes(cls, incremental=True):
+        "Fetch and apply the changes since the last fetch, see refresh()"
+        cached, since = cls._cache, cls._cached_at
+        if isinstance(cached, MappedRows):
+            # A shared snapshot can't be patched in place, so the next
+            # generation is fetched in full and swapped in whole
+            objects, fetched_at = cls._fetch_mapped()
+            if isinstance(objects, MappedRows):
+                return cls._swap_mapped(cached, objects, fetched_at)
+            checked = None
+        elif cached is None or not incremental:
+            objects, fetched_at = cls._fetch(use_snapshot=False)
+            checked = None
+        else:
+            fetched_at = time.time()
+            objects, checked = cls._changes(since, cached)
+        objects = cls._prepare(objects)
+
+        with cls._lock:
+            old = cls._cache or []
+            position = dict((obj.id, n) for n, obj in enumerate(old))
+            cache = list(old)
+            seen = set()
+            added, replaced, modified, previous, fresh = [], [], [], [], []
+            for obj in objects:
+                if obj.id in seen:
+                    continue
+                seen.add(obj.id)
+                fresh.append(obj)
+                n = position.get(obj.id)
+                if n is None:
+                    added.append(obj)
+                    cache.append(obj)
+                    continue
+                # Always swap in the new copy, but only report it as
+                # modified when something worth comparing changed
+                replaced.append(old[n])
+                cache[n] = obj
+                if cls._fingerprint(obj) != cls._fingerprint(old[n]):
+                    modified.append(obj)
+                    previous.append(old[n])
+
+            if checked is None:
+                # A complete listing, anything not in it is gone
+                checked = position
+            gone = set(i for i in checked
+                       if i in position and i not in seen)
+            removed = [old[p] for p in sorted(position[i] for i in gone)]
+            if removed:
+                cache = [obj for obj in cache if obj.id not in gone]
+
+            # Readers may still be using the old cache and indexes, so
+            # new ones are built and swapped in together
+            indexes = cls._patched_indexes(cache, removed + replaced, fresh)
+            cls._indexes = indexes
+            cls._cache = cache
+            cls._cached_at = fetched_at
+        return Delta(added, removed, modified, previous)
+
+    @classmethod
+    def _fetch_mapped(cls):
+        """
+        _fetch() a new generation of a shared snapshot, as MappedRows
+        like every other process using it gets, unless saving it failed
+        """
+        objects, fetched_at = cls._fetch(use_snapshot=False)
+        store = cls.snapshots
+        if not isinstance(objects, MappedRows) and store is not None:
+            snapshot = store.load(cls)
+            if snapshot is not None and \
+                    isinstance(snapshot[0], MappedRows):
+                return snapshot
+        return objects, fetched_at
+
+    @classmethod
+    def _swap_mapped(cls, old, new, fetched_at):
+        """
+        Swap in a new generation of a shared snapshot, returning the
+        Delta from the old one. Rows are compared as they are mapped,
+        and only the ones that changed are turned into records.
+        """
+        before = old.fingerprints()
+        position = dict((id, (n, fingerprint))
+                        for n, (id, fingerprint) in enumerate(before))
+        seen = set()
+        added, modified, previous = [], [], []
+        for n, (id, fingerprint) in enumerate(new.fingerprints()):
+            seen.add(id)
+            if id not in position:
+                added.append(new[n])
+                continue
+            row, old_fingerprint = position[id]
+            if fingerprint != old_fingerprint:
+                modified.append(new[n])
+                previous.append(old[row])
+        removed = [old[n] for n, (id, _) in enumerate(before)
+                   if id not in seen]
+        with cls._lock:
+            cls._cache = new
+            cls._indexes = {}
+            cls._cached_at = fetched_at
+        return Delta(added, removed, modified, previous)
+
+    @classmethod
+    def _patched_indexes(cls, cache, removed, added):
+        """
+        New copies of every index that can be patched for a refresh,
+        leaving out the rest to be rebuilt on their next use. The
+        current indexes are never changed.
+        """
+        if not removed and not added:
+            return cls._indexes
+        position = dict((id(obj), n) for n, obj in enumerate(cache))
+        indexes = {}
+        for key, index in cls._indexes.items():
+            patched = getattr(index, 'patched', None)
+            if patched is None:
+                continue
+            try:
+                indexes[key] = patched(removed, added, position)
+            except (TypeError, AttributeError):
+                # The new objects can't be indexed by this key
+                continue
+        return indexes
+
+    @classmethod
+    def _changes(cls, since, cached):
+        """
+        Return (objects, ids) for an incremental refresh: new copies of
+        anything that may have changed since the given time, and the
+        ids that were checked, so any of them missing from objects no
+        longer exist. ids is None when objects is a complete listing.
+
+        Types without a cheaper way to find changes list everything,
+        which still patches the indexes instead of rebuilding them.
+        """
+        return cls._query(), None
+
+    @classmethod
+    def _fingerprint(cls, obj):
+        "What is compared to tell whether an object was modified"
+        fields = [getattr(obj, f, None) for f in cls.compact_fields]
+        return fields, tag_map(obj)
+
+    @classmethod
+    def _refresh_in_background(cls):
+        with cls._lock:
+            if cls._refreshing:
+                return
+            cls._refreshing = True
+        thread = threading.Thread(target=cls._background_refresh)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def _background_refresh(cls):
+        try:
+            cls.refresh(incremental=cls.incremental)
+        except Exception:
+            logger.exception('Unable to refresh %s', cls.__name__)
+        finally:
+            cls._refreshing = False
+
+    @classmethod
+    def age(cls):
+        "Seconds since the cache was filled, or None if it's empty"
+        if cls._cached_at is None:
+            return None
+        return time.time() - cls._cached_at
+
+    @classmethod
+    def stats(cls):
+        """
+        Cache hit, miss and refresh counters, plus the current age
+
+        >>> ec2.instances.stats()
+        {'hits': 10, 'misses': 1, 'refreshes': 0, 'age': 12.5}
+        """
+        stats = dict(cls._stats)
+        stats['age'] = cls.age()
+        return stats
+
+    @classmethod
+    def index(cls, key, fold=False):
+        """
+        Lazily build a HashIndex of the cached results keyed by an
+        attribute or tag, optionally case folded for iexact lookups.
+        Returns None if the values can't be indexed.
+
+        >>> ec2.instances.index('name').get('production-web-01')
+        [<Instance: ...>]
+        """
+        return cls._built(
+            (key, fold), lambda objects: HashIndex.build(objects, key, fold))
+
+    @classmethod
+    def prefix_index(cls, key, fold=False):
+        """
+        Lazily build a PrefixIndex of the cached results keyed by an
+        attribute or tag, with fold=True for istartswith lookups.
+        Returns None if the values can't be indexed.
+
+        >>> ec2.instances.prefix_index('name').get('production-web-')
+        [<Instance: ...>, <Instance: ...>]
+        """
+        return cls._built(
+            ('prefix', key, fold),
+            lambda objects: PrefixIndex.build(objects, key, fold))
+
+    @classmethod
+    def substring_index(cls, key, fold=False):
+        """
+        Lazily build a TrigramIndex of the cached results keyed by an
+        attribute or tag, with fold=True for icontains lookups.
+        Returns None if the values can't be indexed.
+
+        >>> ec2.instances.substring_index('name', fold=True).get('web')
+        [<Instance: ...>, <Instance: ...>]
+        """
+        return cls._built(
+            ('substring', key, fold),
+            lambda objects: TrigramIndex.build(objects, key, fold))
+
+    @classmethod
+    def _built(cls, name, build):
+        "Whatever build() returns for the cached results, built once"
+        objects = cls._cached()
+        try:
+            return cls._indexes[name]
+        except KeyError:
+            index = build(objects)
+            with cls._lock:
+                # Don't attach it to a snapshot that was swapped out
+                if cls._cache is objects:
+                    cls._indexes[name] = index
+            return index
+
+    @classmethod
+    def _api_filters(cls, plans):
+        """
+        Translate the lookups the API can answer natively into its
+        ``filters=`` parameter. Anything that isn't translated is
+        still applied locally, so the server only needs to return
+        a superset of the real results. Values are escaped, as the API
+        treats *, ? and \\ in them as wildcards and escapes.
+        """
+        filters = {}
+        for plan in plans:
+            for lookup in plan.lookups:
+                name = cls.api_filters.get(lookup.key)
+                if name is None or name in filters:
+                    # Repeating a filter name would OR the values
+                    continue
+                if lookup.comparison == 'in':
+                    values = in_values(lookup.value)
+                    if values and all(isinstance(v, basestring)
+                                      for v in values):
+                        # Several values for one filter are ORed
+                        filters[name] = [wildcard_escape(v) for v in values]
+                    continue
+                if not isinstance(lookup.value, basestring):
+                    continue
+                if lookup.comparison == 'exact':
+                    filters[name] = wildcard_escape(lookup.value)
+                elif lookup.comparison == 'startswith':
+                    filters[name] = wildcard_escape(lookup.value) + '*'
+        return filters
+
+    @classmethod
+    def _query_chunked(cls, filters):
+        """
+        _query(), splitting the filter with the most values into chunks
+        of max_filter_values, which are fetched in parallel
+        """
+        from multiprocessing.pool import ThreadPool
+
+        size = cls.max_filter_values
+        name = max(filters, key=lambda name: (
+            len(filters[name]) if isinstance(filters[name], list) else 0))
+        values = filters[name]
+        if not isinstance(values, list) or len(values) <= size:
+            return cls._query(filters=filters)
+
+        chunks = []
+        for n in xrange(0, len(values), size):
+            chunk = dict(filters)
+            chunk[name] = values[n:n + size]
+            chunks.append(chunk)
+        pool = ThreadPool(min(cls.max_workers, len(chunks)))
+        try:
+            pages = pool.map(lambda chunk: cls._query(filters=chunk), chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+        # An object can match values in more than one chunk
+        seen = set()
+        objects = []
+        for page in pages:
+            for obj in page:
+                if obj.id not in seen:
+                    seen.add(obj.id)
+                    objects.append(obj)
+        return objects
+
+    @classmethod
+    def _candidates(cls, plans):
+        """
+        Narrow down the cached results using an index for the first
+        exact, iexact or in lookup that can use one, then for the first
+        prefix or substring lookup that can. With columnar enabled,
+        every lookup goes to the column store instead. The plans still
+        need to be applied to whatever is returned.
+
+        Results loaded from a SharedSnapshotStore are filtered against
+        the mapped snapshot instead.
+        """
+        objects = cls._cached()
+        if isinstance(objects, MappedRows):
+            return objects.filter(
+                [lookup for plan in plans for lookup in plan.lookups])
+        if cls.columnar:
+            return cls._columnar(plans)[0]
+        for plan in plans:
+            for lookup in plan.lookups:
+                if lookup.comparison not in HashIndex.comparisons:
+                    continue
+                fold = lookup.comparison == 'iexact'
+                index = cls.index(lookup.key, fold)
+                if index is None:
+                    continue
+                try:
+                    if lookup.comparison == 'in':
+                        return index.get_many(in_values(lookup.value))
+                    return index.get(lookup.value)
+                except TypeError:
+                    # Unhashable value, so scan instead
+                    continue
+        for plan in plans:
+            for lookup in plan.lookups:
+                narrowed = cls._narrowed(lookup)
+                if narrowed is not None:
+                    return narrowed
+        return objects
+
+    @classmethod
+    def _columnar(cls, plans):
+        """
+        Filter the cached results with the column store, returning
+        the matches and the plans still left to apply to them, which
+        only has the lookups that couldn't be vectorized
+        """
+        objects, remaining = cls.columns().split(
+            [lookup for plan in plans for lookup in plan.lookups])
+        if not remaining:
+            return objects, ()
+        plan = Plan()
+        plan.lookups = remaining
+        return objects, (plan,)
+
+    @classmethod
+    def _narrowed(cls, lookup):
+        """
+        Candidates for a lookup from a prefix or substring index, or
+        None if neither can answer it
+        """
+        if lookup.key in cls.prefix_indexed:
+            prefix = PrefixIndex.prefix_for(lookup)
+            if prefix is not None:
+                fold = lookup.comparison == 'istartswith'
+                index = cls.prefix_index(lookup.key, fold)
+                if index is not None:
+                    try:
+                        return index.get(prefix)
+                    except (TypeError, UnicodeError):
+                        # Can't be compared with the values, so scan
+                        pass
+        if lookup.key in cls.substring_indexed and \
+                lookup.comparison in TrigramIndex.comparisons and \
+                isinstance(lookup.value, basestring):
+            fold = lookup.comparison == 'icontains'
+            index = cls.substring_index(lookup.key, fold)
+            if index is not None:
+                try:
+                    return index.get(lookup.value)
+                except (TypeError, UnicodeError):
+                    pass
+        return None
+
+    @classmethod
+    def columns(cls):
+        "The ColumnStore for the cached results, built on first use"
+        return cls._built('columns', ColumnStore)
+
+    @classmethod
+    def get(cls, *plans, **kwargs):
         """
         Generic get() for one item only
 
         >>> ec2.instances.get(name='production-web-01')
         <Instance: ...>
         """
-        things = cls.filter(**kwargs)
-        if len(things) > 1:
-            # Raise an exception if more than one object is matched
-            raise cls.MultipleObjectsReturned
-        elif len(things) == 0:
-            # Rase an exception if no objects were matched
-            raise cls.DoesNotExist
-        return things[0]
+        return cls.filter(*plans, **kwargs).get()
+
+    @classmethod
+    def in_bulk(cls, ids):
+        """
+        Map each of the given ids to its object, leaving out any that
+        don't exist. Uses the id index once results are cached,
+        otherwise only those ids are fetched, in parallel chunks.
+
+        >>> ec2.instances.in_bulk(['i-abc123', 'i-def456'])
+        {'i-abc123': <Instance: ...>, 'i-def456': <Instance: ...>}
+        """
+        ids = list(ids)
+        if not ids:
+            return {}
+        return dict((obj.id, obj) for obj in cls.filter(id__in=ids))
 
     @classmethod
-    def filter(cls, **kwargs):
+    def compile(cls, **kwargs):
+        """
+        Parse filter() kwargs once into a reusable Plan. Lookups are
+        split, values lowercased and regular expressions compiled
+        up front, so the plan can be passed to filter() repeatedly.
+
+        >>> plan = ec2.instances.compile(name__startswith='production')
+        >>> ec2.instances.filter(plan)
+        [ ... ]
+        """
+        return Plan(**kwargs)
+
+    @classmethod
+    def filter(cls, *plans, **kwargs):
         """
         The meat. Filtering using Django model style syntax.
 
@@ -74,19 +891,235 @@ class objects_base(object):
             endswith: check if attribute value ends with the string
             iendswith: case insensitive startswith
             isnull: check if the attribute does not exist
+            in: check if attribute value is one of a list of values
+
+        Precompiled plans from compile() may also be passed positionally,
+        and ``regions=`` works the same as it does for all().
+
+        Returns a lazy ec2.query.QuerySet, which can be chained further.
 
         >>> ec2.instances.filter(name__startswith='production')
         [ ... ]
         """
-        qs = cls.all()
-        for key in kwargs:
-            qs = filter(lambda i: make_compare(key, kwargs[key], i), qs)
-        return qs
+        return QuerySet(cls).filter(*plans, **kwargs)
 
     @classmethod
-    def clear(cls):
-        "Clear the cached instances"
+    def select_related(cls, *names):
+        """
+        A QuerySet of everything, with related objects attached, see
+        QuerySet.select_related()
+
+        >>> ec2.instances.select_related('vpc', 'volumes')
+        [ ... ]
+        """
+        return QuerySet(cls).select_related(*names)
+
+    @classmethod
+    def _select_related(cls, objects, names):
+        """
+        Attach related objects to each of the given objects, with one
+        bulk query per relation and region
+        """
+        regions = {}
+        for obj in objects:
+            region_name = getattr(obj, 'region_name', None)
+            regions.setdefault(region_name, []).append(obj)
+        for name in names:
+            relation = cls.related[name]
+            for region_name, grouped in regions.iteritems():
+                relation.prefetch(cls, grouped, name, region_name)
+
+    @classmethod
+    def exclude(cls, *plans, **kwargs):
+        """
+        The opposite of filter(), everything except what matches
+
+        >>> ec2.instances.exclude(state='terminated')
+        [ ... ]
+        """
+        return QuerySet(cls).exclude(*plans, **kwargs)
+
+    @classmethod
+    def _source(cls, plans):
+        """
+        Objects that could match the plans, and the plans they still
+        need to be checked against. From the API when the cache is cold
+        and the plans can be pushed down, otherwise from the cache,
+        narrowed by an index or filtered by the column store. After
+        pushdown_limit queries, the cache is filled instead. A usable
+        snapshot fills the cache too, rather than calling the API.
+
+        Each query counts one cache hit or miss.
+        """
+        loaded = False
+        if cls.pushdown and cls._cache is None and (
+                cls.pushdown_limit is None or
+                cls._pushdowns < cls.pushdown_limit):
+            # Counted as a miss when it fills the cache
+            loaded = cls._load_snapshot()
+            filters = None if loaded else cls._api_filters(plans)
+            if filters:
+                # Cold cache, so only ask for what could match
+                cls._pushdowns += 1
+                return cls._prepare(cls._query_chunked(filters)), plans
+        objects = cls._cached() if loaded else cls.all()
+        if cls.columnar and not isinstance(objects, MappedRows):
+            return cls._columnar(plans)
+        return cls._candidates(plans), plans
+
+    @classmethod
+    def iterator(cls, *plans, **kwargs):
+        """
+        Stream matching results page by page, straight from the API.
+        Nothing is read from or stored in the cache, so memory stays
+        bounded by the page size.
+
+        >>> for instance in ec2.instances.iterator(state='running'):
+        ...     print instance.id
+        """
+        for page in cls._filtered_pages(plans, kwargs):
+            for obj in page:
+                yield obj
+
+    @classmethod
+    def _filtered_pages(cls, plans, kwargs):
+        "Matching results from each page, see iterator()"
+        if kwargs:
+            plans += (Plan(**kwargs),)
+        filters = cls._api_filters(plans) if cls.pushdown else {}
+        # Too many values to send, and pages can't be fetched in chunks
+        for name, values in filters.items():
+            if isinstance(values, list) and \
+                    len(values) > cls.max_filter_values:
+                del filters[name]
+        for page in cls._pages(filters=filters or None):
+            matches = []
+            for obj in cls._prepare(page):
+                for plan in plans:
+                    if not plan(obj):
+                        break
+                else:
+                    matches.append(obj)
+            yield matches
+
+    @classmethod
+    def _pages(cls, filters=None):
+        """
+        Yield results one page at a time. Types whose API doesn't
+        paginate return everything as a single page.
+        """
+        yield cls._query(filters=filters)
+
+    @classmethod
+    def aall(cls, regions=None):
+        """
+        Non blocking all(), returning an ec2.futures.Future. Concurrent
+        calls while the cache is being filled all share one fetch.
+
+        >>> ec2.instances.aall().add_done_callback(callback)
+        """
+        if regions is not None:
+            return submit(cls.all, regions=regions)
+        if cls._cache is not None:
+            return Future.completed(cls.all())
+        with cls._pending_lock:
+            if cls._pending is None:
+                cls._pending = submit(cls._fill)
+            return cls._pending
+
+    @classmethod
+    def _fill(cls):
         try:
-            del cls._cache
-        except AttributeError:
-            pass
+            return cls.all()
+        finally:
+            cls._pending = None
+
+    @classmethod
+    def afilter(cls, *plans, **kwargs):
+        """
+        Non blocking filter(), returning an ec2.futures.Future. It
+        waits on the same shared fetch as aall(), then filters the
+        cached results exactly like filter() does, on the thread pool.
+
+        >>> ec2.instances.afilter(state='running').result()
+        [ ... ]
+        """
+        if 'regions' in kwargs:
+            return submit(cls.filter, *plans, **kwargs)
+        if kwargs:
+            # Bad lookups are raised right away, not from the future
+            plans += (Plan(**kwargs),)
+
+        def evaluate():
+            qs = cls.filter(*plans)
+            qs._fetch_all()
+            return qs
+        return cls._once_filled(evaluate)
+
+    @classmethod
+    def aget(cls, *plans, **kwargs):
+        """
+        Non blocking get(), returning an ec2.futures.Future which
+        raises DoesNotExist or MultipleObjectsReturned from result()
+        """
+        if 'regions' in kwargs:
+            return submit(cls.get, *plans, **kwargs)
+        if kwargs:
+            plans += (Plan(**kwargs),)
+        return cls._once_filled(lambda: cls.get(*plans))
+
+    @classmethod
+    def _once_filled(cls, fn):
+        """
+        A Future for fn(), run on the thread pool once the cache is
+        filled, so not even a warm cache is filtered in the caller's
+        thread
+        """
+        if cls._cache is not None:
+            return submit(fn)
+        return cls.aall().then(lambda objects: fn())
+
+    @classmethod
+    def aiterator(cls, *plans, **kwargs):
+        """
+        Non blocking iterator(), returning a Future for the first
+        ec2.futures.Page of matching results. Each page's ``next`` is
+        a future for the following page, which is only fetched once
+        ``next`` is read. Reading it before handling the current page
+        fetches the following one meanwhile, never more than one page
+        ahead. Futures hold None past the last page.
+
+        >>> page = ec2.instances.aiterator(state='running').result()
+        >>> while page is not None:
+        ...     following = page.next
+        ...     handle(page.objects)
+        ...     page = following.result()
+        """
+        pages = cls._filtered_pages(plans, kwargs)
+
+        def fetch():
+            try:
+                objects = next(pages)
+            except StopIteration:
+                return None
+            return Page(objects, fetch)
+
+        return submit(fetch)
+
+    @classmethod
+    def clear(cls):
+        """
+        Clear the cached instances, including any snapshot on disk
+        and the caches of every region bound copy
+        """
+        for bound in cls._regions.values():
+            bound.clear()
+        if cls.snapshots is not None:
+            cls.snapshots.delete(cls)
+        with cls._lock:
+            cls._cache = None
+            cls._indexes = {}
+            cls._cached_at = None
+            cls._pushdowns = 0
+        if listeners:
+            emit('cache_clear', cls)
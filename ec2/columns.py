@@ -0,0 +1,149 @@
+"""
+ec2.columns
+~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+from ec2.helpers import tag_map
+
+#: numpy, once a ColumnStore has imported it. It's slow to import and
+#: only needed when columnar filtering is turned on.
+numpy = None
+
+# Per distinct value results, FALLBACK meaning "check the tag instead",
+# which is what a Lookup does when the attribute is missing or its
+# comparison raises AttributeError (such as None.lower())
+FALSE, TRUE, FALLBACK = 0, 1, 2
+
+
+class Column(object):
+    """
+    One attribute (or tag) across every object in a snapshot,
+    dictionary encoded. Attribute values and tag values are kept apart,
+    because some comparisons treat them differently.
+    """
+
+    def __init__(self, objects, key):
+        self.key = key
+        self.attr_values, self.attr_codes = [], {}
+        self.tag_values, self.tag_codes = [], {}
+        attrs = numpy.empty(len(objects), dtype=numpy.int32)
+        tags = numpy.empty(len(objects), dtype=numpy.int32)
+        for row, obj in enumerate(objects):
+            try:
+                value = getattr(obj, key)
+            except AttributeError:
+                attrs[row] = -1
+            else:
+                # Raises TypeError for unhashable values
+                attrs[row] = self._encode(
+                    value, self.attr_values, self.attr_codes)
+            tag = tag_map(obj)
+            if key in tag:
+                tags[row] = self._encode(
+                    tag[key], self.tag_values, self.tag_codes)
+            else:
+                tags[row] = -1
+        self.attrs = attrs
+        self.tags = tags
+
+    @staticmethod
+    def _encode(value, values, codes):
+        try:
+            return codes[value]
+        except KeyError:
+            codes[value] = code = len(values)
+            values.append(value)
+            return code
+
+    def mask(self, lookup):
+        "A boolean array of the rows matching a Lookup"
+        # One extra slot at the end of each table, for code -1
+        attr_table = numpy.full(len(self.attr_values) + 1, FALLBACK,
+                                dtype=numpy.int8)
+        if lookup.comparison == 'exact':
+            # Equality never raises, so it's just a code comparison
+            attr_table[:-1] = FALSE
+            try:
+                code = self.attr_codes.get(lookup.value)
+            except TypeError:
+                code = None
+            if code is not None:
+                attr_table[code] = TRUE
+        else:
+            for code, value in enumerate(self.attr_values):
+                try:
+                    attr_table[code] = bool(lookup.attr_test(value))
+                except AttributeError:
+                    pass
+
+        tag_table = numpy.empty(len(self.tag_values) + 1, dtype=numpy.bool_)
+        tag_table[-1] = bool(lookup.missing)
+        for code, value in enumerate(self.tag_values):
+            tag_table[code] = bool(lookup.tag_test(value))
+
+        result = attr_table[self.attrs]
+        fallback = result == FALLBACK
+        if fallback.any():
+            result[fallback] = tag_table[self.tags[fallback]]
+        return result.astype(numpy.bool_)
+
+
+class ColumnStore(object):
+    """
+    A columnar view of a snapshot, evaluating lookups as vectorized
+    masks. Each comparison runs once per distinct value rather than
+    once per object, and only the matching objects are materialized.
+
+    Requires numpy.
+    """
+
+    def __init__(self, objects):
+        global numpy
+        if numpy is None:
+            try:
+                import numpy
+            except ImportError:
+                raise ImportError('numpy is required for columnar filtering')
+        self.objects = objects
+        self._columns = {}
+
+    def column(self, key):
+        "The Column for a key, built on first use, or None"
+        try:
+            return self._columns[key]
+        except KeyError:
+            try:
+                column = Column(self.objects, key)
+            except TypeError:
+                # Unhashable values, can't be encoded
+                column = None
+            self._columns[key] = column
+            return column
+
+    def filter(self, lookups):
+        """
+        Objects matching every lookup that can be vectorized. Any
+        lookups that can't be still need to be checked by the caller.
+        """
+        return self.split(lookups)[0]
+
+    def split(self, lookups):
+        """
+        Like filter(), also returning the lookups that couldn't be
+        vectorized, which are the only ones left to check
+        """
+        mask, remaining = None, []
+        for lookup in lookups:
+            column = self.column(lookup.key)
+            if column is None:
+                remaining.append(lookup)
+                continue
+            matches = column.mask(lookup)
+            mask = matches if mask is None else mask & matches
+        if mask is None:
+            return self.objects, remaining
+        objects = self.objects
+        return [objects[row] for row in numpy.flatnonzero(mask)], remaining
@@ -7,26 +7,235 @@ ec2.connection
 """
 
 import os
-import boto.ec2
-import boto.vpc
+import threading
+import time
+import weakref
+from contextlib import contextmanager
 
-_connection = None
-_vpc_connection = None
+# boto is only imported once a connection is needed, since importing it
+# takes longer than everything else in this package put together
 
+_regions = None
 
-def get_connection():
-    "Cache a global connection object to be used by all classes"
-    global _connection
-    if _connection is None:
-        _connection = boto.ec2.connect_to_region(**credentials())
-    return _connection
+# The pool each checked out connection came from, so release_connection()
+# hands it back to a session's pool rather than the global one
+_owners = weakref.WeakKeyDictionary()
+_owners_lock = threading.Lock()
 
+# Long lived connections from get_connection(), never pooled, keyed
+# like the pool
+_connections = {}
+_connections_lock = threading.Lock()
 
-def get_vpc_connection():
-    global _vpc_connection
-    if _vpc_connection is None:
-        _vpc_connection = boto.vpc.connect_to_region(**credentials())
-    return _vpc_connection
+
+def _params(region_name, creds=None):
+    params = dict(**(creds or credentials()))
+    if region_name is not None:
+        params['region_name'] = region_name
+    return params
+
+
+def _key(service, params):
+    return (service, params['region_name'],
+            params['aws_access_key_id'], params['aws_secret_access_key'])
+
+
+class ConnectionPool(object):
+    """
+    Thread safe pool of boto connections, keyed by service, region and
+    credentials. A connection is only ever used by whoever acquired it,
+    until it's released back to the pool for the next caller.
+
+    size: idle connections kept around for each key
+    max_idle: seconds an idle connection is kept before it's closed
+    health_check: optional callable, given an idle connection before it
+        is handed out again, returning False to throw it away
+    """
+
+    connectors = {
+        'ec2': lambda **params: _connect_ec2(**params),
+        'vpc': lambda **params: _connect_vpc(**params),
+    }
+
+    def __init__(self, size=10, max_idle=60, health_check=None):
+        self.size = size
+        self.max_idle = max_idle
+        self.health_check = health_check
+        self._idle = {}
+        self._keys = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def acquire(self, service='ec2', region_name=None, creds=None):
+        """
+        Check out a connection, reusing an idle one when possible.
+        creds is a dict like credentials(), by default credentials().
+        """
+        params = _params(region_name, creds)
+        key = _key(service, params)
+        connection = None
+        while connection is None:
+            with self._lock:
+                idle = self._evict(key)
+                connection = idle.pop()[1] if idle else None
+            if connection is None:
+                connection = self.connectors[service](**params)
+            elif self.health_check and not self.health_check(connection):
+                _close(connection)
+                connection = None
+        with self._lock:
+            self._keys[connection] = key
+        with _owners_lock:
+            _owners[connection] = self
+        return connection
+
+    def release(self, connection, discard=False):
+        """
+        Return a connection to the pool. Discarded connections, and
+        ones beyond the pool size, are closed instead.
+        """
+        with self._lock:
+            key = self._keys.pop(connection, None)
+            if key is None:
+                # Not one of ours
+                return
+            idle = self._evict(key)
+            if not discard and len(idle) < self.size:
+                idle.append((time.time(), connection))
+                return
+        _close(connection)
+
+    def _evict(self, key):
+        "Idle connections for a key, after closing any that sat too long"
+        idle = self._idle.setdefault(key, [])
+        cutoff = time.time() - self.max_idle
+        while idle and idle[0][0] < cutoff:
+            _close(idle.pop(0)[1])
+        return idle
+
+    def clear(self):
+        "Close every idle connection"
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for _, connection in connections:
+                _close(connection)
+
+
+def _connect_ec2(**params):
+    import boto.ec2
+    return boto.ec2.connect_to_region(**params)
+
+
+def _connect_vpc(**params):
+    import boto.vpc
+    return boto.vpc.connect_to_region(**params)
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+#: The pool used by acquire_connection() and acquire_vpc_connection()
+pool = ConnectionPool()
+
+
+def acquire_connection(region_name=None, session=None):
+    """
+    Check out an EC2 connection from the global pool, for the given
+    region or credentials.REGION_NAME. Hand it back with
+    release_connection(), or use it through leased().
+
+    With an ec2.Session, it comes from the session's own pool and
+    uses the session's credentials instead.
+    """
+    return _acquire('ec2', region_name, session)
+
+
+def acquire_vpc_connection(region_name=None, session=None):
+    "Check out a VPC connection from the global or a session's pool"
+    return _acquire('vpc', region_name, session)
+
+
+def _acquire(service, region_name, session):
+    if session is None:
+        return pool.acquire(service, region_name)
+    return session.pool.acquire(service, region_name, session.credentials())
+
+
+def get_connection(region_name=None, session=None):
+    """
+    One long lived EC2 connection per region and credentials, created
+    on first use and shared by every caller, as before connections
+    were pooled. Cached boto objects are attached to it too, so
+    calls like instance.update() work without holding a pooled one.
+
+    Threads calling through it share it, so anything wanting its
+    own connection should use acquire_connection() instead.
+    """
+    return _shared('ec2', region_name, session)
+
+
+def get_vpc_connection(region_name=None, session=None):
+    "One long lived VPC connection, see get_connection()"
+    return _shared('vpc', region_name, session)
+
+
+def _shared(service, region_name, session):
+    if session is None:
+        params, owner = _params(region_name), pool
+    else:
+        params = _params(region_name, session.credentials())
+        owner = session.pool
+    key = _key(service, params)
+    try:
+        return _connections[key]
+    except KeyError:
+        with _connections_lock:
+            if key not in _connections:
+                _connections[key] = owner.connectors[service](**params)
+            return _connections[key]
+
+
+def release_connection(connection, discard=False):
+    "Return a connection from acquire_connection() to its pool"
+    with _owners_lock:
+        owner = _owners.pop(connection, pool)
+    owner.release(connection, discard)
+
+
+@contextmanager
+def leased(connection):
+    """
+    Release a connection when the block finishes. Errors from AWS
+    itself leave the connection usable, anything else discards it.
+
+    >>> with leased(acquire_connection()) as connection:
+    ...     connection.get_all_instances()
+    """
+    from boto.exception import BotoServerError
+    healthy = False
+    try:
+        yield connection
+        healthy = True
+    except (BotoServerError, GeneratorExit):
+        healthy = True
+        raise
+    finally:
+        release_connection(connection, discard=not healthy)
+
+
+def get_regions(session=None):
+    "Names of every region enabled for the account, fetched once"
+    global _regions
+    if session is not None:
+        return session.regions()
+    if _regions is None:
+        with leased(acquire_connection()) as connection:
+            _regions = [r.name for r in connection.get_all_regions()]
+    return _regions
 
 
 class credentials(object):
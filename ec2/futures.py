@@ -0,0 +1,145 @@
+"""
+ec2.futures
+~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import sys
+import threading
+
+_pool = None
+_pool_lock = threading.Lock()
+
+#: Threads shared by every non blocking query
+max_workers = 8
+
+
+class Future(object):
+    """
+    The result of a query running in the background.
+
+    Callbacks added with add_done_callback() run in the thread that
+    completes the future, or immediately if it's already done, which
+    makes it easy to hand results over to an event loop.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+
+    @classmethod
+    def completed(cls, result):
+        "A future that already holds its result"
+        future = cls()
+        future.set_result(result)
+        return future
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        "Wait for the result, raising whatever the query raised"
+        self._done.wait(timeout)
+        if not self.done():
+            raise TimeoutError
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        "Wait for the query, returning its exception or None"
+        try:
+            self.result(timeout)
+        except TimeoutError:
+            raise
+        except Exception as e:
+            return e
+        return None
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        "Fail the future with a sys.exc_info() tuple"
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def then(self, fn):
+        "A new future, for fn() applied to this one's result"
+        future = Future()
+
+        def chain(done):
+            try:
+                future.set_result(fn(done.result()))
+            except Exception:
+                future.set_exception(sys.exc_info())
+        self.add_done_callback(chain)
+        return future
+
+
+class TimeoutError(Exception):
+    "Raised when a future's result isn't ready in time"
+
+
+class Page(object):
+    """
+    A page of results from a non blocking iterator. ``next`` is a
+    future for the following Page, which holds None past the end.
+    The following page is only fetched once ``next`` is read, so at
+    most one page is ever fetched ahead of the caller.
+    """
+
+    def __init__(self, objects, fetch_next):
+        self.objects = objects
+        self._fetch_next = fetch_next
+        self._next = None
+        self._lock = threading.Lock()
+
+    @property
+    def next(self):
+        "Future for the following Page, submitted the first time it's read"
+        with self._lock:
+            if self._next is None:
+                self._next = submit(self._fetch_next)
+            return self._next
+
+    def __iter__(self):
+        return iter(self.objects)
+
+
+def submit(fn, *args, **kwargs):
+    "Run fn on the shared thread pool, returning a Future"
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from multiprocessing.pool import ThreadPool
+            _pool = ThreadPool(max_workers)
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception:
+            future.set_exception(sys.exc_info())
+    _pool.apply_async(run)
+    return future
@@ -11,162 +11,337 @@ import re
 
 def make_compare(key, value, obj):
     "Map a key name to a specific comparison function"
-    if '__' not in key:
-        # If no __ exists, default to doing an "exact" comparison
-        key, comp = key, 'exact'
-    else:
-        key, comp = key.rsplit('__', 1)
+    key, comp = split_lookup(key)
     # Check if comp is valid
     if hasattr(Compare, comp):
         return getattr(Compare, comp)(key, value, obj)
     raise AttributeError("No comparison '%s'" % comp)
 
 
-class Compare(object):
-    "Private class, namespacing comparison functions."
+def split_lookup(key):
+    "Split a filter key such as ``name__startswith`` into (key, comparison)"
+    if '__' not in key:
+        # If no __ exists, default to doing an "exact" comparison
+        return key, 'exact'
+    return tuple(key.rsplit('__', 1))
 
-    @staticmethod
-    def exact(key, value, obj):
+
+def wildcard_escape(value):
+    "Escape a value for use in an EC2 API filter, which supports * and ?"
+    return re.sub(r'([\\*?])', r'\\\1', value)
+
+
+def build_tag_map(obj, intern=None):
+    """
+    Return obj's tags keyed by their lowercased name, passing each
+    name through intern() if given
+    """
+    tags = {}
+    for tag, value in (getattr(obj, 'tags', None) or {}).iteritems():
+        tag = tag.lower()
+        if intern is not None:
+            tag = intern(tag)
+        # The first tag wins if two only differ by case
+        tags.setdefault(tag, value)
+    return tags
+
+
+def index_tags(obj, intern=None):
+    """
+    Attach a lowercased tag map to obj, so tag lookups against it
+    are a single dict access instead of a scan over every tag.
+    Pass an interner() to share the lowercased names between objects.
+    """
+    obj._tag_map = build_tag_map(obj, intern)
+    return obj
+
+
+def interner():
+    "A function returning one shared copy of each equal string it's given"
+    strings = {}
+    return lambda value: strings.setdefault(value, value)
+
+
+def tag_map(obj):
+    "Lowercased tags for obj, using the map attached by index_tags()"
+    try:
+        return obj._tag_map
+    except AttributeError:
+        return build_tag_map(obj)
+
+
+def resolve(obj, key, default=None):
+    "Value of an attribute on obj, falling back to the tag with that name"
+    try:
+        return getattr(obj, key)
+    except AttributeError:
+        return tag_map(obj).get(key, default)
+
+
+class Lookup(object):
+    """
+    A single filter lookup, parsed and prepared once.
+
+    The comparison value is normalized up front (lowercased, compiled
+    to a regular expression, etc), so calling the lookup against an
+    object only pays for the attribute access and the comparison.
+
+    >>> Lookup('name__startswith', 'production')(instance)
+    True
+    """
+    __slots__ = ('key', 'comparison', 'value', 'attr_test', 'tag_test',
+                 'missing')
+
+    def __init__(self, key, value, comparison=None):
+        if comparison is None:
+            key, comparison = split_lookup(key)
+        try:
+            prepare = _prepare[comparison]
+        except KeyError:
+            raise AttributeError("No comparison '%s'" % comparison)
+        self.key = key
+        self.comparison = comparison
+        self.value = value
+        self.attr_test, self.tag_test, self.missing = prepare(value)
+
+    def __call__(self, obj):
+        key = self.key
         try:
-            return getattr(obj, key) == value
+            return self.attr_test(getattr(obj, key))
         except AttributeError:
             # Fall back to checking tags
-            if hasattr(obj, 'tags'):
-                for tag in obj.tags:
-                    if key == tag.lower():
-                        return obj.tags[tag] == value
+            tags = tag_map(obj)
+            if key in tags:
+                return self.tag_test(tags[key])
             # There is no tag found either
-            return False
+            return self.missing
+
+    def __repr__(self):
+        return '<Lookup: %s__%s=%r>' % (self.key, self.comparison, self.value)
+
+
+class Plan(object):
+    """
+    A compiled set of lookups that can be kept around and reused
+    across many filter() calls.
+
+    >>> plan = Plan(state='running', name__startswith='production')
+    >>> plan(instance)
+    True
+    >>> plan.filter(ec2.instances.all())
+    [ ... ]
+    """
+
+    def __init__(self, **kwargs):
+        self.lookups = [Lookup(key, kwargs[key]) for key in kwargs]
+
+    def __call__(self, obj):
+        for lookup in self.lookups:
+            if not lookup(obj):
+                return False
+        return True
+
+    def filter(self, objects):
+        "Return the objects which match every lookup"
+        return [obj for obj in objects if self(obj)]
+
+    def __repr__(self):
+        return '<Plan: %r>' % self.lookups
+
+
+# Each comparison prepares its value once and returns a tuple of
+# (test against an attribute, test against a tag, result when missing).
+# The attribute and tag tests differ slightly for some comparisons, and
+# are kept that way so a Plan gives exactly the same answers as Compare.
+
+def _exact(value):
+    def test(v):
+        return v == value
+    return test, test, False
+
+
+def _iexact(value):
+    value = value.lower()
+
+    def test(v):
+        return v.lower() == value
+    return test, test, False
+
+
+def _like(value):
+    if isinstance(value, basestring):
+        # If a string is passed in,
+        # we want to convert it to a pattern object
+        value = re.compile(value)
+
+    def test(v):
+        return bool(value.match(v))
+    return test, test, False
+
+
+def _ilike(value):
+    return _like(re.compile(value, re.I))
+
+
+def _contains(value):
+    def test(v):
+        return value in v
+    return test, test, False
+
+
+def _icontains(value):
+    value = value.lower()
+
+    def attr_test(v):
+        return value in v.lower()
+
+    def tag_test(v):
+        return value in v
+    return attr_test, tag_test, False
+
+
+def _startswith(value):
+    def test(v):
+        return v.startswith(value)
+    return test, test, False
+
+
+def _istartswith(value):
+    value = value.lower()
+
+    def attr_test(v):
+        return v.startswith(value)
+
+    def tag_test(v):
+        return v.lower().startswith(value)
+    return attr_test, tag_test, False
+
+
+def _endswith(value):
+    def test(v):
+        return v.endswith(value)
+    return test, test, False
+
+
+def _iendswith(value):
+    value = value.lower()
+
+    def attr_test(v):
+        return v.endswith(value)
+
+    def tag_test(v):
+        return v.lower().endswith(value)
+    return attr_test, tag_test, False
+
+
+def _isnull(value):
+    def attr_test(v):
+        return (v is None) == value
+
+    def tag_test(v):
+        return (v is None) and value
+    # There is no attribute or tag, so must be null
+    return attr_test, tag_test, True and value
+
+
+def in_values(value):
+    "The values of an ``__in`` lookup, as a list"
+    if isinstance(value, basestring):
+        # A single value, not a sequence of characters
+        return [value]
+    return list(value)
+
+
+def _in(value):
+    values = in_values(value)
+    try:
+        # A set, so each test is a hash lookup instead of a scan
+        values = frozenset(values)
+    except TypeError:
+        pass
+
+    def test(v):
+        try:
+            return v in values
+        except TypeError:
+            # Unhashable, so compare one by one
+            return any(v == other for other in values)
+    return test, test, False
+
+
+_prepare = {
+    'exact': _exact,
+    'iexact': _iexact,
+    'like': _like,
+    'regex': _like,
+    'ilike': _ilike,
+    'iregex': _ilike,
+    'contains': _contains,
+    'icontains': _icontains,
+    'startswith': _startswith,
+    'istartswith': _istartswith,
+    'endswith': _endswith,
+    'iendswith': _iendswith,
+    'isnull': _isnull,
+    'in': _in,
+}
+
+
+class Compare(object):
+    "Private class, namespacing comparison functions."
+
+    @staticmethod
+    def exact(key, value, obj):
+        return Lookup(key, value, 'exact')(obj)
 
     @staticmethod
     def iexact(key, value, obj):
-        value = value.lower()
-        try:
-            return getattr(obj, key).lower() == value
-        except AttributeError:
-            # Fall back to checking tags
-            if hasattr(obj, 'tags'):
-                for tag in obj.tags:
-                    if key == tag.lower():
-                        return obj.tags[tag].lower() == value
-            # There is no tag found either
-            return False
+        return Lookup(key, value, 'iexact')(obj)
 
     @staticmethod
     def like(key, value, obj):
-        if isinstance(value, basestring):
-            # If a string is passed in,
-            # we want to convert it to a pattern object
-            value = re.compile(value)
-        try:
-            return bool(value.match(getattr(obj, key)))
-        except AttributeError:
-            # Fall back to checking tags
-            if hasattr(obj, 'tags'):
-                for tag in obj.tags:
-                    if key == tag.lower():
-                        return bool(value.match(obj.tags[tag]))
-            # There is no tag found either
-            return False
+        return Lookup(key, value, 'like')(obj)
     # Django alias
     regex = like
 
     @staticmethod
     def ilike(key, value, obj):
-        return Compare.like(key, re.compile(value, re.I), obj)
+        return Lookup(key, value, 'ilike')(obj)
     # Django alias
     iregex = ilike
 
     @staticmethod
     def contains(key, value, obj):
-        try:
-            return value in getattr(obj, key)
-        except AttributeError:
-            # Fall back to checking tags
-            if hasattr(obj, 'tags'):
-                for tag in obj.tags:
-                    if key == tag.lower():
-                        return value in obj.tags[tag]
-            # There is no tag found either
-            return False
+        return Lookup(key, value, 'contains')(obj)
 
     @staticmethod
     def icontains(key, value, obj):
-        value = value.lower()
-        try:
-            return value in getattr(obj, key).lower()
-        except AttributeError:
-            # Fall back to checking tags
-            if hasattr(obj, 'tags'):
-                for tag in obj.tags:
-                    if key == tag.lower():
-                        return value in obj.tags[tag]
-            # There is no tag found either
-            return False
+        return Lookup(key, value, 'icontains')(obj)
 
     @staticmethod
     def startswith(key, value, obj):
-        try:
-            return getattr(obj, key).startswith(value)
-        except AttributeError:
-            # Fall back to checking tags
-            if hasattr(obj, 'tags'):
-                for tag in obj.tags:
-                    if key == tag.lower():
-                        return obj.tags[tag].startswith(value)
-            # There is no tag found either
-            return False
+        return Lookup(key, value, 'startswith')(obj)
 
     @staticmethod
     def istartswith(key, value, obj):
-        value = value.lower()
-        try:
-            return getattr(obj, key).startswith(value)
-        except AttributeError:
-            # Fall back to checking tags
-            if hasattr(obj, 'tags'):
-                for tag in obj.tags:
-                    if key == tag.lower():
-                        return obj.tags[tag].lower().startswith(value)
-            # There is no tag found either
-            return False
+        return Lookup(key, value, 'istartswith')(obj)
 
     @staticmethod
     def endswith(key, value, obj):
-        try:
-            return getattr(obj, key).endswith(value)
-        except AttributeError:
-            # Fall back to checking tags
-            if hasattr(obj, 'tags'):
-                for tag in obj.tags:
-                    if key == tag.lower():
-                        return obj.tags[tag].endswith(value)
-            # There is no tag found either
-            return False
+        return Lookup(key, value, 'endswith')(obj)
 
     @staticmethod
     def iendswith(key, value, obj):
-        value = value.lower()
-        try:
-            return getattr(obj, key).endswith(value)
-        except AttributeError:
-            # Fall back to checking tags
-            if hasattr(obj, 'tags'):
-                for tag in obj.tags:
-                    if key == tag.lower():
-                        return obj.tags[tag].lower().endswith(value)
-            # There is no tag found either
-            return False
+        return Lookup(key, value, 'iendswith')(obj)
 
     @staticmethod
     def isnull(key, value, obj):
-        try:
-            return (getattr(obj, key) is None) == value
-        except AttributeError:
-            # Fall back to checking tags
-            if hasattr(obj, 'tags'):
-                for tag in obj.tags:
-                    if key == tag.lower():
-                        return (obj.tags[tag] is None) and value
-            # There is no tag found either, so must be null
-            return True and value
+        return Lookup(key, value, 'isnull')(obj)
+
+    @staticmethod
+    def in_(key, value, obj):
+        return Lookup(key, value, 'in')(obj)
+
+
+# ``in`` is a keyword, so it can't be defined with a def
+setattr(Compare, 'in', Compare.__dict__['in_'])
@@ -0,0 +1,429 @@
+"""
+ec2.indexes
+~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import copy
+import re
+import sre_constants
+import sre_parse
+import threading
+from bisect import bisect_left
+
+from ec2.helpers import tag_map
+
+
+class Index(object):
+    """
+    What every index of the cached results has in common: the key and
+    whether it's case folded, and putting results back in cache order.
+    """
+
+    #: Errors building an index raises when the key can't be indexed
+    build_errors = (TypeError, AttributeError)
+
+    def __init__(self, objects, key, fold=False):
+        self.key = key
+        self.fold = fold
+        # Kept to put results back in order, see _positions
+        self.objects = objects
+        self.positions = None
+        self._lock = threading.Lock()
+
+    def _positions(self):
+        "Maps id() of every indexed object to its place in the cache"
+        positions = self.positions
+        if positions is None:
+            with self._lock:
+                if self.positions is None:
+                    self.positions = dict(
+                        (id(obj), n) for n, obj in enumerate(self.objects))
+                    self.objects = None
+                positions = self.positions
+        return positions
+
+    def _copy(self, position):
+        """
+        A shallow copy ordered by the positions of an incremental
+        refresh, for patched() to fill in
+        """
+        index = copy.copy(self)
+        index.objects, index.positions = None, position
+        index._lock = threading.Lock()
+        return index
+
+    @classmethod
+    def build(cls, objects, key, fold=False):
+        "Build an index, or return None if the key can't be indexed"
+        try:
+            return cls(objects, key, fold)
+        except cls.build_errors:
+            return None
+
+
+class HashIndex(Index):
+    """
+    Maps the value of an attribute (or tag) to the objects holding it,
+    so exact and iexact lookups don't need to scan every object.
+
+    Values are resolved exactly the way Lookup resolves them: the
+    attribute first, then the tag with the same lowercased name.
+    """
+
+    #: Comparisons this index is able to answer
+    comparisons = ('exact', 'iexact', 'in')
+
+    def __init__(self, objects, key, fold=False):
+        super(HashIndex, self).__init__(objects, key, fold)
+        self.buckets = buckets = {}
+        for obj in objects:
+            try:
+                value = self.value_for(obj)
+            except KeyError:
+                # Neither an attribute nor a tag, so never matched
+                continue
+            # Raises TypeError for unhashable values, which
+            # means this key can't be indexed at all.
+            buckets.setdefault(value, []).append(obj)
+
+    def value_for(self, obj):
+        key = self.key
+        try:
+            value = getattr(obj, key)
+            return value.lower() if self.fold else value
+        except AttributeError:
+            value = tag_map(obj)[key]
+            return value.lower() if self.fold else value
+
+    def get(self, value):
+        "All objects with the given value, in their original order"
+        if self.fold:
+            value = value.lower()
+        return self.buckets.get(value, [])
+
+    def get_many(self, values):
+        """
+        All objects with any of the given values, in their original
+        order. Raises TypeError if any of the values is unhashable.
+        """
+        buckets = []
+        seen = set()
+        for value in values:
+            if self.fold:
+                value = value.lower()
+            if value not in seen:
+                seen.add(value)
+                bucket = self.buckets.get(value)
+                if bucket:
+                    buckets.append(bucket)
+        if len(buckets) == 1:
+            return list(buckets[0])
+        positions = self._positions()
+        return sorted((obj for bucket in buckets for obj in bucket),
+                      key=lambda obj: positions[id(obj)])
+
+    def patched(self, removed, added, position):
+        """
+        A new index for an incremental refresh, instead of rebuilding
+        it. ``position`` maps id() of every cached object to its place
+        in the new cache, so touched buckets keep cache order. This
+        index is left as it is, as readers may still be using it.
+        Raises TypeError like __init__.
+        """
+        index = self._copy(position)
+        buckets = index.buckets = dict(self.buckets)
+        drop = set(id(obj) for obj in removed)
+        touched = set()
+        for obj in removed:
+            try:
+                touched.add(self.value_for(obj))
+            except KeyError:
+                pass
+        additions = {}
+        for obj in added:
+            try:
+                value = self.value_for(obj)
+            except KeyError:
+                continue
+            additions.setdefault(value, []).append(obj)
+            touched.add(value)
+        for value in touched:
+            bucket = [obj for obj in buckets.get(value, ())
+                      if id(obj) not in drop]
+            bucket.extend(additions.get(value, ()))
+            if bucket:
+                bucket.sort(key=lambda obj: position[id(obj)])
+                buckets[value] = bucket
+            else:
+                buckets.pop(value, None)
+        return index
+
+
+class PrefixIndex(Index):
+    """
+    The string values of an attribute (or tag) kept sorted, so
+    startswith, istartswith and regular expressions beginning with a
+    literal prefix are a binary search and a walk over the matches,
+    instead of a scan over every object.
+
+    What get() returns may include objects that don't match, and still
+    has to be checked against the lookup. Objects whose attribute isn't
+    a string are always included, so checking them behaves exactly like
+    a scan, falling back to tags or raising.
+
+    With fold=True it answers istartswith, which lowercases tag values
+    but compares attribute values as they are.
+    """
+
+    #: Comparisons this index is able to answer
+    comparisons = ('startswith', 'istartswith', 'like', 'regex')
+
+    build_errors = Index.build_errors + (UnicodeError,)
+
+    def __init__(self, objects, key, fold=False):
+        super(PrefixIndex, self).__init__(objects, key, fold)
+        self.entries = self._sorted(*self._split(objects))
+
+    def _split(self, objects):
+        "(value, object) pairs to sort, and objects always included"
+        pairs, others = [], []
+        for obj in objects:
+            try:
+                value = self.value_for(obj)
+            except KeyError:
+                # Neither an attribute nor a tag, so never matched
+                continue
+            if value is None:
+                others.append(obj)
+            else:
+                pairs.append((value, obj))
+        return pairs, others
+
+    @staticmethod
+    def _sorted(pairs, others):
+        "(sorted values, their objects, objects always included)"
+        pairs.sort(key=lambda pair: pair[0])
+        return [v for v, _ in pairs], [obj for _, obj in pairs], others
+
+    def value_for(self, obj):
+        """
+        The value obj is sorted by, None if it isn't a string, raising
+        KeyError if it's neither an attribute nor a tag
+        """
+        try:
+            value = getattr(obj, self.key)
+        except AttributeError:
+            value = tag_map(obj)[self.key]
+            if self.fold and isinstance(value, basestring):
+                value = value.lower()
+        return value if isinstance(value, basestring) else None
+
+    def get(self, prefix):
+        "Objects that could start with prefix, in their original order"
+        if self.fold:
+            prefix = prefix.lower()
+        values, objects, others = self.entries
+        start = end = bisect_left(values, prefix)
+        while end < len(values) and values[end].startswith(prefix):
+            end += 1
+        if start == end and not others:
+            return []
+        positions = self._positions()
+        return sorted(objects[start:end] + others,
+                      key=lambda obj: positions[id(obj)])
+
+    def patched(self, removed, added, position):
+        """
+        A new index for an incremental refresh, instead of rebuilding
+        it, see HashIndex.patched()
+        """
+        values, objects, others = self.entries
+        drop = set(id(obj) for obj in removed)
+        pairs = [(v, obj) for v, obj in zip(values, objects)
+                 if id(obj) not in drop]
+        others = [obj for obj in others if id(obj) not in drop]
+        new_pairs, new_others = self._split(added)
+        pairs.extend(new_pairs)
+        others.extend(new_others)
+        index = self._copy(position)
+        index.entries = self._sorted(pairs, others)
+        return index
+
+    @staticmethod
+    def prefix_for(lookup):
+        """
+        The literal prefix every match of a lookup starts with, or None
+        if the lookup can't be answered by a PrefixIndex
+        """
+        value = lookup.value
+        if lookup.comparison in ('startswith', 'istartswith'):
+            return value if isinstance(value, basestring) else None
+        if lookup.comparison not in ('like', 'regex'):
+            return None
+        flags = 0
+        if not isinstance(value, basestring):
+            value, flags = value.pattern, value.flags
+        try:
+            parsed = sre_parse.parse(value, flags)
+        except (sre_constants.error, TypeError):
+            return None
+        if parsed.pattern.flags & re.IGNORECASE:
+            return None
+        char = unichr if isinstance(value, unicode) else chr
+        prefix = []
+        for n, (op, arg) in enumerate(parsed):
+            if op == sre_constants.LITERAL:
+                prefix.append(char(arg))
+            elif n == 0 and op == sre_constants.AT and arg in (
+                    sre_constants.AT_BEGINNING,
+                    sre_constants.AT_BEGINNING_STRING):
+                # Redundant, like() already matches from the start
+                continue
+            else:
+                break
+        return value[:0].join(prefix) or None
+
+
+def trigrams(value):
+    "Every three character substring of value"
+    return set(value[n:n + 3] for n in xrange(len(value) - 2))
+
+
+class TrigramIndex(Index):
+    """
+    Maps every three character substring (trigram) of an attribute's
+    (or tag's) string values to the values containing it, so contains
+    and icontains lookups only check the values holding every trigram
+    of what's searched for, instead of every object. Searches shorter
+    than three characters check each distinct value once.
+
+    What get() returns may include objects that don't match, and still
+    has to be checked against the lookup. Objects whose attribute isn't
+    a string are always included, like with PrefixIndex.
+
+    With fold=True values are lowercased, answering icontains.
+    """
+
+    #: Comparisons this index is able to answer
+    comparisons = ('contains', 'icontains')
+
+    def __init__(self, objects, key, fold=False):
+        super(TrigramIndex, self).__init__(objects, key, fold)
+        self.entries = ({}, {}, [])
+        self._add(objects, self.entries)
+
+    def value_for(self, obj):
+        """
+        The value obj is indexed by, None if it isn't a string, raising
+        KeyError if it's neither an attribute nor a tag
+        """
+        try:
+            value = getattr(obj, self.key)
+        except AttributeError:
+            value = tag_map(obj)[self.key]
+        if not isinstance(value, basestring):
+            return None
+        return value.lower() if self.fold else value
+
+    def _add(self, objects, entries, owned=None):
+        """
+        Add objects to the entries: (buckets of objects by value,
+        trigrams to the values containing them, objects always
+        included). When patching, ``owned`` holds the buckets and sets
+        already copied, and any others are copied before changing them.
+        """
+        buckets, grams, others = entries
+        for obj in objects:
+            try:
+                value = self.value_for(obj)
+            except KeyError:
+                # Neither an attribute nor a tag, so never matched
+                continue
+            if value is None:
+                others.append(obj)
+                continue
+            if value in buckets:
+                self._owned(buckets, value, owned, list).append(obj)
+                continue
+            buckets[value] = [obj]
+            if owned is not None:
+                owned.add(('bucket', value))
+            for gram in trigrams(value):
+                self._owned(grams, gram, owned, set).add(value)
+
+    @staticmethod
+    def _owned(mapping, key, owned, factory):
+        "mapping[key], made safe to change in place"
+        if owned is None:
+            try:
+                return mapping[key]
+            except KeyError:
+                mapping[key] = value = factory()
+                return value
+        kind = 'bucket' if factory is list else 'gram'
+        if (kind, key) not in owned:
+            owned.add((kind, key))
+            mapping[key] = factory(mapping.get(key, ()))
+        return mapping[key]
+
+    def get(self, value):
+        "Objects that could contain value, in their original order"
+        if self.fold:
+            value = value.lower()
+        buckets, grams, others = self.entries
+        needed = trigrams(value)
+        if needed:
+            postings = sorted((grams.get(gram, ()) for gram in needed),
+                              key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(posting)
+        else:
+            candidates = buckets
+        matches = [obj for candidate in candidates if value in candidate
+                   for obj in buckets[candidate]]
+        if not matches and not others:
+            return []
+        positions = self._positions()
+        return sorted(matches + others, key=lambda obj: positions[id(obj)])
+
+    def patched(self, removed, added, position):
+        """
+        A new index for an incremental refresh, instead of rebuilding
+        it, see HashIndex.patched(). Only the buckets and trigram sets
+        that change are copied, the rest are shared with this index.
+        """
+        buckets, grams, others = self.entries
+        buckets, grams, owned = dict(buckets), dict(grams), set()
+        drop = set(id(obj) for obj in removed)
+        others = [obj for obj in others if id(obj) not in drop]
+        for obj in removed:
+            try:
+                value = self.value_for(obj)
+            except KeyError:
+                continue
+            if value not in buckets:
+                continue
+            bucket = [other for other in buckets[value]
+                      if id(other) not in drop]
+            owned.add(('bucket', value))
+            if bucket:
+                buckets[value] = bucket
+                continue
+            del buckets[value]
+            for gram in trigrams(value):
+                values = self._owned(grams, gram, owned, set)
+                values.discard(value)
+                if not values:
+                    del grams[gram]
+                    owned.discard(('gram', gram))
+        entries = (buckets, grams, others)
+        self._add(added, entries, owned)
+        index = self._copy(position)
+        index.entries = entries
+        return index
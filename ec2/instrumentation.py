@@ -0,0 +1,139 @@
+"""
+ec2.instrumentation
+~~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('ec2')
+
+#: Every registered listener. Nothing is measured while it's empty.
+listeners = []
+
+
+def register(listener):
+    """
+    Start sending events to a listener, which is called as
+    ``listener(event, model, **data)``. ``model`` is the type the
+    event is about, such as ec2.instances. Returns the listener, so
+    this also works as a decorator.
+
+    Events, with their data:
+        fetch: an API call, with filters, count and duration
+        cache_hit, cache_miss, cache_clear: all() and clear()
+        refresh: with incremental and duration
+        predicate: one lookup of a filter(), with lookup (such as
+            ``name__startswith``), rows_in, rows_out and duration
+
+    Anything failing, fetch and refresh included, also has error.
+
+    >>> @ec2.instrumentation.register
+    ... def to_statsd(event, model, **data):
+    ...     statsd.incr('ec2.%s.%s' % (model.__name__, event))
+    """
+    listeners.append(listener)
+    return listener
+
+
+def unregister(listener):
+    "Stop sending events to a listener"
+    listeners.remove(listener)
+
+
+def emit(event, model, **data):
+    "Send an event to every listener"
+    for listener in list(listeners):
+        try:
+            listener(event, model, **data)
+        except Exception:
+            # Broken metrics should never break a query
+            logger.exception('Instrumentation listener %r failed', listener)
+
+
+@contextmanager
+def timed(event, model, **data):
+    """
+    Emit an event with the duration of the block. The block can add
+    to the yielded data, such as a count of results.
+    """
+    start = time.time()
+    try:
+        yield data
+    except Exception as e:
+        data['error'] = e
+        raise
+    finally:
+        if listeners:
+            emit(event, model, duration=time.time() - start, **data)
+
+
+class StatsCollector(object):
+    """
+    A listener keeping counters and timings in memory, keyed like
+    ``instances.fetch`` or ``instances.predicate.name__startswith``.
+
+    >>> stats = ec2.instrumentation.register(StatsCollector())
+    >>> stats.snapshot()
+    {'counters': {'instances.fetch': 1, 'instances.fetch.objects': 250,
+                  ...},
+     'timings': {'instances.fetch': {'count': 1, 'total': 1.2,
+                                     'min': 1.2, 'max': 1.2}, ...}}
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.timings = {}
+
+    def __call__(self, event, model, **data):
+        key = '%s.%s' % (model.__name__, event)
+        if 'lookup' in data:
+            key = '%s.%s' % (key, data['lookup'])
+        with self._lock:
+            self._incr(key, 1)
+            if 'error' in data:
+                self._incr(key + '.errors', 1)
+            for field, suffix in (('count', 'objects'),
+                                  ('rows_in', 'rows_in'),
+                                  ('rows_out', 'rows_out')):
+                if field in data:
+                    self._incr('%s.%s' % (key, suffix), data[field])
+            if 'duration' in data:
+                self._time(key, data['duration'])
+
+    def _incr(self, key, n):
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def _time(self, key, duration):
+        timing = self.timings.get(key)
+        if timing is None:
+            self.timings[key] = {
+                'count': 1, 'total': duration,
+                'min': duration, 'max': duration,
+            }
+        else:
+            timing['count'] += 1
+            timing['total'] += duration
+            timing['min'] = min(timing['min'], duration)
+            timing['max'] = max(timing['max'], duration)
+
+    def snapshot(self):
+        "A copy of every counter and timing collected so far"
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'timings': dict(
+                    (key, dict(timing))
+                    for key, timing in self.timings.iteritems()
+                ),
+            }
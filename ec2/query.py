@@ -0,0 +1,245 @@
+"""
+ec2.query
+~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import threading
+import time
+from itertools import islice
+
+from ec2.helpers import Plan, resolve
+from ec2.instrumentation import emit, listeners
+
+
+class QuerySet(object):
+    """
+    A lazy, chainable query, returned by filter() and exclude().
+
+    Nothing is fetched or matched until the results are needed, and
+    then only once; the matches are kept for later use. first(),
+    exists(), get() and indexing stop looking as soon as they have an
+    answer, and later calls carry on from where they stopped.
+    It otherwise behaves like the list filter() used to return.
+
+    >>> qs = ec2.instances.filter(state='running').exclude(name='web-01')
+    >>> qs.order_by('-launch_time')[:5]
+    [ ... ]
+    """
+
+    def __init__(self, model, plans=(), excludes=(), ordering=(),
+                 regions=None, related=()):
+        self.model = model
+        self.plans = plans
+        self.excludes = excludes
+        self.ordering = ordering
+        self.regions = regions
+        self.related = related
+        self._result = None
+        # Matches generated so far, and the generator to carry on with,
+        # while nothing has needed all of them yet
+        self._matches = []
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def _clone(self, **changes):
+        state = {
+            'plans': self.plans,
+            'excludes': self.excludes,
+            'ordering': self.ordering,
+            'regions': self.regions,
+            'related': self.related,
+        }
+        state.update(changes)
+        return QuerySet(self.model, **state)
+
+    def filter(self, *plans, **kwargs):
+        "A new QuerySet, narrowed down by more lookups"
+        regions = kwargs.pop('regions', self.regions)
+        if kwargs:
+            plans += (Plan(**kwargs),)
+        return self._clone(plans=self.plans + plans, regions=regions)
+
+    def exclude(self, *plans, **kwargs):
+        """
+        A new QuerySet without the objects matching the lookups.
+        Like Django, everything in one exclude() call has to match
+        for an object to be left out.
+        """
+        if kwargs:
+            plans += (Plan(**kwargs),)
+        return self._clone(excludes=self.excludes + plans)
+
+    def order_by(self, *keys):
+        """
+        A new QuerySet sorted by attributes or tags, with a leading
+        ``-`` for descending order
+
+        >>> ec2.instances.filter(state='running').order_by('-launch_time')
+        """
+        return self._clone(ordering=keys)
+
+    def select_related(self, *names):
+        """
+        A new QuerySet attaching related objects to each result, such
+        as an instance's vpc or volumes. Each relation costs one bulk
+        query for all of the results, rather than one per result.
+
+        >>> qs = ec2.instances.filter(state='running')
+        >>> for i in qs.select_related('vpc', 'security_groups'):
+        ...     print i.vpc.cidr_block, [g.name for g in i.security_groups]
+        """
+        for name in names:
+            if name not in self.model.related:
+                raise AttributeError("No relation '%s'" % name)
+        return self._clone(related=self.related + names)
+
+    def _iter(self):
+        "Generate matches from scratch, without sorting or caching"
+        if self.regions is not None:
+            objects = self.model._fan_out(
+                self.regions, 'filter', *self.plans)
+            plans = ()
+        else:
+            objects, plans = self.model._source(self.plans)
+            if listeners and plans:
+                objects = self._instrumented(objects, plans)
+                plans = ()
+        excludes = self.excludes
+        for obj in objects:
+            for plan in plans:
+                if not plan(obj):
+                    break
+            else:
+                for plan in excludes:
+                    if plan(obj):
+                        break
+                else:
+                    yield obj
+
+    def _instrumented(self, objects, plans):
+        """
+        Apply the plans one lookup at a time, reporting each lookup
+        to the instrumentation listeners. This gives the same results
+        as checking every plan per object, but isn't lazy.
+        """
+        objects = list(objects)
+        for plan in plans:
+            for lookup in plan.lookups:
+                rows_in, start = len(objects), time.time()
+                objects = [obj for obj in objects if lookup(obj)]
+                emit('predicate', self.model,
+                     lookup='%s__%s' % (lookup.key, lookup.comparison),
+                     rows_in=rows_in, rows_out=len(objects),
+                     duration=time.time() - start)
+        return objects
+
+    def _fetch_all(self):
+        if self._result is None:
+            with self._lock:
+                if self._pending is not None:
+                    result = self._matches + list(self._pending)
+                else:
+                    result = list(self._iter())
+                self._matches, self._pending = [], None
+            # Sort by the last key first, relying on a stable sort
+            for key in reversed(self.ordering):
+                reverse = key.startswith('-')
+                key = key.lstrip('-')
+                result.sort(key=lambda obj: resolve(obj, key),
+                            reverse=reverse)
+            if self.related:
+                self.model._select_related(result, self.related)
+            self._result = result
+        return self._result
+
+    def _lazy(self):
+        "Whether results can still be generated one at a time"
+        return (self._result is None and not self.ordering and
+                not self.related)
+
+    def _first(self, n):
+        """
+        The first n matches, only generating as many more as needed.
+        The generator is kept, so the next call carries on from there.
+        """
+        with self._lock:
+            if self._result is not None:
+                return self._result[:n]
+            if self._pending is None:
+                self._pending = self._iter()
+            matches = self._matches
+            matches.extend(islice(self._pending, max(0, n - len(matches))))
+            return matches[:n]
+
+    def __iter__(self):
+        return iter(self._fetch_all())
+
+    def __len__(self):
+        return len(self._fetch_all())
+
+    def __nonzero__(self):
+        return bool(self._fetch_all())
+
+    def __getitem__(self, k):
+        if self._lazy():
+            if isinstance(k, slice):
+                if k.stop is not None and all(
+                        i is None or i >= 0
+                        for i in (k.start, k.stop, k.step)):
+                    return self._first(k.stop)[k]
+            elif k >= 0:
+                return self._first(k + 1)[k]
+        return self._fetch_all()[k]
+
+    def __eq__(self, other):
+        if isinstance(other, QuerySet):
+            other = other._fetch_all()
+        return self._fetch_all() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __add__(self, other):
+        return self._fetch_all() + list(other)
+
+    def __radd__(self, other):
+        return list(other) + self._fetch_all()
+
+    def __repr__(self):
+        return repr(self._fetch_all())
+
+    def count(self):
+        "Number of matches"
+        return len(self)
+
+    def exists(self):
+        "Whether anything matches, stopping at the first match"
+        if not self._lazy():
+            return bool(self._fetch_all())
+        return bool(self._first(1))
+
+    def first(self):
+        "The first match, or None"
+        result = self._first(1) if self._lazy() else self._fetch_all()
+        return result[0] if result else None
+
+    def get(self, *plans, **kwargs):
+        """
+        The only match, raising DoesNotExist or MultipleObjectsReturned.
+        Stops looking as soon as a second match turns up.
+        """
+        qs = self.filter(*plans, **kwargs) if plans or kwargs else self
+        if qs._lazy():
+            matches = qs._first(2)
+        else:
+            matches = qs._fetch_all()[:2]
+        if len(matches) > 1:
+            # Raise an exception if more than one object is matched
+            raise self.model.MultipleObjectsReturned
+        elif len(matches) == 0:
+            # Rase an exception if no objects were matched
+            raise self.model.DoesNotExist
+        return matches[0]
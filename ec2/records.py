@@ -0,0 +1,87 @@
+"""
+ec2.records
+~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+
+class Record(object):
+    """
+    A compact, read only snapshot of a boto object, holding only a
+    chosen set of fields in __slots__ instead of a full __dict__, a
+    connection and every nested object.
+
+    Lookups work the same as against the boto object, as long as the
+    field was kept. full() fetches the complete boto object again.
+    """
+    __slots__ = ('tags', '_tag_map', 'region_name')
+
+    #: The objects_base type this record came from
+    _model = None
+
+    #: Fields copied over from the boto object
+    _projected = ()
+
+    def full(self):
+        "Fetch the complete boto object this record was made from"
+        return self._model.describe(self.id)
+
+    def __repr__(self):
+        return '%s:%s' % (type(self).__name__, getattr(self, 'id', None))
+
+
+def record_class(model, fields):
+    "Create a Record subclass holding the given fields"
+    fields = tuple(f for f in fields if f not in Record.__slots__)
+    if 'id' not in fields:
+        # Needed to get back to the full object
+        fields = ('id',) + fields
+    # Room for anything select_related() attaches
+    related = tuple(name for name in model.related if name not in fields)
+    return type(model.__name__ + 'Record', (Record,), {
+        '__slots__': fields + related,
+        '_model': model,
+        '_projected': fields,
+    })
+
+
+class Projector(object):
+    """
+    Turns boto objects into records, sharing one copy of each
+    distinct string (ids, types, zones, tag keys) between them.
+    """
+
+    def __init__(self, record_type, derived=None):
+        self.record_type = record_type
+        self.fields = record_type._projected
+        self.derived = derived or {}
+        self._strings = {}
+
+    def intern(self, value):
+        if isinstance(value, basestring):
+            return self._strings.setdefault(value, value)
+        return value
+
+    def value(self, obj, field):
+        "A field of a boto object, computing it if it's derived"
+        derive = self.derived.get(field)
+        if derive is not None:
+            return derive(obj)
+        return getattr(obj, field)
+
+    def __call__(self, obj):
+        intern = self.intern
+        record = self.record_type()
+        for field in self.fields:
+            try:
+                setattr(record, field, intern(self.value(obj, field)))
+            except AttributeError:
+                # Left unset, so lookups fall back to the tags
+                pass
+        record.tags = dict(
+            (intern(k), intern(v))
+            for k, v in (getattr(obj, 'tags', None) or {}).iteritems()
+        )
+        return record
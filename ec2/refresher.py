@@ -0,0 +1,135 @@
+"""
+ec2.refresher
+~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger('ec2')
+
+
+class Refresher(object):
+    """
+    A background thread keeping the caches of some types current,
+    calling back with a Delta of whatever changed on each refresh.
+    New results are swapped in whole, so readers never wait on it.
+
+    types: the types to keep current, such as ec2.instances
+    interval: seconds between the start of each round of refreshes
+    jitter: fraction of the interval each wait is randomly changed by,
+        so many processes don't all refresh at the same moment
+    budget: seconds a round may take. Types it doesn't get to are
+        refreshed first in the next round. None for no limit.
+    incremental: only fetch what changed, see objects_base.refresh().
+        Otherwise everything is fetched, which also catches tag changes.
+
+    >>> refresher = Refresher([ec2.instances, ec2.security_groups])
+    >>> @refresher.on_change
+    ... def changed(model, delta):
+    ...     for old, new in delta.changed:
+    ...         if old.state != new.state:
+    ...             print new.id, old.state, '->', new.state
+    >>> refresher.start()
+    """
+
+    def __init__(self, types, interval=60, jitter=0.1, budget=None,
+                 incremental=False):
+        self.types = list(types)
+        self.interval = interval
+        self.jitter = jitter
+        self.budget = budget
+        self.incremental = incremental
+        self.callbacks = []
+        self._stopped = threading.Event()
+        self._thread = None
+        # How far the last round overran the interval
+        self._overrun = 0
+
+    def on_change(self, callback):
+        """
+        Call ``callback(model, delta)`` whenever a refresh changed
+        something. Returns the callback, so this works as a decorator.
+        """
+        self.callbacks.append(callback)
+        return callback
+
+    def start(self):
+        "Start refreshing in a daemon thread"
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        "Stop refreshing, waiting for a refresh in progress to finish"
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        # Fill empty caches first, rather than calling back with every
+        # object as added
+        for model in self.types:
+            try:
+                model.all()
+            except Exception:
+                logger.exception('Unable to fetch %s', model.__name__)
+        while True:
+            # Event.wait() only returns whether it was set from 2.7
+            self._stopped.wait(self.delay())
+            if self._stopped.is_set():
+                break
+            started = time.time()
+            self.run_once()
+            self._overrun = max(0, time.time() - started - self.interval)
+
+    def delay(self):
+        "Seconds to wait before the next round"
+        spread = self.interval * self.jitter
+        delay = self.interval + random.uniform(-spread, spread)
+        return max(0, delay - self._overrun)
+
+    def run_once(self):
+        """
+        Refresh each type once, until the budget runs out. Returns the
+        types that were refreshed.
+        """
+        started = time.time()
+        refreshed = []
+        for model in list(self.types):
+            if self._stopped.is_set():
+                break
+            if self.budget is not None and \
+                    time.time() - started >= self.budget:
+                logger.warning('Refresh budget of %ss ran out, skipping %s',
+                               self.budget, model.__name__)
+                break
+            self._refresh(model)
+            refreshed.append(model)
+        # Whatever was skipped goes first next time
+        self.types = [model for model in self.types
+                      if model not in refreshed] + refreshed
+        return refreshed
+
+    def _refresh(self, model):
+        try:
+            delta = model.refresh(incremental=self.incremental, delta=True)
+        except Exception:
+            logger.exception('Unable to refresh %s', model.__name__)
+            return
+        if not delta:
+            return
+        for callback in list(self.callbacks):
+            try:
+                callback(model, delta)
+            except Exception:
+                logger.exception('Refresh callback %r failed', callback)
@@ -0,0 +1,131 @@
+"""
+ec2.related
+~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+
+class Related(object):
+    """
+    A relation from one type to another, declared in a type's
+    ``related`` mapping. select_related() uses it to attach the related
+    objects to a whole list of results with one bulk query per type,
+    instead of one lookup per result.
+
+    model: name of the related type in ec2.types
+    key: attribute name, or a function of an object, giving the id(s)
+        to join on
+    """
+
+    def __init__(self, model, key):
+        self.model = model
+        self.key = key
+
+    def values(self, obj):
+        "The id(s) to join on for obj, as a list"
+        try:
+            if callable(self.key):
+                value = self.key(obj)
+            else:
+                value = getattr(obj, self.key)
+        except AttributeError:
+            return []
+        if value is None:
+            return []
+        if isinstance(value, basestring):
+            return [value]
+        return list(value)
+
+    def target(self, model, region_name):
+        "The related type, bound to the same region as the results"
+        from ec2 import types
+        target = getattr(types, self.model)
+        if model.session is not None:
+            target = model.session.bind(target)
+        default = model.region_name or model._credentials()['region_name']
+        if model.region_name is None and region_name == default:
+            return target
+        return target.in_region(region_name)
+
+    def candidates(self, target, filter_name, ids):
+        """
+        Related objects that could match the ids. Only those ids are
+        fetched when the target's cache is cold and they fit in one
+        filter, otherwise the target's cached results are used.
+        """
+        if not ids:
+            return []
+        if target._cache is None and target.pushdown and \
+                len(ids) <= target.max_filter_values:
+            return target._prepare(
+                target._query(filters={filter_name: sorted(ids)}))
+        return target.all()
+
+    def prefetch(self, model, objects, name, region_name):
+        """
+        Attach the related objects to every one of the objects, as the
+        attribute ``name``, with one bulk lookup. Subclasses implement
+        this, returning nothing: a single related object or None for
+        ForeignKey, a list for many=True and Reverse.
+
+        model: the type the objects are results of
+        region_name: the region they came from, and the related
+            objects are looked up in, see target()
+        """
+        raise NotImplementedError
+
+
+class ForeignKey(Related):
+    """
+    Each object holds the id of its related object, such as an
+    instance's ``vpc_id``. With many=True it holds a list of them,
+    and a list of related objects is attached.
+    """
+
+    def __init__(self, model, key, many=False):
+        super(ForeignKey, self).__init__(model, key)
+        self.many = many
+
+    def prefetch(self, model, objects, name, region_name):
+        target = self.target(model, region_name)
+        ids = set()
+        for obj in objects:
+            ids.update(self.values(obj))
+        found = dict(
+            (related.id, related)
+            for related in self.candidates(
+                target, target.api_filters['id'], ids)
+            if related.id in ids
+        )
+        for obj in objects:
+            related = [found[value] for value in self.values(obj)
+                       if value in found]
+            if not self.many:
+                related = related[0] if related else None
+            setattr(obj, name, related)
+
+
+class Reverse(Related):
+    """
+    Related objects hold the id of each object, such as a volume's
+    attached instance. A list of them is attached to each object.
+
+    filter_name: the API filter matching the related objects' key
+    """
+
+    def __init__(self, model, key, filter_name):
+        super(Reverse, self).__init__(model, key)
+        self.filter_name = filter_name
+
+    def prefetch(self, model, objects, name, region_name):
+        target = self.target(model, region_name)
+        ids = set(obj.id for obj in objects)
+        grouped = {}
+        for related in self.candidates(target, self.filter_name, ids):
+            for value in self.values(related):
+                if value in ids:
+                    grouped.setdefault(value, []).append(related)
+        for obj in objects:
+            setattr(obj, name, grouped.get(obj.id, []))
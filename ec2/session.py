@@ -0,0 +1,97 @@
+"""
+ec2.session
+~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import threading
+
+from ec2 import types
+from ec2.base import objects_base
+from ec2.connection import ConnectionPool, acquire_connection, leased
+from ec2.throttle import Throttle
+
+
+class Session(object):
+    """
+    Credentials, a connection pool, and a cache and indexes for every
+    type, kept apart from the module level ones and from any other
+    session. Many accounts or regions can be served from one process
+    at once, without sharing connections or results.
+
+    The module level API, such as ec2.instances, works like a default
+    session using ec2.credentials, ec2.connection.pool and
+    ec2.throttle.throttle. Rate limits are per account, so a session
+    gets its own Throttle unless it's given one.
+
+    >>> session = ec2.Session('AKIA...', 'secret', 'us-west-2')
+    >>> session.instances.filter(state='running')
+    [ ... ]
+    """
+
+    def __init__(self, access_key_id, secret_access_key,
+                 region_name='us-east-1', pool=None, throttle=None):
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.region_name = region_name
+        self.pool = pool if pool is not None else ConnectionPool()
+        self.throttle = throttle if throttle is not None else Throttle()
+        self._types = {}
+        self._regions = None
+        self._lock = threading.Lock()
+
+    def credentials(self):
+        "The session's credentials, as a dict like ec2.credentials()"
+        return {
+            'aws_access_key_id': self.access_key_id,
+            'aws_secret_access_key': self.secret_access_key,
+            'region_name': self.region_name,
+        }
+
+    def bind(self, cls):
+        """
+        A copy of a type using this session, with its own cache. The
+        copy is created once and reused.
+
+        >>> session.bind(ec2.instances) is session.instances
+        True
+        """
+        with self._lock:
+            try:
+                return self._types[cls]
+            except KeyError:
+                bound = type(cls)(cls.__name__, (cls,), {
+                    '__doc__': cls.__doc__,
+                    '__module__': cls.__module__,
+                    'session': self,
+                })
+                self._types[cls] = bound
+                return bound
+
+    def __getattr__(self, name):
+        "Each type in ec2.types, such as session.instances"
+        cls = getattr(types, name, None)
+        if isinstance(cls, type) and issubclass(cls, objects_base) and \
+                cls is not objects_base:
+            return self.bind(cls)
+        raise AttributeError(name)
+
+    def regions(self):
+        "Names of every region enabled for the account, fetched once"
+        if self._regions is None:
+            with leased(acquire_connection(session=self)) as connection:
+                self._regions = [r.name for r in connection.get_all_regions()]
+        return self._regions
+
+    def clear(self):
+        "Clear the cache of every type, and close idle connections"
+        with self._lock:
+            bound = self._types.values()
+        for cls in bound:
+            cls.clear()
+        self.pool.clear()
+
+    def __repr__(self):
+        return '<Session: %s>' % self.region_name
@@ -0,0 +1,405 @@
+"""
+ec2.shared
+~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import mmap
+import struct
+from array import array
+
+from ec2.helpers import index_tags, interner
+from ec2.snapshots import SnapshotStore
+
+# Bump whenever the file layout changes, so old snapshots are ignored
+VERSION = 1
+
+MAGIC = 'EC2M'
+PREAMBLE = struct.Struct('=4sI')
+
+# Row codes of fields and tags that aren't set
+UNSET = -1
+
+# Values that haven't been decoded yet
+MISSING = object()
+
+# Per value code results while filtering, FALLBACK meaning "check the
+# tag instead", like ec2.columns
+FALSE, TRUE, FALLBACK = 0, 1, 2
+
+
+def _array(typecode, values=()):
+    codes = array(typecode, values)
+    if codes.itemsize != 4:
+        raise TypeError('Snapshots need 4 byte integers')
+    return codes
+
+
+def _encode(value):
+    "Serialize one field or tag value, keeping its exact type"
+    if value is None:
+        return 'n'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, unicode):
+        return 'u' + value.encode('utf-8')
+    if isinstance(value, str):
+        return 's' + value
+    if isinstance(value, (int, long)):
+        return 'i' + str(value)
+    if isinstance(value, float):
+        return 'd' + repr(value)
+    raise TypeError('Unable to share %r in a snapshot' % (value,))
+
+
+def _decode(data):
+    kind, payload = data[0], data[1:]
+    if kind == 'n':
+        return None
+    if kind == 't':
+        return True
+    if kind == 'f':
+        return False
+    if kind == 'u':
+        return payload.decode('utf-8')
+    if kind == 's':
+        return payload
+    if kind == 'i':
+        return int(payload)
+    if kind == 'd':
+        return float(payload)
+    raise ValueError('Unknown value type %r' % kind)
+
+
+def write(f, objects, fields, fetched_at, read=getattr):
+    """
+    Write objects to a file as a shared snapshot: each of the fields
+    and the tags of every object, as codes into one table of distinct
+    values. Fields an object doesn't have are left unset.
+
+    read: ``read(obj, field)`` reading a field, raising AttributeError
+        when it isn't set, such as Projector.value
+    """
+    import json
+    values, codes = [], {}
+
+    def encode(value):
+        data = _encode(value)
+        try:
+            return codes[data]
+        except KeyError:
+            codes[data] = code = len(values)
+            values.append(data)
+            return code
+
+    columns = dict((field, _array('i')) for field in fields)
+    tag_offsets, tag_pairs = _array('I', [0]), _array('i')
+    rows = 0
+    for obj in objects:
+        rows += 1
+        for field in fields:
+            try:
+                data = read(obj, field)
+            except AttributeError:
+                columns[field].append(UNSET)
+            else:
+                columns[field].append(encode(data))
+        for key, value in (getattr(obj, 'tags', None) or {}).iteritems():
+            tag_pairs.append(encode(key))
+            tag_pairs.append(encode(value))
+        tag_offsets.append(len(tag_pairs))
+
+    value_offsets = _array('I', [0])
+    for data in values:
+        value_offsets.append(value_offsets[-1] + len(data))
+
+    # Everything after the header, in order, and where each section
+    # starts relative to the end of the header
+    sections = [('value_offsets', value_offsets.tostring()),
+                ('values', ''.join(values)),
+                ('tag_offsets', tag_offsets.tostring()),
+                ('tag_pairs', tag_pairs.tostring())]
+    sections.extend(('column:' + field, columns[field].tostring())
+                    for field in fields)
+    starts, position = {}, 0
+    for name, data in sections:
+        starts[name] = position
+        position += len(data)
+    header = json.dumps({
+        'version': VERSION,
+        'fetched_at': fetched_at,
+        'fields': list(fields),
+        'rows': rows,
+        'sections': starts,
+    })
+    f.write(PREAMBLE.pack(MAGIC, len(header)))
+    f.write(header)
+    for _, data in sections:
+        f.write(data)
+
+
+class MappedSnapshot(object):
+    """
+    A shared snapshot file, mapped read only. Nothing is read until
+    it's asked for, and each distinct value is decoded at most once.
+    Only the value codes of the fields and tags in use are copied out
+    of the mapping, at 4 bytes per row.
+    """
+
+    def __init__(self, f):
+        import json
+        self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, length = PREAMBLE.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a shared snapshot')
+        header = json.loads(self.map[PREAMBLE.size:PREAMBLE.size + length])
+        self.version = header['version']
+        self.fetched_at = header['fetched_at']
+        self.fields = tuple(header['fields'])
+        self.rows = header['rows']
+        base = PREAMBLE.size + length
+        self.sections = dict((name, base + start)
+                             for name, start in header['sections'].items())
+        count = (self.sections['values'] -
+                 self.sections['value_offsets']) // 4 - 1
+        self._values = [MISSING] * count
+        self._columns = {}
+        self._tag_columns = {}
+
+    def _ints(self, section, start, stop, typecode='i'):
+        "Integers start to stop of a section, as an array"
+        offset = self.sections[section]
+        codes = _array(typecode)
+        codes.fromstring(self.map[offset + 4 * start:offset + 4 * stop])
+        return codes
+
+    def value(self, code):
+        "Decode the value for a code"
+        value = self._values[code]
+        if value is MISSING:
+            offset = self.sections['values']
+            start, stop = struct.unpack_from(
+                '=II', self.map, self.sections['value_offsets'] + 4 * code)
+            value = _decode(self.map[offset + start:offset + stop])
+            self._values[code] = value
+        return value
+
+    def column(self, field):
+        "Value codes of a field for every row, UNSET where it isn't set"
+        try:
+            return self._columns[field]
+        except KeyError:
+            codes = self._columns[field] = self._ints(
+                'column:' + field, 0, self.rows)
+            return codes
+
+    def _tag_pairs(self):
+        "(offsets of each row's tags, key and value codes of every tag)"
+        try:
+            return self._columns['tags']
+        except KeyError:
+            offsets = self._ints('tag_offsets', 0, self.rows + 1, 'I')
+            pairs = self._ints('tag_pairs', 0, offsets[-1])
+            self._columns['tags'] = offsets, pairs
+            return offsets, pairs
+
+    def tags(self, row):
+        "The tags of a row, as a dict"
+        offsets, pairs = self._tag_pairs()
+        value = self.value
+        return dict((value(pairs[n]), value(pairs[n + 1]))
+                    for n in xrange(offsets[row], offsets[row + 1], 2))
+
+    def tag_column(self, key):
+        """
+        Value codes of the tag with a lowercased name for every row,
+        the way tag_map() resolves it, built once per key
+        """
+        try:
+            return self._tag_columns[key]
+        except KeyError:
+            pass
+        offsets, pairs = self._tag_pairs()
+        matching = {}
+        codes = _array('i', [UNSET]) * self.rows
+        for row in xrange(self.rows):
+            for n in xrange(offsets[row], offsets[row + 1], 2):
+                name = pairs[n]
+                if name not in matching:
+                    matching[name] = self.value(name).lower() == key
+                if matching[name]:
+                    codes[row] = pairs[n + 1]
+                    # The first tag wins if two only differ by case
+                    break
+        self._tag_columns[key] = codes
+        return codes
+
+
+class MappedRows(object):
+    """
+    The cached results of a type, read from a MappedSnapshot. Each row
+    becomes a compact ec2.records.Record the first time it's used, and
+    filter() evaluates lookups against the mapped values, so only the
+    matching rows are ever turned into records.
+    """
+
+    def __init__(self, snapshot, record_type, region_name):
+        self.snapshot = snapshot
+        self.record_type = record_type
+        self.region_name = region_name
+        self._records = [None] * snapshot.rows
+        self._columns = None
+        self._intern = interner()
+
+    def __len__(self):
+        return self.snapshot.rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[row] for row in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        record = self._records[index]
+        if record is None:
+            record = self._records[index] = self._record(index)
+        return record
+
+    def __iter__(self):
+        for row in xrange(len(self)):
+            yield self[row]
+
+    def fingerprints(self):
+        """
+        (id, (fields, tags)) of every row, in order, read straight from
+        the snapshot. Comparing them between two generations tells what
+        changed without turning every row into a record.
+        """
+        snapshot = self.snapshot
+        value = snapshot.value
+        ids = snapshot.column('id')
+        columns = [snapshot.column(field) for field in snapshot.fields]
+        fingerprints = []
+        for row in xrange(len(self)):
+            fields = tuple(None if codes[row] == UNSET else value(codes[row])
+                           for codes in columns)
+            fingerprints.append(
+                (value(ids[row]), (fields, snapshot.tags(row))))
+        return fingerprints
+
+    def _record(self, row):
+        snapshot = self.snapshot
+        if self._columns is None:
+            self._columns = [(field, snapshot.column(field))
+                             for field in snapshot.fields]
+        value = snapshot.value
+        record = self.record_type()
+        for field, codes in self._columns:
+            code = codes[row]
+            if code != UNSET:
+                setattr(record, field, value(code))
+        record.tags = snapshot.tags(row)
+        record.region_name = self.region_name
+        return index_tags(record, self._intern)
+
+    def filter(self, lookups):
+        """
+        Records matching every lookup. Lookups on fields and tags are
+        checked once per distinct value, anything else against each
+        remaining record.
+        """
+        rows = xrange(len(self))
+        for lookup in lookups:
+            rows = self._matching(lookup, rows)
+        return [self[row] for row in rows]
+
+    def _matching(self, lookup, rows):
+        "The rows matching a lookup"
+        snapshot, key = self.snapshot, lookup.key
+        if key in snapshot.fields:
+            attrs = snapshot.column(key)
+        elif hasattr(self.record_type, key):
+            # Not a value from the snapshot, such as region_name
+            return [row for row in rows if lookup(self[row])]
+        else:
+            attrs = None
+        tags = snapshot.tag_column(key)
+        attr_results, tag_results = {UNSET: FALLBACK}, {UNSET: lookup.missing}
+        matches = []
+        for row in rows:
+            result = FALLBACK
+            if attrs is not None:
+                code = attrs[row]
+                try:
+                    result = attr_results[code]
+                except KeyError:
+                    try:
+                        result = bool(lookup.attr_test(snapshot.value(code)))
+                    except AttributeError:
+                        pass
+                    attr_results[code] = result
+            if result == FALLBACK:
+                code = tags[row]
+                try:
+                    result = tag_results[code]
+                except KeyError:
+                    result = lookup.tag_test(snapshot.value(code))
+                    tag_results[code] = result
+            if result:
+                matches.append(row)
+        return matches
+
+
+class SharedSnapshotStore(SnapshotStore):
+    """
+    A SnapshotStore for many processes on one host, such as the
+    workers of a web server. Snapshots hold compact_fields and tags in
+    a layout that each process maps read only, so the data is in
+    memory once, however many processes use it. Records are only built
+    for the rows a process actually uses, and filters are evaluated
+    against the mapped values.
+
+    New generations are written to a new file that's renamed into
+    place, so processes still using the old one are unaffected, and
+    pick up the new one on their next refresh.
+
+    Processes loading a shared snapshot always get compact records,
+    as if ``compact = True`` was set.
+
+    >>> ec2.base.objects_base.snapshots = SharedSnapshotStore(max_age=300)
+    >>> ec2.base.objects_base.ttl = 60
+    """
+
+    extension = 'shared'
+
+    def load(self, cls):
+        """
+        Return (MappedRows, fetched_at) from a snapshot that is younger
+        than max_age, or None if there isn't a usable one.
+        """
+        if not self.safe():
+            return None
+        try:
+            with open(self.filename(cls), 'rb') as f:
+                snapshot = MappedSnapshot(f)
+        except (IOError, EnvironmentError, ValueError, KeyError,
+                struct.error):
+            return None
+        record_type = cls._projector().record_type
+        if snapshot.version != VERSION or \
+                snapshot.fields != record_type._projected or \
+                self.expired(snapshot.fetched_at):
+            return None
+        region_name = cls.region_name or cls._credentials()['region_name']
+        return (MappedRows(snapshot, record_type, region_name),
+                snapshot.fetched_at)
+
+    def save(self, cls, objects, fetched_at):
+        "Atomically write a new generation of the snapshot for a type"
+        project = cls._projector()
+        fields = project.record_type._projected
+        self._replace(self.filename(cls), lambda f: write(
+            f, objects, fields, fetched_at, project.value))
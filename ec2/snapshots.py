@@ -0,0 +1,196 @@
+"""
+ec2.snapshots
+~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import cPickle as pickle
+import errno
+import logging
+import os
+import stat
+import time
+from contextlib import contextmanager
+
+from ec2.connection import get_connection, get_vpc_connection
+
+logger = logging.getLogger('ec2')
+
+# Bump whenever the file layout changes, so old snapshots are ignored
+VERSION = 1
+
+
+def _persistent_id(obj):
+    """
+    Connections are never written to disk, they hold credentials and
+    sockets. They're swapped for a marker, and on load reattached to
+    the long lived connection from get_connection(), which is never
+    handed out by the pool.
+    """
+    from boto.connection import AWSAuthConnection
+    if isinstance(obj, AWSAuthConnection):
+        from boto.vpc import VPCConnection
+        return 'vpc' if isinstance(obj, VPCConnection) else 'ec2'
+    return None
+
+
+def _reconnect(pid, cls):
+    if pid == 'vpc':
+        return get_vpc_connection(cls.region_name, cls.session)
+    if pid == 'ec2':
+        return get_connection(cls.region_name, cls.session)
+    raise pickle.UnpicklingError('Unknown persistent id %r' % pid)
+
+
+class SnapshotStore(object):
+    """
+    Keeps serialized copies of cached results on local disk, so
+    short lived processes can skip the API entirely on their first
+    all() as long as a recent enough snapshot exists.
+
+    Snapshots are keyed by type, region and access key, and replaced
+    atomically so concurrent readers never see a partial file.
+
+    They're kept in ~/.cache/python-ec2 by default. Loading a pickle
+    can run any code, so a directory that isn't owned by the current
+    user, or that anyone else can access, is never used.
+
+    >>> ec2.instances.snapshots = SnapshotStore(max_age=300)
+    """
+
+    extension = 'pickle'
+
+    def __init__(self, path=None, max_age=300):
+        if path is None:
+            path = os.path.join(
+                os.path.expanduser('~'), '.cache', 'python-ec2')
+        self.path = path
+        self.max_age = max_age
+
+    def filename(self, cls):
+        "Path of the snapshot for a type with the current credentials"
+        import hashlib
+        creds = cls._credentials()
+        # Never put the key itself in a filename
+        digest = hashlib.sha1(
+            creds['aws_access_key_id'] or '').hexdigest()[:16]
+        region_name = cls.region_name or creds['region_name']
+        return os.path.join(self.path, '%s-%s-%s.%s' % (
+            cls.__name__, region_name, digest, self.extension))
+
+    def expired(self, fetched_at):
+        "Whether a snapshot fetched at the given time is too old to use"
+        return time.time() - fetched_at > self.max_age
+
+    def load(self, cls):
+        """
+        Return (objects, fetched_at) from a snapshot that is younger
+        than max_age, or None if there isn't a usable one.
+        """
+        if not self.safe():
+            return None
+        try:
+            with open(self.filename(cls), 'rb') as f:
+                unpickler = pickle.Unpickler(f)
+                unpickler.persistent_load = self._reconnector(cls)
+                version, fetched_at, objects = unpickler.load()
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        if version != VERSION or self.expired(fetched_at):
+            return None
+        return objects, fetched_at
+
+    def _reconnector(self, cls):
+        "persistent_load() for a load, creating each connection once"
+        connections = {}
+
+        def persistent_load(pid):
+            try:
+                return connections[pid]
+            except KeyError:
+                connection = connections[pid] = _reconnect(pid, cls)
+                return connection
+        return persistent_load
+
+    def save(self, cls, objects, fetched_at):
+        "Atomically write a new snapshot for a type"
+        def dump(f):
+            pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = _persistent_id
+            pickler.dump((VERSION, fetched_at, list(objects)))
+        self._replace(self.filename(cls), dump)
+
+    def safe(self):
+        """
+        Whether the directory is owned by the current user, and nobody
+        else can read or write it, so no one else can plant a snapshot
+        """
+        if not hasattr(os, 'getuid'):
+            # Windows, where home directories are private already
+            return True
+        try:
+            st = os.lstat(self.path)
+        except OSError:
+            return False
+        return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and \
+            not st.st_mode & 0077
+
+    def _makedirs(self):
+        try:
+            os.makedirs(self.path, 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        if not self.safe():
+            raise IOError(errno.EPERM, 'Refusing to keep snapshots in a '
+                          'directory other users can access', self.path)
+
+    def _replace(self, filename, write):
+        "Call write() with a temporary file, then rename it to filename"
+        import tempfile
+        self._makedirs()
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            # rename() is atomic, readers see either the old or new file
+            os.rename(tmp, filename)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    @contextmanager
+    def lock(self, cls):
+        """
+        Held while looking for a snapshot and fetching a new one, so
+        when many processes need one at once, only one of them calls
+        the API and the others load its snapshot.
+        """
+        try:
+            import fcntl
+        except ImportError:
+            # Not available on Windows, where every process fetches
+            yield
+            return
+        try:
+            self._makedirs()
+        except (IOError, OSError):
+            logger.exception('Unable to lock %s snapshot', cls.__name__)
+            yield
+            return
+        with open(self.filename(cls) + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def delete(self, cls):
+        "Remove the snapshot for a type, if there is one"
+        try:
+            os.unlink(self.filename(cls))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
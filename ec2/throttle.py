@@ -0,0 +1,235 @@
+"""
+ec2.throttle
+~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger('ec2')
+
+#: The API action behind each boto method, which is what AWS limits by
+ACTIONS = {
+    'get_all_instances': 'DescribeInstances',
+    'get_all_reservations': 'DescribeInstances',
+    'get_only_instances': 'DescribeInstances',
+    'get_all_security_groups': 'DescribeSecurityGroups',
+    'get_all_vpcs': 'DescribeVpcs',
+    'get_all_subnets': 'DescribeSubnets',
+    'get_all_volumes': 'DescribeVolumes',
+    'get_all_network_interfaces': 'DescribeNetworkInterfaces',
+    'get_all_images': 'DescribeImages',
+    'get_all_regions': 'DescribeRegions',
+}
+
+
+class TokenBucket(object):
+    """
+    Hands out up to ``rate`` requests a second, and up to ``burst`` at
+    once after being idle. The rate is halved whenever AWS throttles a
+    request anyway, and creeps back up with every one that succeeds.
+    """
+
+    #: Lowest fraction of the configured rate backing off goes down to
+    floor = 1 / 16.0
+
+    #: Fraction of the configured rate regained per successful request
+    step = 1 / 20.0
+
+    def __init__(self, rate, burst):
+        self.limit = float(rate)
+        self.rate = self.limit
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.requests = self.throttled = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """
+        Wait for a token. Callers queue up by taking tokens they don't
+        have yet, and waiting until they would have been refilled.
+        """
+        with self._lock:
+            self._refill(time.time())
+            self.tokens -= 1
+            self.requests += 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.waited += delay
+        if delay:
+            time.sleep(delay)
+
+    def backoff(self):
+        "Slow down after being throttled"
+        with self._lock:
+            self._refill(time.time())
+            self.throttled += 1
+            self.rate = max(self.limit * self.floor, self.rate / 2)
+            # Nobody else goes ahead on tokens AWS disagreed with
+            self.tokens = min(self.tokens, 0)
+
+    def recover(self):
+        "Speed up again after a request went through"
+        if self.rate < self.limit:
+            with self._lock:
+                self.rate = min(self.limit, self.rate + self.limit * self.step)
+
+
+class Throttle(object):
+    """
+    Client side rate limits for API calls, shared by every thread,
+    so fanning out over regions, pages and chunks doesn't run into
+    RequestLimitExceeded. Each region has a token bucket, by default
+    shared by every action like AWS's own for describe calls, and
+    actions with limits of their own get their own buckets.
+
+    Throttling errors that happen anyway slow the bucket down and are
+    retried after an exponential, jittered backoff.
+
+    rate: requests per second per region, or None for no limit
+    burst: requests allowed at once after being idle
+    limits: (rate, burst) for particular actions, regions or
+        (region, action) pairs, such as ``{'DescribeImages': (5, 10)}``
+    retries: times a throttled call is retried before giving up
+    backoff: seconds to wait before the first retry, doubling with
+        each one up to max_backoff
+
+    >>> ec2.throttle.throttle.configure(rate=10, limits={
+    ...     ('eu-west-1', 'DescribeInstances'): (5, 20),
+    ... })
+    """
+
+    #: Error codes meaning the request was rejected for going too fast
+    throttling_errors = ('RequestLimitExceeded', 'Throttling',
+                         'ThrottlingException')
+
+    def __init__(self, rate=20, burst=100, limits=None, retries=5,
+                 backoff=0.5, max_backoff=20):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.configure(rate, burst, limits, retries, backoff, max_backoff)
+
+    def configure(self, rate=20, burst=100, limits=None, retries=5,
+                  backoff=0.5, max_backoff=20):
+        "Change the limits, starting every bucket over"
+        with self._lock:
+            self.rate = rate
+            self.burst = burst
+            self.limits = dict(limits or {})
+            self.retries = retries
+            self.backoff = backoff
+            self.max_backoff = max_backoff
+            self._buckets = {}
+
+    def bucket(self, region_name, action):
+        "The TokenBucket for an action in a region, or None if unlimited"
+        limits = self.limits
+        if (region_name, action) in limits:
+            key, limit = (region_name, action), limits[region_name, action]
+        elif action in limits:
+            key, limit = (region_name, action), limits[action]
+        else:
+            key = (region_name, None)
+            limit = limits.get(region_name, (self.rate, self.burst))
+        if limit[0] is None:
+            return None
+        try:
+            return self._buckets[key]
+        except KeyError:
+            with self._lock:
+                return self._buckets.setdefault(key, TokenBucket(*limit))
+
+    def call(self, region_name, action, function, *args, **kwargs):
+        """
+        Call a function making an API request, waiting for its bucket
+        and retrying if it's throttled anyway
+        """
+        bucket = self.bucket(region_name, action)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.take()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                if getattr(e, 'error_code', None) not in \
+                        self.throttling_errors or attempt >= self.retries:
+                    raise
+                if bucket is not None:
+                    bucket.backoff()
+                # Full jitter, so callers throttled together don't all
+                # come back at the same moment
+                delay = random.uniform(0, min(
+                    self.max_backoff, self.backoff * 2 ** attempt))
+                logger.info('%s throttled in %s, retrying in %.2fs',
+                            action, region_name, delay)
+                time.sleep(delay)
+                attempt += 1
+            else:
+                if bucket is not None:
+                    bucket.recover()
+                return result
+
+    def wrap(self, connection, region_name):
+        "A connection whose describe calls go through this throttle"
+        return Throttled(connection, self, region_name)
+
+    def stats(self):
+        """
+        Counters for every bucket, keyed by (region, action), action
+        being None for the bucket actions share by default
+
+        >>> ec2.throttle.throttle.stats()
+        {('us-east-1', None): {'requests': 120, 'throttled': 2,
+                               'waited': 1.5, 'rate': 12.5}}
+        """
+        with self._lock:
+            buckets = self._buckets.items()
+        return dict((key, {
+            'requests': bucket.requests,
+            'throttled': bucket.throttled,
+            'waited': bucket.waited,
+            'rate': bucket.rate,
+        }) for key, bucket in buckets)
+
+
+class Throttled(object):
+    "A connection whose describe calls go through a Throttle"
+
+    def __init__(self, connection, throttle, region_name):
+        self.connection = connection
+        self.throttle = throttle
+        self.region_name = region_name
+
+    def __getattr__(self, name):
+        attr = getattr(self.connection, name)
+        if not name.startswith('get_') or not callable(attr):
+            return attr
+        action = ACTIONS.get(name, name)
+
+        def throttled(*args, **kwargs):
+            return self.throttle.call(self.region_name, action, attr,
+                                      *args, **kwargs)
+        return throttled
+
+
+#: Used by every type outside of an ec2.Session
+throttle = Throttle()
+
+
+def get_throttle(session=None):
+    "The Throttle for a session, or the global one"
+    if session is not None:
+        return session.throttle
+    return throttle
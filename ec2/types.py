@@ -6,35 +6,358 @@ ec2.types
 :license: BSD, see LICENSE for more details.
 """
 
-from ec2.connection import get_connection, get_vpc_connection
+import datetime
+from contextlib import contextmanager
+
+from ec2.connection import (acquire_connection, acquire_vpc_connection,
+                            leased)
 from ec2.base import objects_base
+from ec2.instrumentation import timed
+from ec2.related import ForeignKey, Reverse
+from ec2.throttle import get_throttle
+
+
+def _ec2(cls):
+    "Lease an EC2 connection for a type's region and session"
+    return _leased(cls, acquire_connection(cls.region_name, cls.session))
+
+
+def _vpc(cls):
+    "Lease a VPC connection for a type's region and session"
+    return _leased(
+        cls, acquire_vpc_connection(cls.region_name, cls.session))
+
+
+@contextmanager
+def _leased(cls, connection):
+    "leased(), with API calls going through the session's throttle"
+    region_name = cls.region_name or cls._credentials()['region_name']
+    with leased(connection) as connection:
+        yield get_throttle(cls.session).wrap(connection, region_name)
+
+
+def _attached_instance(obj):
+    "Id of the instance a volume or network interface is attached to"
+    # Volumes call it attach_data, and either can be missing
+    attachment = getattr(obj, 'attach_data', None) or \
+        getattr(obj, 'attachment', None)
+    return getattr(attachment, 'instance_id', None)
+
+
+def _joined_group_ids(obj):
+    "Ids of a boto object's security groups, kept by compact records"
+    return ' '.join(g.id for g in obj.groups)
+
+
+def _group_ids(obj):
+    "Ids of the security groups of a boto object or a compact record"
+    try:
+        return obj.group_ids.split()
+    except AttributeError:
+        return [g.id for g in obj.groups]
 
 
 class instances(objects_base):
     "Singleton to stem off queries for instances"
 
+    api_filters = {
+        'id': 'instance-id',
+        'state': 'instance-state-name',
+        'name': 'tag-value',
+        'image_id': 'image-id',
+        'instance_type': 'instance-type',
+        'key_name': 'key-name',
+        'public_dns_name': 'dns-name',
+        'private_dns_name': 'private-dns-name',
+        'ip_address': 'ip-address',
+        'private_ip_address': 'private-ip-address',
+        'root_device_type': 'root-device-type',
+        'placement': 'availability-zone',
+        'subnet_id': 'subnet-id',
+        'vpc_id': 'vpc-id',
+    }
+
+    compact_fields = (
+        'id', 'state', 'instance_type', 'image_id', 'placement',
+        'private_ip_address', 'ip_address', 'private_dns_name',
+        'public_dns_name', 'key_name', 'launch_time', 'vpc_id',
+        'subnet_id', 'root_device_type', 'architecture', 'platform',
+        'group_ids',
+    )
+
+    derived_fields = {'group_ids': _joined_group_ids}
+
+    related = {
+        'vpc': ForeignKey('vpcs', 'vpc_id'),
+        'subnet': ForeignKey('subnets', 'subnet_id'),
+        'image': ForeignKey('images', 'image_id'),
+        'security_groups': ForeignKey(
+            'security_groups', _group_ids, many=True),
+        'volumes': Reverse(
+            'volumes', _attached_instance, 'attachment.instance-id'),
+        'network_interfaces': Reverse(
+            'network_interfaces', _attached_instance,
+            'attachment.instance-id'),
+    }
+
+    #: States an instance only passes through. Instances in them, or
+    #: running or terminated, are described again on every incremental
+    #: refresh until they settle or disappear.
+    transitional_states = ('pending', 'stopping', 'shutting-down')
+
+    #: Longest gap an incremental refresh covers with launch-time
+    #: filters before falling back to listing everything
+    max_incremental_days = 7
+
     @classmethod
-    def _all(cls):
+    def _all(cls, filters=None):
         "Grab all AWS instances"
-        return [
-            i for r in get_connection().get_all_instances()
-            for i in r.instances
-        ]
+        with _ec2(cls) as connection:
+            return [
+                i for r in connection.get_all_instances(filters=filters)
+                for i in r.instances
+            ]
+
+    @classmethod
+    def _changes(cls, since, cached):
+        """
+        Instances launched (or started again) since the last fetch,
+        every instance in a transitional state, and the cached ones
+        that were running, transitional or terminated, by id. That
+        finds the ones that stopped, terminated or are gone since,
+        without listing every stopped instance. Its cost grows with
+        the running instances, at 200 ids a call.
+
+        Changes that skip all of those, such as retagging, are only
+        picked up by a full refresh, so it's worth running one every
+        so often.
+        """
+        # launch-time only matches wildcards, so ask for whole days,
+        # with some slack for clock skew
+        first = datetime.datetime.utcfromtimestamp(since - 300).date()
+        days = (datetime.datetime.utcnow().date() - first).days + 1
+        if days > cls.max_incremental_days:
+            return cls._query(), None
+        objects = cls._query(filters={'launch-time': [
+            (first + datetime.timedelta(n)).isoformat() + '*'
+            for n in xrange(days)
+        ]})
+        states = cls.transitional_states
+        objects.extend(cls._query(filters={
+            'instance-state-name': list(states)}))
+
+        # Stops and terminations can finish between two refreshes
+        states += ('running', 'terminated')
+        watched = [obj.id for obj in cached
+                   if getattr(obj, 'state', None) in states]
+        # Filters take at most 200 values
+        for n in xrange(0, len(watched), 200):
+            objects.extend(cls._query(filters={
+                'instance-id': watched[n:n + 200]}))
+        return objects, watched
+
+    @classmethod
+    def _pages(cls, filters=None):
+        "Page through AWS instances, following next_token"
+        next_token = None
+        while True:
+            # Only hold a connection while a page is being fetched
+            with timed('fetch', cls, filters=filters) as data:
+                with _ec2(cls) as connection:
+                    reservations = connection.get_all_reservations(
+                        filters=filters,
+                        max_results=cls.page_size,
+                        next_token=next_token,
+                    )
+                page = [i for r in reservations for i in r.instances]
+                data['count'] = len(page)
+            yield page
+            next_token = getattr(reservations, 'next_token', None)
+            if not next_token:
+                break
 
 
 class security_groups(objects_base):
     "Singleton to stem off queries for security groups"
 
+    api_filters = {
+        'id': 'group-id',
+        'name': 'group-name',
+        'description': 'description',
+        'vpc_id': 'vpc-id',
+        'owner_id': 'owner-id',
+    }
+
+    compact_fields = ('id', 'name', 'description', 'vpc_id', 'owner_id')
+
+    related = {
+        'vpc': ForeignKey('vpcs', 'vpc_id'),
+    }
+
     @classmethod
-    def _all(cls):
+    def _all(cls, filters=None):
         "Grab all AWS Security Groups"
-        return get_connection().get_all_security_groups()
+        with _ec2(cls) as connection:
+            return connection.get_all_security_groups(filters=filters)
 
 
 class vpcs(objects_base):
     "Singleton to stem off queries for virtual private clouds"
 
+    service = 'vpc'
+
+    api_filters = {
+        'id': 'vpc-id',
+        'name': 'tag-value',
+        'state': 'state',
+        'cidr_block': 'cidr',
+        'dhcp_options_id': 'dhcp-options-id',
+    }
+
+    compact_fields = (
+        'id', 'state', 'cidr_block', 'is_default', 'instance_tenancy',
+        'dhcp_options_id',
+    )
+
+    related = {
+        'subnets': Reverse('subnets', 'vpc_id', 'vpc-id'),
+    }
+
     @classmethod
-    def _all(cls):
+    def _all(cls, filters=None):
         "Grab all AWS Virtual Private Clouds"
-        return get_vpc_connection().get_all_vpcs()
+        with _vpc(cls) as connection:
+            return connection.get_all_vpcs(filters=filters)
+
+
+class subnets(objects_base):
+    "Singleton to stem off queries for VPC subnets"
+
+    service = 'vpc'
+
+    api_filters = {
+        'id': 'subnet-id',
+        'name': 'tag-value',
+        'state': 'state',
+        'vpc_id': 'vpc-id',
+        'cidr_block': 'cidr',
+        'availability_zone': 'availability-zone',
+    }
+
+    compact_fields = (
+        'id', 'state', 'vpc_id', 'cidr_block', 'availability_zone',
+        'available_ip_address_count',
+    )
+
+    related = {
+        'vpc': ForeignKey('vpcs', 'vpc_id'),
+    }
+
+    @classmethod
+    def _all(cls, filters=None):
+        "Grab all AWS VPC subnets"
+        with _vpc(cls) as connection:
+            return connection.get_all_subnets(filters=filters)
+
+
+class volumes(objects_base):
+    "Singleton to stem off queries for EBS volumes"
+
+    api_filters = {
+        'id': 'volume-id',
+        'name': 'tag-value',
+        'status': 'status',
+        'size': 'size',
+        'snapshot_id': 'snapshot-id',
+        'zone': 'availability-zone',
+        'type': 'volume-type',
+    }
+
+    compact_fields = (
+        'id', 'status', 'size', 'type', 'zone', 'snapshot_id', 'iops',
+        'encrypted', 'create_time',
+    )
+
+    related = {
+        'instance': ForeignKey('instances', _attached_instance),
+    }
+
+    @classmethod
+    def _all(cls, filters=None):
+        "Grab all AWS EBS volumes"
+        with _ec2(cls) as connection:
+            return connection.get_all_volumes(filters=filters)
+
+
+class network_interfaces(objects_base):
+    "Singleton to stem off queries for elastic network interfaces"
+
+    api_filters = {
+        'id': 'network-interface-id',
+        'status': 'status',
+        'description': 'description',
+        'subnet_id': 'subnet-id',
+        'vpc_id': 'vpc-id',
+        'availability_zone': 'availability-zone',
+        'private_ip_address': 'private-ip-address',
+        'mac_address': 'mac-address',
+        'owner_id': 'owner-id',
+    }
+
+    compact_fields = (
+        'id', 'status', 'description', 'subnet_id', 'vpc_id',
+        'availability_zone', 'private_ip_address', 'mac_address',
+        'owner_id', 'group_ids',
+    )
+
+    derived_fields = {'group_ids': _joined_group_ids}
+
+    related = {
+        'vpc': ForeignKey('vpcs', 'vpc_id'),
+        'subnet': ForeignKey('subnets', 'subnet_id'),
+        'instance': ForeignKey('instances', _attached_instance),
+        'security_groups': ForeignKey(
+            'security_groups', _group_ids, many=True),
+    }
+
+    @classmethod
+    def _all(cls, filters=None):
+        "Grab all AWS network interfaces"
+        with _ec2(cls) as connection:
+            return connection.get_all_network_interfaces(filters=filters)
+
+
+class images(objects_base):
+    "Singleton to stem off queries for AMIs"
+
+    api_filters = {
+        'id': 'image-id',
+        'name': 'name',
+        'state': 'state',
+        'owner_id': 'owner-id',
+        'architecture': 'architecture',
+        'platform': 'platform',
+        'type': 'image-type',
+        'root_device_type': 'root-device-type',
+        'virtualization_type': 'virtualization-type',
+        'description': 'description',
+    }
+
+    compact_fields = (
+        'id', 'name', 'state', 'owner_id', 'architecture', 'platform',
+        'type', 'root_device_type', 'virtualization_type', 'description',
+    )
+
+    #: Whose images to list. Every public image is listed without it,
+    #: which is far too many. Looking images up by id ignores it, so
+    #: public images instances were launched from can still be found.
+    owners = ('self',)
+
+    @classmethod
+    def _all(cls, filters=None):
+        "Grab all AWS images owned by owners"
+        owners = None
+        if not filters or 'image-id' not in filters:
+            owners = list(cls.owners)
+        with _ec2(cls) as connection:
+            return connection.get_all_images(owners=owners, filters=filters)
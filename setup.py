@@ -7,9 +7,14 @@ A light-weight wrapper around boto to query for AWS EC2 instances,
 security groups, and VPCs in a sane way.
 """
 
+import re
+
 from setuptools import setup, find_packages
 from setuptools.command.test import test as TestCommand
 
+with open('ec2/__init__.py') as f:
+    version = re.search(r"__version__ = '([^']+)'", f.read()).group(1)
+
 
 install_requires = [
     'boto',
@@ -21,6 +26,10 @@ tests_require = [
     'pytest-cov',
 ]
 
+extras_require = {
+    'columnar': ['numpy'],
+}
+
 
 class PyTest(TestCommand):
     def finalize_options(self):
@@ -35,7 +44,7 @@ class PyTest(TestCommand):
 
 setup(
     name='ec2',
-    version='0.4.0',
+    version=version,
     author='Matt Robenolt',
     author_email='matt@ydekproductions.com',
     url='https://github.com/mattrobenolt/ec2',
@@ -43,6 +52,7 @@ setup(
     long_description=__doc__,
     packages=find_packages(exclude=('tests',)),
     install_requires=install_requires,
+    extras_require=extras_require,
     tests_require=tests_require,
     license='BSD',
     cmdclass={'test': PyTest},
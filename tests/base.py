@@ -1,12 +1,20 @@
+from boto.ec2.image import Image
 from boto.ec2.instance import Instance, InstanceState
-
+from boto.ec2.networkinterface import Attachment, NetworkInterface
 from boto.ec2.securitygroup import SecurityGroup
+from boto.ec2.volume import AttachmentSet, Volume
+from boto.vpc.subnet import Subnet
 from boto.vpc.vpc import VPC
 from mock import MagicMock, patch
 import unittest
 
 import ec2
 
+TYPES = (
+    ec2.instances, ec2.security_groups, ec2.vpcs, ec2.subnets, ec2.volumes,
+    ec2.network_interfaces, ec2.images,
+)
+
 RUNNING_STATE = InstanceState(16, 'running')
 STOPPED_STATE = InstanceState(64, 'stopped')
 
@@ -32,7 +40,7 @@ class BaseTestCase(unittest.TestCase):
             i2.tags = {'Name': 'instance-%d' % instance_count}
             instance_count += 1
             reservation = MagicMock()
-            reservation.instances.__iter__ = MagicMock(return_value=iter([i1, i2]))
+            reservation.instances = [i1, i2]
             reservations.append(reservation)
 
         security_groups = []
@@ -59,23 +67,72 @@ class BaseTestCase(unittest.TestCase):
             vpc.dhcp_options_id = 'dopt-abc%d' % i
             vpcs.append(vpc)
 
+        # One subnet in each VPC
+        subnets = []
+        for i in xrange(2):
+            subnet = Subnet()
+            subnet.id = 'subnet-abc%d' % i
+            subnet.vpc_id = 'vpc-abc%d' % i
+            subnet.state = 'available'
+            subnet.cidr_block = '10.%d.1.0/24' % i
+            subnet.availability_zone = 'us-east-1a'
+            subnets.append(subnet)
+
+        # Two volumes attached to i-abc0, one to i-abc1, one unattached
+        volumes = []
+        for i, instance_id in enumerate(('i-abc0', 'i-abc0', 'i-abc1', None)):
+            volume = Volume()
+            volume.id = 'vol-abc%d' % i
+            volume.status = 'in-use' if instance_id else 'available'
+            volume.size = 8
+            volume.attach_data = AttachmentSet()
+            volume.attach_data.instance_id = instance_id
+            volumes.append(volume)
+
+        # One network interface, attached to i-abc0
+        interface = NetworkInterface()
+        interface.id = 'eni-abc0'
+        interface.subnet_id = 'subnet-abc0'
+        interface.vpc_id = 'vpc-abc0'
+        interface.status = 'in-use'
+        interface.attachment = Attachment()
+        interface.attachment.instance_id = 'i-abc0'
+        network_interfaces = [interface]
+
+        images = []
+        for i in xrange(2):
+            image = Image()
+            image.id = 'ami-abc%d' % i
+            image.name = 'image-%d' % i
+            image.state = 'available'
+            images.append(image)
+
         self.connection = MagicMock()
         self.connection.get_all_instances = MagicMock(return_value=reservations)
         self.connection.get_all_security_groups = MagicMock(return_value=security_groups)
+        self.connection.get_all_volumes = MagicMock(return_value=volumes)
+        self.connection.get_all_network_interfaces = MagicMock(return_value=network_interfaces)
+        self.connection.get_all_images = MagicMock(return_value=images)
 
         self.vpc_connection = MagicMock()
         self.vpc_connection.get_all_vpcs = MagicMock(return_value=vpcs)
+        self.vpc_connection.get_all_subnets = MagicMock(return_value=subnets)
 
     def tearDown(self):
         ec2.credentials.ACCESS_KEY_ID = None
         ec2.credentials.SECRET_ACCESS_KEY = None
         ec2.credentials.REGION_NAME = 'us-east-1'
-        ec2.instances.clear()
-        ec2.security_groups.clear()
-        ec2.vpcs.clear()
+        ec2.connection.pool.clear()
+        ec2.connection._regions = None
+        ec2.connection._connections.clear()
+        ec2.throttle.throttle.configure()
+        for cls in TYPES:
+            cls.clear()
+            for key in cls._stats:
+                cls._stats[key] = 0
 
     def _patch_connection(self):
-        return patch('ec2.types.get_connection', return_value=self.connection)
+        return patch('ec2.types.acquire_connection', return_value=self.connection)
 
     def _patch_vpc_connection(self):
-        return patch('ec2.types.get_vpc_connection', return_value=self.vpc_connection)
+        return patch('ec2.types.acquire_vpc_connection', return_value=self.vpc_connection)
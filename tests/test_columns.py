@@ -0,0 +1,103 @@
+from .base import BaseTestCase, RUNNING_STATE, STOPPED_STATE
+from boto.ec2.instance import Instance
+from mock import patch
+import pytest
+
+import ec2
+from ec2.columns import ColumnStore
+
+# unittest.skipIf is new in 2.7
+pytest.importorskip('numpy')
+
+
+class ColumnStoreTestCase(BaseTestCase):
+    def setUp(self):
+        super(ColumnStoreTestCase, self).setUp()
+        self.instances = []
+        for n in xrange(12):
+            i = Instance()
+            i.id = 'i-abc%d' % n
+            i._state = RUNNING_STATE if n % 3 else STOPPED_STATE
+            i.ip_address = '10.0.0.%d' % n if n % 2 else None
+            i.tags = {'Name': 'Web-%02d' % n, 'role': 'db' if n % 4 else 'web'}
+            if n % 5 == 0:
+                del i.tags['role']
+                i.tags['ip_address'] = 'tagged'
+            self.instances.append(ec2.helpers.index_tags(i))
+        self.store = ColumnStore(self.instances)
+
+    def tearDown(self):
+        super(ColumnStoreTestCase, self).tearDown()
+        ec2.instances.columnar = False
+
+    def test_matches_plan(self):
+        lookups = {
+            'exact': ['running', 'Web-03', 'db', None, '10.0.0.3', 'tagged'],
+            'iexact': ['RUNNING', 'web-03', 'DB', 'TAGGED'],
+            'like': [r'^r', r'^Web-0\d$', r'^10\.'],
+            'ilike': [r'^R', r'^web-1\d$', r'^TAG'],
+            'contains': ['unn', 'eb', '0.0'],
+            'icontains': ['UNN', 'EB', 'tag'],
+            'startswith': ['run', 'Web', '10.'],
+            'istartswith': ['RUN', 'web', 'TAG'],
+            'endswith': ['ing', '-05', 'ed'],
+            'iendswith': ['ING', 'ED'],
+            'isnull': [True, False],
+        }
+        for comparison, values in lookups.items():
+            for key in ('state', 'name', 'role', 'ip_address', 'lol'):
+                for value in values:
+                    plan = ec2.helpers.Plan(**{'%s__%s' % (key, comparison): value})
+                    try:
+                        expected = plan.filter(self.instances)
+                    except TypeError:
+                        # Such as a regex against None, which has to fail the same way
+                        self.assertRaises(TypeError, self.store.filter, plan.lookups)
+                        continue
+                    self.assertEquals(
+                        expected,
+                        self.store.filter(plan.lookups),
+                        (key, comparison, value),
+                    )
+
+    def test_multiple(self):
+        plan = ec2.helpers.Plan(state='running', role='db', name__istartswith='WEB-0')
+        expected = plan.filter(self.instances)
+        self.assertEquals(['i-abc1', 'i-abc2', 'i-abc7'], [i.id for i in expected])
+        self.assertEquals(expected, self.store.filter(plan.lookups))
+
+    def test_unhashable(self):
+        self.assertEquals(None, self.store.column('groups'))
+        plan = ec2.helpers.Plan(groups=[], state='running')
+        # Only the lookups that could be vectorized were applied
+        self.assertEquals(8, len(self.store.filter(plan.lookups)))
+        objects, remaining = self.store.split(plan.lookups)
+        self.assertEquals(8, len(objects))
+        self.assertEquals(['groups'], [lookup.key for lookup in remaining])
+
+    def test_columns_reused(self):
+        column = self.store.column('state')
+        self.assertTrue(column is self.store.column('state'))
+        self.assertEquals(['stopped', 'running'], column.attr_values)
+
+    def test_columnar(self):
+        ec2.instances.columnar = True
+        with self._patch_connection():
+            store = ec2.instances.columns()
+            self.assertTrue(store is ec2.instances.columns())
+            self.assertEquals(['i-abc0', 'i-abc2'], [i.id for i in ec2.instances.filter(state__startswith='run')])
+            self.assertEquals(['i-abc3'], [i.id for i in ec2.instances.filter(state='stopped', name__endswith='3')])
+            ec2.instances.clear()
+            self.assertFalse(store is ec2.instances.columns())
+
+    def test_columnar_skips_indexes(self):
+        ec2.instances.columnar = True
+        with self._patch_connection():
+            ec2.instances.all()
+            with patch('ec2.helpers.Lookup.__call__') as called:
+                with patch.object(ec2.instances, 'index') as index:
+                    self.assertEquals(['i-abc1', 'i-abc3'], [i.id for i in ec2.instances.filter(state='stopped')])
+                    self.assertEquals(['i-abc1'], [i.id for i in ec2.instances.filter(id__in=['i-abc1', 'i-abc2'], state='stopped')])
+            # Everything was answered by the column store
+            self.assertFalse(index.called)
+            self.assertFalse(called.called)
@@ -1,5 +1,8 @@
 from .base import BaseTestCase
-from mock import patch
+from boto.exception import BotoServerError
+from mock import MagicMock, patch
+import threading
+import time
 
 import ec2
 
@@ -14,6 +17,144 @@ class ConnectionTestCase(BaseTestCase):
             ec2.connection.get_vpc_connection()
             mock.assert_called_once_with(aws_access_key_id='abc', aws_secret_access_key='xyz', region_name='us-east-1')
 
+    def test_connect_region(self):
+        with patch('boto.ec2.connect_to_region') as mock:
+            ec2.connection.get_connection('us-west-2')
+            mock.assert_called_once_with(aws_access_key_id='abc', aws_secret_access_key='xyz', region_name='us-west-2')
+
+    def test_shared(self):
+        "get_connection() hands out one long lived connection, never pooled"
+        with patch('boto.ec2.connect_to_region', side_effect=lambda **params: MagicMock()) as mock:
+            connection = ec2.connection.get_connection()
+            self.assertTrue(connection is ec2.connection.get_connection())
+            self.assertFalse(connection is ec2.connection.get_connection('us-west-2'))
+            with ec2.connection.leased(ec2.connection.acquire_connection()) as pooled:
+                self.assertFalse(connection is pooled)
+            self.assertEquals(3, mock.call_count)
+
+    def test_reattached(self):
+        "Cached objects don't hold on to the pooled connection they came from"
+        with self._patch_connection():
+            with patch('boto.ec2.connect_to_region') as mock:
+                instances = ec2.instances.all()
+                self.assertTrue(instances[0].connection is mock.return_value)
+                self.assertTrue(instances[3].connection is mock.return_value)
+                self.assertTrue(ec2.instances.describe('i-abc1').connection is mock.return_value)
+                mock.assert_called_once_with(aws_access_key_id='abc', aws_secret_access_key='xyz', region_name='us-east-1')
+
+        with self._patch_vpc_connection():
+            with patch('boto.vpc.connect_to_region') as mock:
+                self.assertTrue(ec2.vpcs.all()[0].connection is mock.return_value)
+
+    def test_regions(self):
+        regions = [MagicMock(), MagicMock()]
+        regions[0].name, regions[1].name = 'us-east-1', 'us-west-2'
+        with patch('boto.ec2.connect_to_region') as mock:
+            mock.return_value.get_all_regions.return_value = regions
+            self.assertEquals(['us-east-1', 'us-west-2'], ec2.connection.get_regions())
+            ec2.connection.get_regions()
+            mock.return_value.get_all_regions.assert_called_once_with()
+
+
+class ConnectionPoolTestCase(BaseTestCase):
+    def setUp(self):
+        super(ConnectionPoolTestCase, self).setUp()
+        self.pool = ec2.connection.ConnectionPool(size=1, max_idle=60)
+        self.connect = MagicMock(side_effect=lambda **params: MagicMock())
+        self.pool.connectors = {'ec2': self.connect}
+
+    def test_reuse(self):
+        first = self.pool.acquire()
+        # Checked out connections are never handed out twice
+        second = self.pool.acquire()
+        self.assertFalse(first is second)
+        self.pool.release(first)
+        self.assertTrue(first is self.pool.acquire())
+        self.assertEquals(2, self.connect.call_count)
+
+    def test_keyed(self):
+        first = self.pool.acquire()
+        self.pool.release(first)
+        self.assertFalse(first is self.pool.acquire(region_name='us-west-2'))
+        self.pool.release(first)
+        ec2.credentials.ACCESS_KEY_ID = 'def'
+        self.assertFalse(first is self.pool.acquire())
+
+    def test_size(self):
+        first, second = self.pool.acquire(), self.pool.acquire()
+        self.pool.release(first)
+        self.pool.release(second)
+        second.close.assert_called_once_with()
+        self.assertFalse(first.close.called)
+
+    def test_discard(self):
+        first = self.pool.acquire()
+        self.pool.release(first, discard=True)
+        first.close.assert_called_once_with()
+        self.assertFalse(first is self.pool.acquire())
+
+    def test_idle_eviction(self):
+        first = self.pool.acquire()
+        self.pool.release(first)
+        with patch('time.time', return_value=time.time() + 120):
+            self.assertFalse(first is self.pool.acquire())
+        first.close.assert_called_once_with()
+
+    def test_health_check(self):
+        first = self.pool.acquire()
+        self.pool.release(first)
+        self.pool.health_check = lambda connection: False
+        self.assertFalse(first is self.pool.acquire())
+        first.close.assert_called_once_with()
+
+    def test_unknown_connection(self):
+        self.pool.release(MagicMock())
+
+    def test_leased(self):
+        with patch('ec2.connection.pool', self.pool):
+            with ec2.connection.leased(ec2.connection.acquire_connection()) as first:
+                pass
+            self.assertTrue(first is ec2.connection.acquire_connection())
+            ec2.connection.release_connection(first)
+
+            # Errors from AWS don't make the connection unusable
+            try:
+                with ec2.connection.leased(ec2.connection.acquire_connection()) as first:
+                    raise BotoServerError(503, 'Unavailable')
+            except BotoServerError:
+                pass
+            self.assertFalse(first.close.called)
+
+            try:
+                with ec2.connection.leased(ec2.connection.acquire_connection()) as first:
+                    raise IOError
+            except IOError:
+                pass
+            first.close.assert_called_once_with()
+
+    def test_threads(self):
+        "Concurrent threads never get the same connection at once"
+        seen, shared = [], []
+        lock = threading.Lock()
+
+        def work():
+            for _ in xrange(50):
+                connection = self.pool.acquire()
+                with lock:
+                    if connection in seen:
+                        shared.append(connection)
+                    seen.append(connection)
+                with lock:
+                    seen.remove(connection)
+                self.pool.release(connection)
+
+        threads = [threading.Thread(target=work) for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals([], shared)
+
 
 class CredentialsTestCase(BaseTestCase):
     def test_credentials(self):
@@ -0,0 +1,50 @@
+from mock import MagicMock
+import threading
+import unittest
+
+from ec2.futures import Future, TimeoutError, submit
+
+
+class FutureTests(unittest.TestCase):
+    def test_result(self):
+        future = Future()
+        self.assertFalse(future.done())
+        self.assertRaises(TimeoutError, future.result, 0.01)
+        future.set_result(42)
+        self.assertTrue(future.done())
+        self.assertEquals(42, future.result())
+        self.assertEquals(None, future.exception())
+
+    def test_exception(self):
+        future = submit(lambda: {}['nope'])
+        self.assertRaises(KeyError, future.result, 1)
+        self.assertTrue(isinstance(future.exception(), KeyError))
+
+    def test_callbacks(self):
+        callback = MagicMock()
+        future = Future()
+        future.add_done_callback(callback)
+        self.assertFalse(callback.called)
+        future.set_result(1)
+        callback.assert_called_once_with(future)
+
+        # Already done, so called straight away
+        callback = MagicMock()
+        future.add_done_callback(callback)
+        callback.assert_called_once_with(future)
+
+    def test_then(self):
+        future = Future()
+        doubled = future.then(lambda n: n * 2)
+        failed = future.then(lambda n: n / 0)
+        future.set_result(21)
+        self.assertEquals(42, doubled.result(1))
+        self.assertRaises(ZeroDivisionError, failed.result, 1)
+
+    def test_submit(self):
+        event = threading.Event()
+        future = submit(event.wait, 1)
+        self.assertFalse(future.done())
+        event.set()
+        self.assertEquals(True, future.result(1))
+        self.assertEquals(3, submit(sum, [1, 2]).result(1))
@@ -75,6 +75,10 @@ class ComparisonTests(unittest.TestCase):
             ec2.helpers.make_compare('state__isnull', True, i)
             mock.assert_called_once_with('state', True, i)
 
+        with patch.object(ec2.helpers.Compare, 'in') as mock:
+            ec2.helpers.make_compare('state__in', ['running'], i)
+            mock.assert_called_once_with('state', ['running'], i)
+
     def test_exact(self):
         i = self.instance
         self.assertTrue(ec2.helpers.Compare.exact('state', 'running', i))
@@ -174,7 +178,111 @@ class ComparisonTests(unittest.TestCase):
         self.assertFalse(ec2.helpers.Compare.isnull('name', True, i))
         self.assertFalse(ec2.helpers.Compare.isnull('name', False, i))
 
+    def test_in(self):
+        i = self.instance
+        compare = getattr(ec2.helpers.Compare, 'in')
+        self.assertTrue(compare('state', ['stopped', 'running'], i))
+        self.assertTrue(compare('state', set(['running']), i))
+        self.assertFalse(compare('state', ['stopped'], i))
+        self.assertFalse(compare('state', [], i))
+        self.assertTrue(compare('name', ('awesome', 'other'), i))
+        self.assertFalse(compare('name', ('AWESOME',), i))
+        # A single string is one value, not a list of characters
+        self.assertTrue(compare('name', 'awesome', i))
+        self.assertFalse(compare('name', 'a', i))
+        # Unhashable values on either side still work
+        self.assertTrue(compare('state', [['x'], 'running'], i))
+        i.groups = ['sg-abc']
+        self.assertTrue(compare('groups', [['sg-abc']], i))
+        self.assertFalse(compare('groups', ['sg-abc'], i))
+
     def test_unknown_key(self):
         i = self.instance
-        for attr in ('exact', 'iexact', 'like', 'ilike', 'contains', 'icontains', 'startswith', 'istartswith', 'endswith', 'iendswith'):
+        for attr in ('exact', 'iexact', 'like', 'ilike', 'contains', 'icontains', 'startswith', 'istartswith', 'endswith', 'iendswith', 'in'):
             self.assertFalse(getattr(ec2.helpers.Compare, attr)('lol', 'foo', i))
+
+
+class PlanTests(unittest.TestCase):
+    def setUp(self):
+        self.instance = Instance()
+        self.instance._state = RUNNING_STATE
+        self.instance.id = 'i-abc'
+        self.instance.tags = {'Name': 'Awesome'}
+
+    def test_bad_comparison(self):
+        self.assertRaises(AttributeError, ec2.helpers.Lookup, 'state__nope', 'running')
+        self.assertRaises(AttributeError, ec2.helpers.Plan, state__nope='running')
+
+    def test_lookup_parsing(self):
+        lookup = ec2.helpers.Lookup('name', 'awesome')
+        self.assertEquals(('name', 'exact'), (lookup.key, lookup.comparison))
+        lookup = ec2.helpers.Lookup('private_ip__startswith', '10.')
+        self.assertEquals(('private_ip', 'startswith'), (lookup.key, lookup.comparison))
+
+    def test_regex_compiled_once(self):
+        with patch('ec2.helpers.re.compile', wraps=re.compile) as mock:
+            plan = ec2.helpers.Plan(name__ilike=r'^a.+e$')
+            self.assertTrue(plan(self.instance))
+            self.assertTrue(plan(self.instance))
+            mock.assert_called_once_with(r'^a.+e$', re.I)
+
+    def test_matches_compare(self):
+        i = self.instance
+        values = {
+            'exact': ['running', 'Awesome', 'nope'],
+            'iexact': ['RUNNING', 'AWESOME', 'nope'],
+            'like': [r'^r.+g$', r'^A.+e$', r'^n'],
+            'ilike': [r'^R.+G$', r'^a.+E$', r'^n'],
+            'contains': ['unn', 'wes', 'nope'],
+            'icontains': ['UNN', 'WES', 'wes'],
+            'startswith': ['run', 'Awe', 'nope'],
+            'istartswith': ['RUN', 'awe', 'AWE'],
+            'endswith': ['ing', 'some', 'nope'],
+            'iendswith': ['ING', 'SOME', 'some'],
+            'isnull': [True, False],
+            'in': [['running', 'stopped'], ['Awesome'], []],
+        }
+        for comp, vals in values.items():
+            for key in ('state', 'name', 'foo'):
+                for value in vals:
+                    plan = ec2.helpers.Plan(**{'%s__%s' % (key, comp): value})
+                    self.assertEquals(
+                        getattr(ec2.helpers.Compare, comp)(key, value, i),
+                        plan(i),
+                        (key, comp, value),
+                    )
+
+    def test_multiple_lookups(self):
+        plan = ec2.helpers.Plan(state='running', name__istartswith='awe')
+        self.assertTrue(plan(self.instance))
+        self.assertEquals([self.instance], plan.filter([self.instance]))
+        plan = ec2.helpers.Plan(state='stopped', name__istartswith='awe')
+        self.assertFalse(plan(self.instance))
+        self.assertEquals([], plan.filter([self.instance]))
+
+
+class TagMapTests(unittest.TestCase):
+    def setUp(self):
+        self.instance = Instance()
+        self.instance.tags = {'Name': 'awesome', 'Role': 'web'}
+
+    def test_build_tag_map(self):
+        self.assertEquals(
+            {'name': 'awesome', 'role': 'web'},
+            ec2.helpers.build_tag_map(self.instance),
+        )
+        self.assertEquals({}, ec2.helpers.build_tag_map(object()))
+
+    def test_index_tags(self):
+        i = ec2.helpers.index_tags(self.instance)
+        self.assertEquals({'name': 'awesome', 'role': 'web'}, i._tag_map)
+        # Lookups use the indexed map rather than the live tags
+        i.tags = {}
+        self.assertTrue(ec2.helpers.Compare.exact('role', 'web', i))
+        self.assertTrue(ec2.helpers.Lookup('name__istartswith', 'AWE')(i))
+
+
+class WildcardEscapeTests(unittest.TestCase):
+    def test_escape(self):
+        self.assertEquals('web-01', ec2.helpers.wildcard_escape('web-01'))
+        self.assertEquals(r'a\*b\?c\\d', ec2.helpers.wildcard_escape(r'a*b?c\d'))
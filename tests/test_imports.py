@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ImportTestCase(unittest.TestCase):
+    def test_lazy_imports(self):
+        "import ec2 stays fast by leaving the heavy modules for later"
+        output = subprocess.Popen([
+            sys.executable, '-c',
+            'import sys, ec2; print " ".join(sorted(sys.modules))',
+        ], cwd=ROOT, stdout=subprocess.PIPE).communicate()[0]
+        modules = set(output.split())
+        self.assertTrue('ec2.types' in modules)
+        for heavy in ('boto', 'numpy', 'pkg_resources', 'tempfile'):
+            self.assertFalse(heavy in modules, '%s was imported' % heavy)
+
+    def test_version(self):
+        "setup.py reads the version from the package"
+        import ec2
+        output = subprocess.Popen([
+            sys.executable, 'setup.py', '--version',
+        ], cwd=ROOT, stdout=subprocess.PIPE).communicate()[0]
+        self.assertEquals(ec2.__version__, output.strip())
@@ -0,0 +1,210 @@
+from boto.ec2.instance import Instance
+import threading
+import unittest
+
+import ec2
+from ec2.helpers import Lookup
+from ec2.indexes import HashIndex, PrefixIndex, TrigramIndex, trigrams
+
+
+class HashIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.instances = []
+        for n in xrange(4):
+            i = Instance()
+            i.id = 'i-abc%d' % n
+            i.tags = {'Name': 'Instance-%d' % (n % 2)}
+            self.instances.append(ec2.helpers.index_tags(i))
+
+    def test_attribute(self):
+        index = HashIndex(self.instances, 'id')
+        self.assertEquals([self.instances[1]], index.get('i-abc1'))
+        self.assertEquals([], index.get('I-ABC1'))
+        self.assertEquals([], index.get('nope'))
+
+    def test_tags(self):
+        index = HashIndex(self.instances, 'name')
+        self.assertEquals(
+            [self.instances[0], self.instances[2]],
+            index.get('Instance-0'),
+        )
+        self.assertEquals([], index.get('instance-0'))
+
+    def test_fold(self):
+        index = HashIndex(self.instances, 'name', fold=True)
+        self.assertEquals(
+            [self.instances[1], self.instances[3]],
+            index.get('INSTANCE-1'),
+        )
+
+    def test_get_many(self):
+        index = HashIndex(self.instances, 'id')
+        self.assertEquals(
+            [self.instances[0], self.instances[2], self.instances[3]],
+            index.get_many(['i-abc3', 'nope', 'i-abc0', 'i-abc2', 'i-abc3']),
+        )
+        self.assertEquals([], index.get_many([]))
+        self.assertRaises(TypeError, index.get_many, [['i-abc0'], 'i-abc1'])
+        index = HashIndex(self.instances, 'name', fold=True)
+        self.assertEquals(self.instances, index.get_many(['INSTANCE-1', 'instance-0']))
+
+    def test_missing_key(self):
+        index = HashIndex(self.instances, 'lol')
+        self.assertEquals({}, index.buckets)
+
+    def test_unhashable(self):
+        self.assertEquals(None, HashIndex.build(self.instances, 'groups'))
+
+    def test_positions_once(self):
+        index = HashIndex(self.instances * 1000, 'id')
+        errors = []
+
+        def work():
+            try:
+                index._positions()
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=work) for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals([], errors)
+        self.assertEquals(None, index.objects)
+        self.assertEquals(3, index._positions()[id(self.instances[3])] % 4)
+
+    def test_patch(self):
+        index = HashIndex(self.instances, 'name')
+        old = self.instances[0]
+        new = Instance()
+        new.id = old.id
+        new.tags = {'Name': 'Instance-1'}
+        added = Instance()
+        added.id = 'i-abc4'
+        added.tags = {'Name': 'Instance-0'}
+        cache = [new] + self.instances[1:3] + [added]
+        position = dict((id(obj), n) for n, obj in enumerate(cache))
+        patched = index.patched([old, self.instances[3]], [new, added], position)
+        self.assertEquals([self.instances[2], added], patched.get('Instance-0'))
+        self.assertEquals([new, self.instances[1]], patched.get('Instance-1'))
+        self.assertEquals({}, patched.patched(cache, [], position).buckets)
+        # The original is left alone for readers still using it
+        self.assertEquals([old, self.instances[2]], index.get('Instance-0'))
+        self.assertEquals(self.instances, index.get_many(['Instance-0', 'Instance-1']))
+
+
+class PrefixIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.instances = []
+        for n, name in enumerate(('web-2', 'Web-1', 'db-1', 'web-10')):
+            i = Instance()
+            i.id = 'i-abc%d' % n
+            i.tags = {'Name': name}
+            self.instances.append(ec2.helpers.index_tags(i))
+        self.instances[3].ip_address = '10.0.0.1'
+
+    def test_tags(self):
+        index = PrefixIndex(self.instances, 'name')
+        web2, _, _, web10 = self.instances
+        self.assertEquals([web2, web10], index.get('web-'))
+        self.assertEquals([web10], index.get('web-1'))
+        self.assertEquals([], index.get('x'))
+        self.assertEquals(self.instances, index.get(''))
+
+    def test_fold(self):
+        index = PrefixIndex(self.instances, 'name', fold=True)
+        web2, web1, _, web10 = self.instances
+        self.assertEquals([web2, web1, web10], index.get('WEB-'))
+
+    def test_not_strings(self):
+        "Objects whose attribute isn't a string are always candidates"
+        index = PrefixIndex(self.instances, 'ip_address')
+        self.assertEquals(self.instances[:3], index.get('192.'))
+        self.assertEquals(self.instances, index.get('10.'))
+
+    def test_prefix_for(self):
+        for lookup, prefix in (
+            (Lookup('name__startswith', 'web'), 'web'),
+            (Lookup('name__istartswith', 'WEB'), 'WEB'),
+            (Lookup('name__like', r'^web-\d'), 'web-'),
+            (Lookup('name__regex', r'web\.1*'), 'web.'),
+            (Lookup('name__like', 'web|db'), None),
+            (Lookup('name__like', '(?i)web'), None),
+            (Lookup('name__ilike', 'web'), None),
+            (Lookup('name__like', r'\d'), None),
+            (Lookup('name__contains', 'web'), None),
+            (Lookup('name__startswith', None), None),
+        ):
+            self.assertEquals(prefix, PrefixIndex.prefix_for(lookup), lookup)
+
+    def test_patch(self):
+        index = PrefixIndex(self.instances, 'name')
+        old = self.instances[0]
+        new = Instance()
+        new.id = old.id
+        new.tags = {'Name': 'db-2'}
+        added = Instance()
+        added.id = 'i-abc4'
+        added.tags = {'Name': 'web-3'}
+        cache = [new] + self.instances[1:3] + [added]
+        position = dict((id(obj), n) for n, obj in enumerate(cache))
+        patched = index.patched([old, self.instances[3]], [new, added], position)
+        self.assertEquals([added], patched.get('web-'))
+        self.assertEquals([new, self.instances[2]], patched.get('db-'))
+        self.assertEquals([self.instances[0], self.instances[3]], index.get('web-'))
+
+
+class TrigramIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.instances = []
+        for n, name in enumerate(('prod-web-2', 'Prod-Web-1', 'prod-db-1', 'web')):
+            i = Instance()
+            i.id = 'i-abc%d' % n
+            i.tags = {'Name': name}
+            self.instances.append(ec2.helpers.index_tags(i))
+        self.instances[3].ip_address = '10.0.0.1'
+
+    def test_trigrams(self):
+        self.assertEquals(set(['web', 'eb-', 'b-1']), trigrams('web-1'))
+        self.assertEquals(set(), trigrams('we'))
+
+    def test_get(self):
+        index = TrigramIndex(self.instances, 'name')
+        web2, _, db1, web = self.instances
+        self.assertEquals([web2, web], index.get('web'))
+        self.assertEquals([web2, db1], index.get('prod-'))
+        self.assertEquals([], index.get('nope'))
+        # Too short for trigrams, so every value is checked
+        self.assertEquals([db1], index.get('db'))
+        self.assertEquals(self.instances, index.get(''))
+
+    def test_fold(self):
+        index = TrigramIndex(self.instances, 'name', fold=True)
+        web2, web1, _, web = self.instances
+        self.assertEquals([web2, web1, web], index.get('WEB'))
+
+    def test_not_strings(self):
+        index = TrigramIndex(self.instances, 'ip_address')
+        self.assertEquals(self.instances[:3], index.get('192'))
+        self.assertEquals(self.instances, index.get('0.0'))
+
+    def test_patch(self):
+        index = TrigramIndex(self.instances, 'name')
+        grams = index.entries[1]
+        old = self.instances[0]
+        new = Instance()
+        new.id = old.id
+        new.tags = {'Name': 'prod-cache-2'}
+        added = Instance()
+        added.id = 'i-abc4'
+        added.tags = {'Name': 'prod-db-1'}
+        cache = [new] + self.instances[1:3] + [added]
+        position = dict((id(obj), n) for n, obj in enumerate(cache))
+        patched = index.patched([old, self.instances[3]], [new, added], position)
+        self.assertEquals([], patched.get('web'))
+        self.assertEquals([new], patched.get('cache'))
+        self.assertEquals([self.instances[2], added], patched.get('db-1'))
+        self.assertFalse('web' in patched.entries[1])
+        self.assertEquals([self.instances[0], self.instances[3]], index.get('web'))
+        # The old sets were copied rather than changed
+        self.assertEquals(set(['prod-web-2', 'web']), grams['web'])
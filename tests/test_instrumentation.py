@@ -0,0 +1,123 @@
+from .base import BaseTestCase
+from boto.exception import BotoServerError
+from mock import MagicMock, patch
+
+import ec2
+from ec2.instrumentation import StatsCollector, register, unregister
+
+
+class InstrumentationTestCase(BaseTestCase):
+    def setUp(self):
+        super(InstrumentationTestCase, self).setUp()
+        self.stats = register(StatsCollector())
+        self.events = []
+        register(self.listener)
+
+    def tearDown(self):
+        super(InstrumentationTestCase, self).tearDown()
+        unregister(self.stats)
+        unregister(self.listener)
+
+    def listener(self, event, model, **data):
+        self.events.append((event, model, data))
+
+    def test_cache(self):
+        with self._patch_connection():
+            ec2.instances.all()
+            ec2.instances.all()
+            ec2.instances.clear()
+        self.assertEquals(
+            ['cache_miss', 'fetch', 'cache_hit', 'cache_clear'],
+            [event for event, _, _ in self.events],
+        )
+        self.assertTrue(all(model is ec2.instances for _, model, _ in self.events))
+        fetch = self.events[1][2]
+        self.assertEquals((None, 4), (fetch['filters'], fetch['count']))
+        self.assertTrue(fetch['duration'] >= 0)
+
+        counters = self.stats.snapshot()['counters']
+        self.assertEquals(1, counters['instances.cache_hit'])
+        self.assertEquals(1, counters['instances.cache_miss'])
+        self.assertEquals(4, counters['instances.fetch.objects'])
+        self.assertEquals(1, self.stats.snapshot()['timings']['instances.fetch']['count'])
+
+    def test_one_hit_per_query(self):
+        with self._patch_connection():
+            ec2.instances.all()
+            del self.events[:]
+            list(ec2.instances.filter(name='instance-1'))
+            ec2.instances.get(name__startswith='instance-2')
+        self.assertEquals(2, len([e for e, _, _ in self.events if e == 'cache_hit']))
+
+    def test_predicates(self):
+        with self._patch_connection():
+            ec2.instances.all()
+            del self.events[:]
+            matches = ec2.instances.filter(state='running').filter(name__endswith='2')
+            self.assertEquals(['i-abc2'], [i.id for i in matches])
+        self.assertEquals([
+            ('predicate', 'state__exact', 2, 2),
+            ('predicate', 'name__endswith', 2, 1),
+        ], [
+            (event, data['lookup'], data['rows_in'], data['rows_out'])
+            for event, _, data in self.events if event != 'cache_hit'
+        ])
+        counters = self.stats.snapshot()['counters']
+        self.assertEquals(2, counters['instances.predicate.name__endswith.rows_in'])
+        self.assertEquals(1, counters['instances.predicate.name__endswith.rows_out'])
+
+    def test_refresh(self):
+        with self._patch_connection():
+            ec2.instances.all()
+            ec2.instances.refresh()
+            ec2.instances.refresh(incremental=True)
+        refreshes = [data for event, _, data in self.events if event == 'refresh']
+        self.assertEquals([False, True], [data['incremental'] for data in refreshes])
+        # One full fetch each, then launch-time, state and id filters
+        self.assertEquals(5, self.stats.snapshot()['counters']['instances.fetch'])
+
+    def test_errors(self):
+        self.connection.get_all_instances.side_effect = BotoServerError(500, 'Oops')
+        with self._patch_connection():
+            self.assertRaises(BotoServerError, ec2.instances.all)
+        _, _, data = self.events[-1]
+        self.assertTrue(isinstance(data['error'], BotoServerError))
+        self.assertEquals(1, self.stats.snapshot()['counters']['instances.fetch.errors'])
+
+    def test_broken_listener(self):
+        broken = register(MagicMock(side_effect=ValueError))
+        try:
+            with self._patch_connection():
+                self.assertEquals(4, len(ec2.instances.all()))
+            self.assertTrue(broken.called)
+        finally:
+            unregister(broken)
+
+    def test_iterator(self):
+        with self._patch_connection():
+            self.connection.get_all_reservations.return_value = \
+                self.connection.get_all_instances.return_value
+            list(ec2.instances.iterator())
+        self.assertEquals([('fetch', 4)], [
+            (event, data['count']) for event, _, data in self.events])
+
+    def test_reset(self):
+        with self._patch_connection():
+            ec2.instances.all()
+        self.stats.reset()
+        self.assertEquals({'counters': {}, 'timings': {}}, self.stats.snapshot())
+
+    def test_no_listeners(self):
+        unregister(self.stats)
+        unregister(self.listener)
+        try:
+            with patch('ec2.base.emit') as emit:
+                with patch('ec2.query.emit') as query_emit:
+                    with self._patch_connection():
+                        ec2.instances.all()
+                        list(ec2.instances.filter(state='running'))
+                    self.assertFalse(emit.called)
+                    self.assertFalse(query_emit.called)
+        finally:
+            register(self.stats)
+            register(self.listener)
@@ -0,0 +1,115 @@
+from .base import BaseTestCase
+from mock import patch
+
+import ec2
+from ec2.query import QuerySet
+
+
+class QuerySetTestCase(BaseTestCase):
+    def test_lazy(self):
+        with self._patch_connection():
+            qs = ec2.instances.filter(state='running')
+            self.assertTrue(isinstance(qs, QuerySet))
+            self.assertFalse(self.connection.get_all_instances.called)
+            self.assertEquals(2, len(qs))
+            self.assertEquals(1, self.connection.get_all_instances.call_count)
+
+    def test_evaluated_once(self):
+        with self._patch_connection():
+            qs = ec2.instances.filter(state='running')
+            with patch.object(qs, '_iter', wraps=qs._iter) as mock:
+                list(qs)
+                len(qs)
+                qs[0]
+                qs.first()
+                qs.exists()
+                mock.assert_called_once_with()
+
+    def test_short_circuits_evaluated_once(self):
+        "Short circuiting calls carry on from where the last one stopped"
+        with self._patch_connection():
+            qs = ec2.instances.filter(state='running')
+            with patch.object(qs, '_iter', wraps=qs._iter) as mock:
+                self.assertTrue(qs.exists())
+                self.assertEquals('i-abc0', qs.first().id)
+                self.assertEquals('i-abc0', qs[0].id)
+                self.assertEquals(['i-abc2'], [i.id for i in qs[1:2]])
+                self.assertRaises(IndexError, lambda: qs[2])
+                self.assertEquals(2, qs.count())
+                self.assertEquals(['i-abc0', 'i-abc2'], [i.id for i in qs])
+                mock.assert_called_once_with()
+            # Pushed down, so nothing was cached either
+            self.assertEquals(None, ec2.instances._cache)
+            self.connection.get_all_instances.assert_called_once_with(
+                filters={'instance-state-name': 'running'})
+
+    def test_list_like(self):
+        with self._patch_connection():
+            ec2.instances.all()
+            qs = ec2.instances.filter(state='stopped')
+            self.assertEquals(['i-abc1', 'i-abc3'], [i.id for i in qs])
+            self.assertEquals('i-abc3', qs[-1].id)
+            self.assertEquals(qs[:], list(qs))
+            self.assertEquals(qs, list(qs))
+            self.assertEquals(list(qs), qs)
+            self.assertEquals(4, len(qs + ec2.instances.filter(state='running')))
+            self.assertTrue(qs)
+            self.assertFalse(ec2.instances.filter(state='crap'))
+            self.assertEquals(repr(list(qs)), repr(qs))
+
+    def test_chaining(self):
+        with self._patch_connection():
+            qs = ec2.instances.filter(id__startswith='i-abc')
+            running = qs.filter(state='running')
+            self.assertEquals(['i-abc0', 'i-abc2'], [i.id for i in running])
+            self.assertEquals(['i-abc2'], [i.id for i in running.exclude(name='instance-0')])
+            self.assertEquals(['i-abc1', 'i-abc3'], [i.id for i in qs.exclude(state='running')])
+            # Everything in one exclude() has to match
+            self.assertEquals(3, qs.exclude(state='running', name='instance-0').count())
+            self.assertEquals(['i-abc1', 'i-abc3'], [i.id for i in ec2.instances.exclude(state='running')])
+            # The original is untouched
+            self.assertEquals(4, qs.count())
+
+    def test_order_by(self):
+        with self._patch_connection():
+            qs = ec2.instances.filter(id__startswith='i-abc')
+            self.assertEquals(['i-abc3', 'i-abc2', 'i-abc1', 'i-abc0'], [i.id for i in qs.order_by('-name')])
+            self.assertEquals(
+                ['i-abc1', 'i-abc3', 'i-abc0', 'i-abc2'],
+                [i.id for i in qs.order_by('-state', 'id')],
+            )
+            self.assertEquals('i-abc3', qs.order_by('-id').first().id)
+            self.assertEquals(['i-abc3', 'i-abc2'], [i.id for i in qs.order_by('-id')[:2]])
+
+    def test_short_circuit(self):
+        with self._patch_connection():
+            ec2.instances.all()
+            with patch('ec2.helpers.Lookup.__call__', autospec=True, return_value=True) as mock:
+                self.assertTrue(ec2.instances.filter(id__startswith='i-').exists())
+                self.assertEquals(1, mock.call_count)
+
+                mock.reset_mock()
+                self.assertEquals('i-abc0', ec2.instances.filter(id__startswith='i-').first().id)
+                self.assertEquals(1, mock.call_count)
+
+                mock.reset_mock()
+                self.assertRaises(ec2.instances.MultipleObjectsReturned, ec2.instances.get, id__startswith='i-')
+                self.assertEquals(2, mock.call_count)
+
+                mock.reset_mock()
+                self.assertEquals(['i-abc0', 'i-abc1'], [i.id for i in ec2.instances.filter(id__startswith='i-')[:2]])
+                self.assertEquals(2, mock.call_count)
+
+    def test_empty(self):
+        with self._patch_connection():
+            qs = ec2.instances.filter(state='crap')
+            self.assertFalse(qs.exists())
+            self.assertEquals(None, qs.first())
+            self.assertRaises(IndexError, lambda: qs[0])
+            self.assertRaises(ec2.instances.DoesNotExist, qs.get)
+
+    def test_get(self):
+        with self._patch_connection():
+            qs = ec2.instances.filter(state='running')
+            self.assertEquals('i-abc2', qs.get(name='instance-2').id)
+            self.assertRaises(ec2.instances.MultipleObjectsReturned, qs.get)
@@ -0,0 +1,71 @@
+from .base import BaseTestCase, RUNNING_STATE
+from boto.ec2.instance import Instance
+
+import ec2
+from ec2.records import Projector, Record, record_class
+
+
+class RecordTestCase(BaseTestCase):
+    def tearDown(self):
+        super(RecordTestCase, self).tearDown()
+        ec2.instances.compact = False
+
+    def test_record_class(self):
+        record_type = record_class(ec2.instances, ('state', 'tags'))
+        self.assertEquals(('id', 'state'), record_type._projected)
+        # Plus room for select_related()
+        self.assertEquals(
+            ('id', 'state') + tuple(ec2.instances.related),
+            record_type.__slots__,
+        )
+        self.assertTrue(issubclass(record_type, Record))
+        self.assertEquals('instancesRecord', record_type.__name__)
+        record = record_type()
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertRaises(AttributeError, setattr, record, 'lol', 1)
+
+    def test_projector(self):
+        project = Projector(record_class(ec2.instances, ('state', 'image_id', 'kernel')))
+        records = []
+        for n in xrange(2):
+            i = Instance()
+            i.id = 'i-abc%d' % n
+            i._state = RUNNING_STATE
+            i.image_id = ''.join(['ami-', 'abc'])
+            i.tags = {''.join(['Na', 'me']): 'web'}
+            del i.kernel
+            records.append(project(i))
+        first, second = records
+        self.assertEquals('i-abc0', first.id)
+        self.assertEquals('running', first.state)
+        self.assertEquals({'Name': 'web'}, first.tags)
+        self.assertFalse(hasattr(first, 'kernel'))
+        # Equal strings are shared between records
+        self.assertTrue(first.image_id is second.image_id)
+        self.assertTrue(list(first.tags)[0] is list(second.tags)[0])
+
+    def test_compact(self):
+        ec2.instances.compact = True
+        with self._patch_connection():
+            instances = ec2.instances.all()
+            self.assertTrue(all(isinstance(i, Record) for i in instances))
+            self.assertEquals('us-east-1', instances[0].region_name)
+            # Lowercased tag names are shared too
+            self.assertTrue(list(instances[0]._tag_map)[0] is list(instances[1]._tag_map)[0])
+            self.assertEquals(['i-abc0', 'i-abc2'], [i.id for i in ec2.instances.filter(state='running')])
+            self.assertEquals('i-abc1', ec2.instances.get(name__iexact='INSTANCE-1').id)
+            self.assertEquals(1, len(ec2.instances.filter(state='stopped', name__endswith='-3')))
+            # Fields that weren't kept are treated as missing
+            self.assertEquals(4, len(ec2.instances.filter(kernel__isnull=True)))
+            self.assertEquals(0, len(ec2.instances.filter(kernel__isnull=False)))
+
+            self.connection.get_all_instances.reset_mock()
+            full = instances[0].full()
+            self.assertTrue(isinstance(full, Instance))
+            self.assertEquals('i-abc0', full.id)
+            self.connection.get_all_instances.assert_called_once_with(filters={'instance-id': 'i-abc0'})
+
+    def test_describe(self):
+        with self._patch_connection():
+            self.assertEquals('i-abc3', ec2.instances.describe('i-abc3').id)
+            self.assertRaises(ec2.instances.DoesNotExist, ec2.instances.describe, 'nope')
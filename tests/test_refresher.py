@@ -0,0 +1,121 @@
+from .base import BaseTestCase, STOPPED_STATE
+from boto.ec2.instance import Instance, Reservation
+from mock import MagicMock, patch
+import threading
+
+import ec2
+
+
+class RefresherTestCase(BaseTestCase):
+    def setUp(self):
+        super(RefresherTestCase, self).setUp()
+        self.changes = []
+        self.refresher = ec2.Refresher([ec2.instances, ec2.security_groups],
+                                       interval=10)
+        self.refresher.on_change(lambda model, delta: self.changes.append((model, delta)))
+
+    def tearDown(self):
+        super(RefresherTestCase, self).tearDown()
+        self.refresher.stop()
+
+    def _replace(self, instance_id, **attrs):
+        "Return a fresh copy of an instance from the next listing"
+        reservations = []
+        for old in self.connection.get_all_instances.return_value:
+            reservation = Reservation()
+            for instance in old.instances:
+                if instance.id == instance_id:
+                    copy = Instance()
+                    copy.__dict__.update(instance.__dict__)
+                    copy.tags = dict(instance.tags)
+                    copy.__dict__.update(attrs)
+                    instance = copy
+                reservation.instances.append(instance)
+            reservations.append(reservation)
+        self.connection.get_all_instances.return_value = reservations
+
+    def test_changes(self):
+        with self._patch_connection():
+            ec2.instances.all()
+            ec2.security_groups.all()
+            self.assertEquals([ec2.instances, ec2.security_groups], self.refresher.run_once())
+            self.assertEquals([], self.changes)
+
+            self._replace('i-abc0', _state=STOPPED_STATE)
+            self.refresher.run_once()
+            self.assertEquals(1, len(self.changes))
+            model, delta = self.changes[0]
+            self.assertTrue(model is ec2.instances)
+            self.assertEquals([('running', 'stopped')],
+                              [(old.state, new.state) for old, new in delta.changed])
+            self.assertEquals('stopped', ec2.instances.get(id='i-abc0').state)
+
+            self._replace('i-abc1', tags={'Name': 'renamed'})
+            self.refresher.run_once()
+            old, new = self.changes[1][1].changed[0]
+            self.assertEquals(('instance-1', 'renamed'), (old.tags['Name'], new.tags['Name']))
+            self.assertEquals([], self.changes[1][1].added)
+
+    def test_delta(self):
+        with self._patch_connection():
+            self.assertEquals(4, len(ec2.instances.refresh(delta=True).added))
+            self.connection.get_all_instances.return_value = \
+                self.connection.get_all_instances.return_value[:1]
+            delta = ec2.instances.refresh(delta=True)
+            self.assertEquals(['i-abc2', 'i-abc3'], [i.id for i in delta.removed])
+            self.assertEquals(2, len(ec2.instances.all()))
+            self.connection.get_all_instances.assert_called_with(filters=None)
+
+    def test_failures(self):
+        "A failing refresh or callback doesn't stop the others"
+        self.refresher.on_change(MagicMock(side_effect=ValueError))
+        with self._patch_connection():
+            ec2.instances.all()
+            self.connection.get_all_security_groups.side_effect = ValueError
+            self._replace('i-abc0', _state=STOPPED_STATE)
+            self.assertEquals([ec2.instances, ec2.security_groups], self.refresher.run_once())
+            self.assertEquals(1, len(self.changes))
+
+    def test_budget(self):
+        "Types the budget didn't leave time for go first next time"
+        self.refresher.budget = 5
+        with self._patch_connection():
+            with patch('ec2.refresher.time') as time:
+                time.time.side_effect = [0, 0, 6, 10, 10, 16]
+                self.assertEquals([ec2.instances], self.refresher.run_once())
+                self.assertEquals([ec2.security_groups], self.refresher.run_once())
+                self.assertEquals([ec2.instances, ec2.security_groups], self.refresher.types)
+
+    def test_delay(self):
+        for _ in xrange(100):
+            self.assertTrue(9 <= self.refresher.delay() <= 11)
+        self.refresher._overrun = 4
+        self.assertTrue(5 <= self.refresher.delay() <= 7)
+        self.refresher.jitter = 0
+        self.refresher._overrun = 20
+        self.assertEquals(0, self.refresher.delay())
+
+    def test_start(self):
+        refreshed = threading.Event()
+        self.refresher.interval = 0.01
+        self.refresher.on_change(lambda model, delta: refreshed.set())
+        with self._patch_connection():
+            ec2.instances.all()
+            self._replace('i-abc0', _state=STOPPED_STATE)
+            self.refresher.start()
+            self.assertTrue(refreshed.wait(5))
+            self.refresher.stop()
+            self.assertEquals(None, self.refresher._thread)
+            self.assertEquals('stopped', ec2.instances.get(id='i-abc0').state)
+
+    def test_stop_without_wait_result(self):
+        # Like Python 2.6, where Event.wait() always returns None
+        wait = threading._Event.wait
+        self.refresher.interval = 0.01
+        with self._patch_connection():
+            with patch('threading._Event.wait',
+                       lambda event, timeout=None: wait(event, timeout) and None):
+                self.refresher.start()
+                thread = self.refresher._thread
+                self.refresher.stop(5)
+                self.assertFalse(thread.is_alive())
@@ -0,0 +1,82 @@
+from .base import BaseTestCase
+from contextlib import contextmanager
+
+import ec2
+
+
+class SelectRelatedTestCase(BaseTestCase):
+    def setUp(self):
+        super(SelectRelatedTestCase, self).setUp()
+        instances = [i for r in self.connection.get_all_instances.return_value
+                     for i in r.instances]
+        groups = self.connection.get_all_security_groups.return_value
+        for n, instance in enumerate(instances):
+            instance.vpc_id = 'vpc-abc%d' % (n % 2)
+            instance.subnet_id = 'subnet-abc%d' % (n % 2)
+            instance.groups = groups[:n % 2 + 1]
+
+    @contextmanager
+    def _patch(self):
+        with self._patch_connection():
+            with self._patch_vpc_connection():
+                yield
+
+    def test_foreign_keys(self):
+        with self._patch():
+            instances = list(ec2.instances.select_related(
+                'vpc', 'subnet', 'security_groups'))
+            self.assertEquals(['vpc-abc0', 'vpc-abc1', 'vpc-abc0', 'vpc-abc1'],
+                              [i.vpc.id for i in instances])
+            self.assertEquals('subnet-abc1', instances[1].subnet.id)
+            self.assertEquals([['sg-abc0'], ['sg-abc0', 'sg-abc1']],
+                              [[g.id for g in i.security_groups] for i in instances[:2]])
+
+    def test_one_query_per_relation(self):
+        "Only the ids needed are fetched while the related cache is cold"
+        with self._patch():
+            list(ec2.instances.select_related('vpc', 'volumes'))
+            self.vpc_connection.get_all_vpcs.assert_called_once_with(
+                filters={'vpc-id': ['vpc-abc0', 'vpc-abc1']})
+            self.connection.get_all_volumes.assert_called_once_with(
+                filters={'attachment.instance-id': ['i-abc0', 'i-abc1', 'i-abc2', 'i-abc3']})
+
+    def test_warm_cache(self):
+        with self._patch():
+            ec2.vpcs.all()
+            list(ec2.instances.select_related('vpc'))
+            self.vpc_connection.get_all_vpcs.assert_called_once_with(filters=None)
+
+    def test_reverse(self):
+        with self._patch():
+            instances = ec2.instances.filter(state='running').select_related(
+                'volumes', 'network_interfaces')
+            self.assertEquals([['vol-abc0', 'vol-abc1'], []],
+                              [[v.id for v in i.volumes] for i in instances])
+            self.assertEquals([['eni-abc0'], []],
+                              [[n.id for n in i.network_interfaces] for i in instances])
+
+            vpc = ec2.vpcs.select_related('subnets').get(id='vpc-abc1')
+            self.assertEquals(['subnet-abc1'], [s.id for s in vpc.subnets])
+
+    def test_missing(self):
+        "Related objects that don't exist are left out"
+        self.vpc_connection.get_all_vpcs.return_value = []
+        with self._patch():
+            instance = ec2.instances.select_related('vpc')[0]
+            self.assertEquals(None, instance.vpc)
+
+    def test_unknown(self):
+        self.assertRaises(AttributeError, ec2.instances.select_related, 'nope')
+
+    def test_compact(self):
+        ec2.instances.compact = True
+        try:
+            with self._patch():
+                instances = ec2.instances.select_related('vpc', 'volumes', 'security_groups')
+                self.assertEquals('vpc-abc0', instances[0].vpc.id)
+                self.assertEquals(2, len(instances[0].volumes))
+                self.assertEquals('sg-abc0 sg-abc1', instances[1].group_ids)
+                self.assertEquals([['sg-abc0'], ['sg-abc0', 'sg-abc1']],
+                                  [[g.id for g in i.security_groups] for i in instances[:2]])
+        finally:
+            ec2.instances.compact = False
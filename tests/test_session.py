@@ -0,0 +1,77 @@
+from .base import BaseTestCase
+from mock import MagicMock, patch
+
+import ec2
+from ec2.connection import acquire_connection, leased
+
+
+class SessionTestCase(BaseTestCase):
+    def setUp(self):
+        super(SessionTestCase, self).setUp()
+        self.session = ec2.Session('def', 'uvw', 'us-west-2')
+        self.other = MagicMock()
+        self.other.get_all_instances = MagicMock(return_value=[])
+        self.connections = {None: self.connection, self.session: self.other}
+
+    def tearDown(self):
+        super(SessionTestCase, self).tearDown()
+        self.session.clear()
+
+    def _patch_connection(self):
+        return patch('ec2.types.acquire_connection',
+                     side_effect=lambda region_name=None, session=None: self.connections[session])
+
+    def test_bind(self):
+        instances = self.session.instances
+        self.assertTrue(instances is self.session.instances)
+        self.assertTrue(instances is self.session.bind(ec2.instances))
+        self.assertTrue(issubclass(instances, ec2.instances))
+        self.assertTrue(issubclass(instances.DoesNotExist, ec2.instances.DoesNotExist))
+        self.assertTrue(self.session is instances.session)
+        self.assertEquals(None, ec2.instances.session)
+        self.assertRaises(AttributeError, getattr, self.session, 'objects_base')
+        self.assertRaises(AttributeError, getattr, self.session, 'nope')
+
+    def test_isolated_caches(self):
+        with self._patch_connection():
+            self.assertEquals(0, len(self.session.instances.all()))
+            self.assertEquals(None, ec2.instances._cache)
+            self.assertEquals(4, len(ec2.instances.all()))
+            self.assertEquals(0, len(self.session.instances.filter(state='running')))
+
+            west = self.session.instances.in_region('us-east-1')
+            self.assertTrue(self.session is west.session)
+            self.assertFalse(west is ec2.instances.in_region('us-east-1'))
+
+            self.session.clear()
+            self.assertEquals(None, self.session.instances._cache)
+            self.assertEquals(4, len(ec2.instances._cache))
+
+    def test_credentials(self):
+        self.assertEquals({
+            'aws_access_key_id': 'def',
+            'aws_secret_access_key': 'uvw',
+            'region_name': 'us-west-2',
+        }, self.session.credentials())
+        with self._patch_connection():
+            self.assertEquals('us-west-2', self.session.instances._credentials()['region_name'])
+            self.assertEquals('us-east-1', ec2.instances._credentials()['region_name'])
+
+    def test_connections(self):
+        "Connections come from, and go back to, the session's own pool"
+        connect = MagicMock(side_effect=lambda **params: MagicMock())
+        self.session.pool.connectors = {'ec2': connect}
+        with leased(acquire_connection(session=self.session)) as connection:
+            pass
+        connect.assert_called_once_with(aws_access_key_id='def', aws_secret_access_key='uvw', region_name='us-west-2')
+        self.assertTrue(connection is self.session.pool.acquire('ec2', creds=self.session.credentials()))
+
+    def test_regions(self):
+        regions = [MagicMock(), MagicMock()]
+        regions[0].name, regions[1].name = 'us-west-1', 'us-west-2'
+        connection = MagicMock()
+        connection.get_all_regions.return_value = regions
+        self.session.pool.connectors = {'ec2': lambda **params: connection}
+        self.assertEquals(['us-west-1', 'us-west-2'], self.session.regions())
+        self.session.regions()
+        connection.get_all_regions.assert_called_once_with()
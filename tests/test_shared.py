@@ -0,0 +1,162 @@
+from .base import BaseTestCase
+import os
+import shutil
+import tempfile
+import time
+
+import ec2
+from ec2.helpers import Lookup
+from ec2.records import Record
+from ec2.shared import MappedRows, SharedSnapshotStore
+
+
+class SharedSnapshotStoreTestCase(BaseTestCase):
+    def setUp(self):
+        super(SharedSnapshotStoreTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.store = SharedSnapshotStore(os.path.join(self.path, 'shared'), max_age=60)
+        self.instances = [i for r in self.connection.get_all_instances.return_value
+                          for i in r.instances]
+        self.instances[0].ip_address = '10.0.0.1'
+        self.instances[1].tags[u'Role'] = u'caf\xe9'
+        self.instances[2].tags['ip_address'] = 'tagged'
+        del self.instances[2].ip_address
+        del self.instances[3].key_name
+
+    def tearDown(self):
+        super(SharedSnapshotStoreTestCase, self).tearDown()
+        ec2.instances.snapshots = None
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        self.assertEquals(None, self.store.load(ec2.instances))
+        now = time.time()
+        self.store.save(ec2.instances, self.instances, now)
+        rows, fetched_at = self.store.load(ec2.instances)
+        self.assertEquals(now, fetched_at)
+        self.assertTrue(isinstance(rows, MappedRows))
+        self.assertEquals(4, len(rows))
+        self.assertEquals(['i-abc0', 'i-abc1', 'i-abc2', 'i-abc3'], [r.id for r in rows])
+
+        record = rows[1]
+        self.assertTrue(isinstance(record, Record))
+        self.assertTrue(record is rows[1] and record is rows[-3])
+        self.assertEquals('stopped', record.state)
+        self.assertEquals(None, record.ip_address)
+        self.assertEquals({'Name': 'instance-1', 'Role': u'caf\xe9'}, record.tags)
+        self.assertEquals(u'caf\xe9', record._tag_map['role'])
+        self.assertTrue([k for k in record._tag_map if k == 'name'][0] is list(rows[0]._tag_map)[0])
+        self.assertEquals('us-east-1', record.region_name)
+        self.assertEquals('10.0.0.1', rows[0].ip_address)
+        # Unset fields stay unset, so lookups fall back to tags
+        self.assertFalse(hasattr(rows[2], 'ip_address'))
+        self.assertFalse(hasattr(rows[3], 'key_name'))
+
+    def test_filter(self):
+        "Filtering the mapped values matches checking each record"
+        self.store.save(ec2.instances, self.instances, time.time())
+        rows, _ = self.store.load(ec2.instances)
+        records = list(rows)
+        for key, value in (
+            ('state', 'running'),
+            ('ip_address', 'tagged'),
+            ('ip_address__startswith', '10.'),
+            ('ip_address__isnull', True),
+            ('name__iexact', 'INSTANCE-2'),
+            ('role__icontains', u'CAF'),
+            ('role__isnull', True),
+            ('key_name__isnull', False),
+            ('region_name', 'us-east-1'),
+            ('nope', 'nope'),
+        ):
+            lookup = Lookup(key, value)
+            expected = [r.id for r in records if lookup(r)]
+            self.assertEquals(expected, [r.id for r in rows.filter([lookup])], lookup)
+        lookups = [Lookup('state', 'running'), Lookup('name__endswith', '2')]
+        self.assertEquals(['i-abc2'], [r.id for r in rows.filter(lookups)])
+
+    def test_generations(self):
+        "Old generations stay readable while new ones are swapped in"
+        self.store.save(ec2.instances, self.instances, time.time())
+        old, _ = self.store.load(ec2.instances)
+        self.store.save(ec2.instances, self.instances[:1], time.time())
+        new, _ = self.store.load(ec2.instances)
+        self.assertEquals(1, len(new))
+        self.assertEquals('i-abc3', old[3].id)
+        self.assertEquals(1, len(os.listdir(self.store.path)))
+
+    def test_unusable(self):
+        self.store.save(ec2.instances, self.instances, time.time() - 120)
+        self.assertEquals(None, self.store.load(ec2.instances))
+        self.store.save(ec2.instances, self.instances, time.time())
+        compact_fields = ec2.instances.compact_fields
+        ec2.instances.compact_fields = ('id', 'state')
+        try:
+            self.assertEquals(None, self.store.load(ec2.instances))
+        finally:
+            ec2.instances.compact_fields = compact_fields
+        with open(self.store.filename(ec2.instances), 'wb') as f:
+            f.write('lol')
+        self.assertEquals(None, self.store.load(ec2.instances))
+
+    def test_select_related(self):
+        groups = self.connection.get_all_security_groups.return_value
+        self.instances[1].groups = groups[:2]
+        self.store.save(ec2.instances, self.instances, time.time())
+        ec2.instances.snapshots = self.store
+        with self._patch_connection():
+            instances = ec2.instances.select_related('security_groups')
+            self.assertEquals('sg-abc0 sg-abc1', instances[1].group_ids)
+            self.assertEquals([[], ['sg-abc0', 'sg-abc1']],
+                              [[g.id for g in i.security_groups] for i in instances[:2]])
+
+    def test_all(self):
+        ec2.instances.snapshots = self.store
+        with self._patch_connection():
+            self.assertEquals(4, len(ec2.instances.all()))
+            # Drop only the in memory cache, like another process would
+            ec2.instances._cache = None
+            instances = ec2.instances.all()
+            self.connection.get_all_instances.assert_called_once_with(filters=None)
+            self.assertTrue(isinstance(instances, MappedRows))
+            self.assertEquals(['i-abc0'], [i.id for i in ec2.instances.filter(ip_address__startswith='10.')])
+            self.assertEquals(['i-abc2'], [i.id for i in ec2.instances.filter(state='running', name__endswith='2')])
+
+            # A newer generation from another process is used on refresh
+            self.store.save(ec2.instances, self.instances[:2], time.time() + 1)
+            self.assertEquals(2, len(ec2.instances.refresh()))
+            self.assertEquals(1, self.connection.get_all_instances.call_count)
+            ec2.instances.refresh()
+            self.assertEquals(2, self.connection.get_all_instances.call_count)
+
+    def test_refresh_delta(self):
+        ec2.instances.snapshots = self.store
+        with self._patch_connection():
+            ec2.instances.all()
+            # Drop the in memory cache, to load the snapshot instead
+            ec2.instances._cache = None
+            old = ec2.instances.all()
+            self.assertTrue(isinstance(old, MappedRows))
+            self.instances[1].tags['Name'] = 'renamed'
+            self.store.save(ec2.instances, self.instances[1:], time.time() + 1)
+
+            delta = ec2.instances.refresh(incremental=True)
+            self.assertEquals(['i-abc0'], [r.id for r in delta.removed])
+            self.assertEquals([], delta.added)
+            self.assertEquals([('instance-1', 'renamed')],
+                              [(o.tags['Name'], n.tags['Name']) for o, n in delta.changed])
+            # The new generation is swapped in whole, and only the rows
+            # that changed were turned into records
+            rows = ec2.instances.all()
+            self.assertTrue(isinstance(rows, MappedRows))
+            self.assertEquals(3, len(rows))
+            self.assertEquals([True, False, False], [r is not None for r in rows._records])
+            self.assertEquals([True, True, False, False], [r is not None for r in old._records])
+
+            # Fetched from the API and saved, then loaded like any other
+            # process would
+            delta = ec2.instances.refresh(incremental=True)
+            self.assertEquals(['i-abc0'], [r.id for r in delta.added])
+            self.assertTrue(isinstance(ec2.instances.all(), MappedRows))
+            self.assertEquals(4, len(ec2.instances.all()))
+            self.assertFalse(ec2.instances.refresh(incremental=True))
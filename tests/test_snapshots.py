@@ -0,0 +1,138 @@
+from .base import BaseTestCase
+from boto.ec2.connection import EC2Connection
+from mock import patch
+import os
+import shutil
+import tempfile
+import time
+
+import ec2
+from ec2.snapshots import SnapshotStore
+
+
+class SnapshotStoreTestCase(BaseTestCase):
+    def setUp(self):
+        super(SnapshotStoreTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.store = SnapshotStore(os.path.join(self.path, 'snapshots'), max_age=60)
+
+    def tearDown(self):
+        super(SnapshotStoreTestCase, self).tearDown()
+        ec2.instances.snapshots = None
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        self.assertEquals(None, self.store.load(ec2.instances))
+        groups = self.connection.get_all_security_groups()
+        now = time.time()
+        self.store.save(ec2.security_groups, groups, now)
+        objects, fetched_at = self.store.load(ec2.security_groups)
+        self.assertEquals(now, fetched_at)
+        self.assertEquals(['sg-abc0', 'sg-abc1'], [g.id for g in objects])
+        # Only the snapshot itself is left behind
+        self.assertEquals(1, len(os.listdir(self.store.path)))
+
+    def test_expired(self):
+        self.store.save(ec2.security_groups, [], time.time() - 120)
+        self.assertEquals(None, self.store.load(ec2.security_groups))
+
+    def test_corrupt(self):
+        self.store.save(ec2.security_groups, [], time.time())
+        with open(self.store.filename(ec2.security_groups), 'wb') as f:
+            f.write('lol')
+        self.assertEquals(None, self.store.load(ec2.security_groups))
+
+    def test_unsafe_directory(self):
+        "Snapshots in a directory anyone else can write to are ignored"
+        self.store.save(ec2.security_groups, [], time.time())
+        os.chmod(self.store.path, 0777)
+        self.assertFalse(self.store.safe())
+        self.assertEquals(None, self.store.load(ec2.security_groups))
+        self.assertRaises(IOError, self.store.save, ec2.security_groups, [], time.time())
+        with self.store.lock(ec2.security_groups):
+            pass
+
+        os.chmod(self.store.path, 0700)
+        self.assertTrue(self.store.safe())
+        with patch('os.getuid', return_value=os.getuid() + 1):
+            self.assertEquals(None, self.store.load(ec2.security_groups))
+
+        # Nor is a symlink to a safe one
+        link = os.path.join(self.path, 'link')
+        os.symlink(self.store.path, link)
+        self.assertFalse(SnapshotStore(link).safe())
+
+    def test_default_path(self):
+        with patch.dict(os.environ, {'HOME': self.path}):
+            store = SnapshotStore()
+            self.assertEquals(os.path.join(self.path, '.cache', 'python-ec2'), store.path)
+            store.save(ec2.security_groups, [], time.time())
+            self.assertTrue(store.safe())
+            self.assertEquals([], store.load(ec2.security_groups)[0])
+
+    def test_keyed_by_credentials(self):
+        filename = self.store.filename(ec2.instances)
+        self.assertFalse('abc' in os.path.basename(filename))
+        self.assertNotEquals(filename, self.store.filename(ec2.security_groups))
+        ec2.credentials.REGION_NAME = 'us-west-2'
+        self.assertNotEquals(filename, self.store.filename(ec2.instances))
+        ec2.credentials.REGION_NAME = 'us-east-1'
+        ec2.credentials.ACCESS_KEY_ID = 'def'
+        self.assertNotEquals(filename, self.store.filename(ec2.instances))
+
+    def test_connections_not_saved(self):
+        connection = EC2Connection('abc', 'xyz')
+        group = self.connection.get_all_security_groups()[0]
+        group.connection = connection
+        self.store.save(ec2.security_groups, [group], time.time())
+        with open(self.store.filename(ec2.security_groups), 'rb') as f:
+            self.assertFalse('xyz' in f.read())
+        with patch('ec2.snapshots.get_connection', return_value=connection):
+            objects, _ = self.store.load(ec2.security_groups)
+        self.assertTrue(objects[0].connection is connection)
+
+    def test_one_connection_per_load(self):
+        groups = self.connection.get_all_security_groups()
+        for group in groups:
+            group.connection = EC2Connection('abc', 'xyz')
+        self.store.save(ec2.security_groups, groups, time.time())
+        with patch('ec2.snapshots.get_connection') as get_connection:
+            objects, _ = self.store.load(ec2.security_groups)
+        get_connection.assert_called_once_with(None, None)
+        self.assertTrue(objects[0].connection is objects[1].connection)
+
+    def test_all(self):
+        ec2.instances.snapshots = self.store
+        with self._patch_connection():
+            self.assertEquals(4, len(ec2.instances.all()))
+            # Drop only the in memory cache, like a new process would
+            ec2.instances._cache = None
+            instances = ec2.instances.all()
+            self.connection.get_all_instances.assert_called_once_with(filters=None)
+            self.assertEquals(4, len(instances))
+            self.assertEquals('instance-0', instances[0].tags['Name'])
+
+            # Refreshing bypasses the snapshot and replaces it
+            ec2.instances.refresh()
+            self.assertEquals(2, self.connection.get_all_instances.call_count)
+
+            # clear() throws the snapshot away too
+            ec2.instances.clear()
+            self.assertEquals(None, self.store.load(ec2.instances))
+
+    def test_pushdown_loads_snapshot(self):
+        ec2.instances.snapshots = self.store
+        with self._patch_connection():
+            self.store.save(ec2.instances, ec2.instances._all(), time.time())
+            self.connection.get_all_instances.reset_mock()
+            # A cold filter() uses another process's snapshot instead
+            # of pushing its filters down to the API
+            self.assertEquals(['i-abc0', 'i-abc2'], [i.id for i in ec2.instances.filter(state='running')])
+            self.assertFalse(self.connection.get_all_instances.called)
+            self.assertEquals(4, len(ec2.instances._cache))
+
+            # Without a usable snapshot, it's still pushed down
+            ec2.instances.clear()
+            self.assertEquals(['i-abc0', 'i-abc2'], [i.id for i in ec2.instances.filter(state='running')])
+            self.connection.get_all_instances.assert_called_once_with(
+                filters={'instance-state-name': 'running'})
@@ -0,0 +1,160 @@
+from .base import BaseTestCase
+from boto.exception import EC2ResponseError
+from mock import MagicMock, patch
+import threading
+import unittest
+
+import ec2
+from ec2.throttle import Throttle, TokenBucket
+
+THROTTLED = '''<Response><Errors><Error>
+<Code>RequestLimitExceeded</Code><Message>Request limit exceeded.</Message>
+</Error></Errors><RequestID>abc</RequestID></Response>'''
+
+
+def throttled():
+    return EC2ResponseError(503, 'Service Unavailable', THROTTLED)
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_take(self):
+        with patch('ec2.throttle.time') as time:
+            time.time.return_value = 100
+            bucket = TokenBucket(2, 3)
+            for _ in xrange(3):
+                bucket.take()
+            self.assertFalse(time.sleep.called)
+            # Waiting callers queue up behind each other
+            bucket.take()
+            bucket.take()
+            self.assertEquals([((0.5,), {}), ((1.0,), {})], time.sleep.call_args_list)
+            self.assertEquals(1.5, bucket.waited)
+            # Refilled, but never beyond the burst
+            time.time.return_value = 200
+            bucket.take()
+            self.assertEquals(2, bucket.tokens)
+            self.assertEquals(6, bucket.requests)
+
+    def test_adaptive(self):
+        bucket = TokenBucket(16, 10)
+        bucket.backoff()
+        self.assertEquals(8, bucket.rate)
+        self.assertEquals(0, bucket.tokens)
+        for _ in xrange(10):
+            bucket.backoff()
+        self.assertEquals(1, bucket.rate)
+        self.assertEquals(11, bucket.throttled)
+        bucket.recover()
+        self.assertEquals(1.8, bucket.rate)
+        for _ in xrange(100):
+            bucket.recover()
+        self.assertEquals(16, bucket.rate)
+
+
+class ThrottleTests(unittest.TestCase):
+    def setUp(self):
+        self.throttle = Throttle(rate=10, burst=5, retries=2, limits={
+            'DescribeImages': (1, 1),
+            'eu-west-1': (5, 5),
+            ('eu-west-1', 'DescribeVpcs'): (2, 2),
+            ('us-west-1', 'DescribeVolumes'): (None, None),
+        })
+
+    def test_buckets(self):
+        bucket = self.throttle.bucket
+        shared = bucket('us-east-1', 'DescribeInstances')
+        self.assertEquals((10, 5), (shared.limit, shared.burst))
+        self.assertTrue(shared is bucket('us-east-1', 'DescribeSecurityGroups'))
+        self.assertFalse(shared is bucket('us-west-1', 'DescribeInstances'))
+        self.assertEquals(1, bucket('us-east-1', 'DescribeImages').limit)
+        self.assertEquals(1, bucket('eu-west-1', 'DescribeImages').limit)
+        self.assertEquals(5, bucket('eu-west-1', 'DescribeInstances').limit)
+        self.assertEquals(2, bucket('eu-west-1', 'DescribeVpcs').limit)
+        self.assertEquals(None, bucket('us-west-1', 'DescribeVolumes'))
+        self.assertEquals(None, Throttle(rate=None).bucket('us-east-1', 'DescribeInstances'))
+
+    def test_retries(self):
+        function = MagicMock(side_effect=[throttled(), throttled(), 42])
+        with patch('ec2.throttle.time') as time:
+            with patch('ec2.throttle.random.uniform', side_effect=lambda a, b: b) as uniform:
+                time.time.return_value = 100
+                self.assertEquals(42, self.throttle.call('us-east-1', 'DescribeInstances', function, 1, a=2))
+                function.assert_called_with(1, a=2)
+                # Backoff doubles, with full jitter, and the bucket slows
+                # down to 5 and then 2.5 requests a second
+                self.assertEquals([((0, 0.5), {}), ((0, 1.0), {})], uniform.call_args_list)
+                self.assertEquals([0.5, 0.2, 1.0, 0.8], [c[0][0] for c in time.sleep.call_args_list])
+
+                function = MagicMock(side_effect=throttled())
+                self.assertRaises(EC2ResponseError, self.throttle.call, 'us-east-1', 'DescribeInstances', function)
+                self.assertEquals(3, function.call_count)
+
+        stats = self.throttle.stats()[('us-east-1', None)]
+        self.assertEquals(6, stats['requests'])
+        self.assertEquals(4, stats['throttled'])
+
+    def test_other_errors(self):
+        "Anything but throttling isn't retried"
+        function = MagicMock(side_effect=EC2ResponseError(400, 'Bad Request'))
+        self.assertRaises(EC2ResponseError, self.throttle.call, 'us-east-1', 'DescribeInstances', function)
+        self.assertEquals(1, function.call_count)
+
+    def test_wrap(self):
+        connection = MagicMock()
+        connection.get_all_images.return_value = 'images'
+        wrapped = self.throttle.wrap(connection, 'us-east-1')
+        self.assertEquals('images', wrapped.get_all_images(owners=['self']))
+        connection.get_all_images.assert_called_once_with(owners=['self'])
+        self.assertTrue(wrapped.region is connection.region)
+        wrapped.close()
+        self.assertEquals({'requests': 1, 'throttled': 0, 'waited': 0, 'rate': 1},
+                          self.throttle.stats()[('us-east-1', 'DescribeImages')])
+
+    def test_threads(self):
+        "Threads share the bucket and queue up behind each other"
+        sleeps = []
+        with patch('ec2.throttle.time') as time:
+            time.time.return_value = 100
+            time.sleep.side_effect = sleeps.append
+            threads = [threading.Thread(target=self.throttle.call, args=('us-east-1', 'DescribeInstances', MagicMock()))
+                       for _ in xrange(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEquals([0.1, 0.2, 0.3, 0.4, 0.5], sorted(sleeps))
+
+
+class ThrottledTypesTestCase(BaseTestCase):
+    def test_all(self):
+        reservations = self.connection.get_all_instances.return_value
+        self.connection.get_all_instances.side_effect = [throttled(), reservations, reservations]
+        with self._patch_connection():
+            with patch('ec2.throttle.time.sleep'):
+                self.assertEquals(4, len(ec2.instances.all()))
+                self.assertEquals(4, len(ec2.instances.in_region('us-west-2').all()))
+        stats = ec2.throttle.throttle.stats()
+        self.assertEquals(2, stats[('us-east-1', None)]['requests'])
+        self.assertEquals(1, stats[('us-east-1', None)]['throttled'])
+        self.assertEquals(1, stats[('us-west-2', None)]['requests'])
+
+    def test_pages(self):
+        ec2.throttle.throttle.configure(limits={'DescribeInstances': (5, 5)})
+        page = MagicMock()
+        page.__iter__.return_value = iter(self.connection.get_all_instances.return_value)
+        page.next_token = None
+        self.connection.get_all_reservations.side_effect = [throttled(), page]
+        with self._patch_connection():
+            with patch('ec2.throttle.time.sleep'):
+                self.assertEquals(4, len(list(ec2.instances.iterator())))
+        self.assertEquals(1, ec2.throttle.throttle.stats()[('us-east-1', 'DescribeInstances')]['throttled'])
+
+    def test_session(self):
+        session = ec2.Session('def', 'uvw', 'us-west-2')
+        self.assertFalse(session.throttle is ec2.throttle.throttle)
+        with patch('ec2.types.acquire_connection', return_value=self.connection):
+            session.security_groups.all()
+        self.assertEquals(1, session.throttle.stats()[('us-west-2', None)]['requests'])
+        self.assertEquals({}, ec2.throttle.throttle.stats())
+        throttle = Throttle()
+        self.assertTrue(throttle is ec2.Session('def', 'uvw', throttle=throttle).throttle)
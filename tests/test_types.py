@@ -1,4 +1,11 @@
-from .base import BaseTestCase
+from .base import BaseTestCase, RUNNING_STATE
+from boto.ec2.instance import Instance, InstanceState
+from boto.ec2.securitygroup import SecurityGroup
+from boto.resultset import ResultSet
+from mock import MagicMock, patch
+import datetime
+import threading
+import time
 
 import ec2
 
@@ -14,6 +21,149 @@ class InstancesTestCase(BaseTestCase):
             # be called
             ec2.instances.all()
             mock.assert_called_once()  # Should only be called once from the initial _connect
+            # Each cached instance has its tags indexed up front
+            self.assertEquals({'name': 'instance-0'}, instances[0]._tag_map)
+
+    def test_stats(self):
+        with self._patch_connection():
+            self.assertEquals({'hits': 0, 'misses': 0, 'refreshes': 0, 'age': None}, ec2.instances.stats())
+            ec2.instances.all()
+            ec2.instances.all()
+            stats = ec2.instances.stats()
+            self.assertEquals((1, 1, 0), (stats['hits'], stats['misses'], stats['refreshes']))
+            self.assertTrue(0 <= stats['age'] < 5)
+
+    def test_one_hit_per_query(self):
+        with self._patch_connection():
+            ec2.instances.all()
+            queries = [
+                lambda: list(ec2.instances.filter(state='running')),
+                lambda: list(ec2.instances.filter(name__startswith='instance-1')),
+                lambda: ec2.instances.get(id='i-abc1'),
+                lambda: ec2.instances.get(name='instance-2'),
+            ]
+            for n, query in enumerate(queries):
+                query()
+                self.assertEquals((n + 1, 1), (ec2.instances.stats()['hits'], ec2.instances.stats()['misses']))
+
+            # A cold query that can't be pushed down only counts its miss
+            ec2.instances.clear()
+            list(ec2.instances.filter(name__iexact='INSTANCE-1'))
+            self.assertEquals((4, 2), (ec2.instances.stats()['hits'], ec2.instances.stats()['misses']))
+
+    def test_concurrent_miss(self):
+        "Threads racing on a cold cache only fetch once"
+        started = threading.Event()
+
+        def slow_get_all(**kwargs):
+            started.wait()
+            return reservations
+
+        reservations = self.connection.get_all_instances.return_value
+        self.connection.get_all_instances.side_effect = slow_get_all
+        with self._patch_connection():
+            threads = [threading.Thread(target=ec2.instances.all) for _ in xrange(8)]
+            for thread in threads:
+                thread.start()
+            started.set()
+            for thread in threads:
+                thread.join()
+            self.connection.get_all_instances.assert_called_once_with(filters=None)
+            self.assertEquals(4, len(ec2.instances.all()))
+
+    def test_ttl(self):
+        with self._patch_connection():
+            ec2.instances.ttl = 60
+            try:
+                stale = ec2.instances.all()
+                ec2.instances._cached_at -= 120
+                # Expired results are served while a refresh runs
+                self.assertTrue(ec2.instances.all() is stale)
+                for _ in xrange(100):
+                    if ec2.instances.stats()['refreshes']:
+                        break
+                    time.sleep(0.01)
+                self.assertEquals(1, ec2.instances.stats()['refreshes'])
+                self.assertEquals(2, self.connection.get_all_instances.call_count)
+                self.assertFalse(ec2.instances.all() is stale)
+                self.assertTrue(ec2.instances.age() < 60)
+            finally:
+                ec2.instances.ttl = None
+
+    def test_refresh_in_progress(self):
+        with self._patch_connection():
+            ec2.instances.ttl = 60
+            ec2.instances._refreshing = True
+            try:
+                ec2.instances.all()
+                ec2.instances._cached_at -= 120
+                with patch('threading.Thread') as thread:
+                    ec2.instances.all()
+                    self.assertFalse(thread.called)
+            finally:
+                ec2.instances.ttl = None
+                ec2.instances._refreshing = False
+
+    def test_async(self):
+        started = threading.Event()
+        reservations = self.connection.get_all_instances.return_value
+
+        def slow_get_all(**kwargs):
+            started.wait()
+            return reservations
+
+        self.connection.get_all_instances.side_effect = slow_get_all
+        with self._patch_connection():
+            every = ec2.instances.aall()
+            running = ec2.instances.afilter(state='running')
+            one = ec2.instances.aget(id='i-abc1')
+            missing = ec2.instances.aget(id='nope')
+            self.assertRaises(AttributeError, ec2.instances.afilter, state__nope='running')
+            self.assertFalse(every.done())
+            started.set()
+
+            self.assertEquals(4, len(every.result(1)))
+            self.assertEquals(['i-abc0', 'i-abc2'], [i.id for i in running.result(1)])
+            self.assertEquals('i-abc1', one.result(1).id)
+            self.assertRaises(ec2.instances.DoesNotExist, missing.result, 1)
+            # Every call shared a single fetch
+            self.connection.get_all_instances.assert_called_once_with(filters=None)
+
+            # A warm cache is still filtered on the pool, not here
+            threads = []
+            listener = ec2.instrumentation.register(
+                lambda event, model, **data: threads.append(threading.current_thread()))
+            try:
+                stopped = ec2.instances.afilter(state='stopped')
+                self.assertEquals(['i-abc1', 'i-abc3'], [i.id for i in stopped.result(1)])
+                self.assertEquals('i-abc1', ec2.instances.aget(id='i-abc1').result(1).id)
+            finally:
+                ec2.instrumentation.unregister(listener)
+            self.assertTrue(threads)
+            self.assertFalse(threading.current_thread() in threads)
+
+    def test_aiterator(self):
+        first, second = self.connection.get_all_instances.return_value
+        pages = [ResultSet(), ResultSet(), ResultSet()]
+        pages[0].append(first)
+        pages[0].next_token = 'page-2'
+        pages[1].append(second)
+        pages[1].next_token = 'page-3'
+        get_pages = self.connection.get_all_reservations = MagicMock(side_effect=pages)
+
+        with self._patch_connection():
+            page = ec2.instances.aiterator(state='running').result(1)
+            seen = []
+            while page is not None:
+                # Nothing is fetched until the caller asks for it
+                time.sleep(0.01)
+                self.assertEquals(len(seen) + 1, get_pages.call_count)
+                seen.append([i.id for i in page])
+                following = page.next
+                self.assertTrue(following is page.next)
+                page = following.result(1)
+            self.assertEquals([['i-abc0'], ['i-abc2'], []], seen)
+            self.assertEquals(None, ec2.instances._cache)
 
     def test_filters_integration(self):
         with self._patch_connection():
@@ -69,6 +219,355 @@ class InstancesTestCase(BaseTestCase):
             instances = ec2.instances.filter(id__isnull=True)
             self.assertEquals(0, len(instances))
 
+    def test_compile(self):
+        with self._patch_connection() as mock:
+            plan = ec2.instances.compile(state='running', name__endswith='-2')
+            self.assertFalse(mock.called)
+            instances = ec2.instances.filter(plan)
+            self.assertEquals(['i-abc2'], [i.id for i in instances])
+            instances = ec2.instances.filter(plan, id__startswith='i-abc0')
+            self.assertEquals(0, len(instances))
+
+    def test_indexes(self):
+        with self._patch_connection():
+            index = ec2.instances.index('name')
+            self.assertTrue(index is ec2.instances.index('name'))
+            self.assertFalse(index is ec2.instances.index('name', fold=True))
+            self.assertEquals(['i-abc1'], [i.id for i in index.get('instance-1')])
+
+            # Only the indexed candidates are checked against the plan
+            plan = ec2.instances.compile(name__iexact='INSTANCE-1')
+            expected = ec2.instances.get(id='i-abc1')
+            self.assertEquals([expected], ec2.instances._candidates((plan,)))
+
+            # Unhashable values can't be indexed and fall back to a scan
+            self.assertEquals(None, ec2.instances.index('groups'))
+            self.assertEquals(4, len(ec2.instances.filter(groups=[])))
+
+            ec2.instances.clear()
+            self.assertFalse(index is ec2.instances.index('name'))
+
+    def test_prefix_indexes(self):
+        with self._patch_connection():
+            ec2.instances.all()
+            for kwargs in ({'name__startswith': 'instance-1'},
+                           {'name__istartswith': 'INSTANCE-1'},
+                           {'name__like': r'^instance-1$'}):
+                plan = ec2.instances.compile(**kwargs)
+                self.assertEquals(['i-abc1'], [i.id for i in ec2.instances._candidates((plan,))])
+                self.assertEquals(['i-abc1'], [i.id for i in ec2.instances.filter(**kwargs)])
+            self.assertTrue(ec2.instances.prefix_index('name') is ec2.instances.prefix_index('name'))
+
+            # Only keys in prefix_indexed are indexed
+            plan = ec2.instances.compile(id__startswith='i-abc1')
+            self.assertEquals(4, len(ec2.instances._candidates((plan,))))
+
+            # Prefixes that can't be compared with the values are scanned
+            plan = ec2.instances.compile(name__startswith='instance-1')
+            with patch('ec2.indexes.PrefixIndex.get', side_effect=UnicodeDecodeError('ascii', '', 0, 1, '')):
+                self.assertEquals(4, len(ec2.instances._candidates((plan,))))
+                self.assertEquals(['i-abc1'], [i.id for i in ec2.instances.filter(plan)])
+
+    def test_substring_indexes(self):
+        with self._patch_connection():
+            plan = ec2.instances.compile(name__icontains='NCE-3')
+            self.assertEquals(4, len(ec2.instances._candidates((plan,))))
+            ec2.instances.substring_indexed = ('name',)
+            try:
+                self.assertEquals(['i-abc3'], [i.id for i in ec2.instances._candidates((plan,))])
+                self.assertEquals(['i-abc3'], [i.id for i in ec2.instances.filter(plan)])
+                self.assertEquals(['i-abc1'], [i.id for i in ec2.instances.filter(name__contains='e-1')])
+                with patch('ec2.indexes.TrigramIndex.get', side_effect=TypeError):
+                    self.assertEquals(4, len(ec2.instances._candidates((plan,))))
+            finally:
+                del ec2.instances.substring_indexed
+
+    def test_incremental_refresh(self):
+        reservations = self.connection.get_all_instances.return_value
+        cached = [i for r in reservations for i in r.instances]
+        cached[1]._state = InstanceState(0, 'pending')
+        cached[3]._state = InstanceState(48, 'terminated')
+
+        started = Instance()
+        started.id = 'i-abc1'
+        started._state = RUNNING_STATE
+        started.tags = {'Name': 'instance-1'}
+        launched = Instance()
+        launched.id = 'i-abc4'
+        launched._state = RUNNING_STATE
+        launched.tags = {'Name': 'instance-4'}
+
+        def get_all(filters=None):
+            reservation = MagicMock()
+            if filters is None:
+                return reservations
+            if 'launch-time' in filters:
+                reservation.instances = [launched]
+            elif 'instance-id' in filters:
+                # i-abc3 is gone for good
+                reservation.instances = [cached[0], started, cached[2]]
+            else:
+                reservation.instances = []
+            return [reservation]
+
+        with self._patch_connection():
+            ec2.instances.all()
+            names = ec2.instances.index('name')
+            running = ec2.instances.index('state')
+            self.connection.get_all_instances.side_effect = get_all
+
+            delta = ec2.instances.refresh(incremental=True)
+            self.assertEquals([launched], delta.added)
+            self.assertEquals([cached[3]], delta.removed)
+            self.assertEquals([started], delta.modified)
+            self.assertEquals('<Delta: 1 added, 1 removed, 1 modified>', repr(delta))
+
+            calls = self.connection.get_all_instances.call_args_list[1:]
+            today = datetime.datetime.utcnow().date().isoformat()
+            self.assertTrue(today + '*' in calls[0][1]['filters']['launch-time'])
+            self.assertEquals({'instance-state-name': ['pending', 'stopping', 'shutting-down']}, calls[1][1]['filters'])
+            self.assertEquals({'instance-id': ['i-abc0', 'i-abc1', 'i-abc2', 'i-abc3']}, calls[2][1]['filters'])
+
+            self.assertEquals([cached[0], started, cached[2], launched], ec2.instances.all())
+            self.assertEquals({'name': 'instance-4'}, launched._tag_map)
+            self.assertEquals(1, ec2.instances.stats()['refreshes'])
+
+            # Indexes are patched rather than rebuilt, into new copies
+            # swapped in with the cache, leaving the old ones alone
+            with patch('ec2.indexes.HashIndex.__init__') as built:
+                self.assertFalse(names is ec2.instances.index('name'))
+                running, old_running = ec2.instances.index('state'), running
+                names, old_names = ec2.instances.index('name'), names
+            self.assertFalse(built.called)
+            self.assertEquals([cached[0], started, cached[2], launched], running.get('running'))
+            self.assertEquals([], running.get('pending'))
+            self.assertEquals([], names.get('instance-3'))
+            self.assertEquals([cached[3]], old_names.get('instance-3'))
+            self.assertEquals([cached[1]], old_running.get('pending'))
+            self.assertEquals([launched], list(ec2.instances.filter(name='instance-4')))
+
+            # Nothing changed
+            self.assertFalse(ec2.instances.refresh(incremental=True))
+
+            # Too long since the last fetch, so everything is listed
+            ec2.instances._cached_at -= 30 * 86400
+            self.connection.get_all_instances.reset_mock()
+            delta = ec2.instances.refresh(incremental=True)
+            self.connection.get_all_instances.assert_called_once_with(filters=None)
+            self.assertEquals([cached[3]], delta.added)
+            self.assertEquals([launched], delta.removed)
+            self.assertEquals([cached[1]], delta.modified)
+
+    def test_incremental_terminated(self):
+        # Terminated between two refreshes, so never seen in between
+        cached = [i for r in self.connection.get_all_instances.return_value for i in r.instances]
+        terminated = Instance()
+        terminated.id = 'i-abc0'
+        terminated._state = InstanceState(48, 'terminated')
+
+        def get_all(filters=None):
+            reservation = MagicMock()
+            reservation.instances = []
+            if filters is None:
+                return self.connection.get_all_instances.return_value
+            if 'instance-id' in filters:
+                self.assertEquals(['i-abc0', 'i-abc2'], filters['instance-id'])
+                reservation.instances = [terminated, cached[2]]
+            return [reservation]
+
+        with self._patch_connection():
+            ec2.instances.all()
+            self.connection.get_all_instances.side_effect = get_all
+            delta = ec2.instances.refresh(incremental=True)
+            self.assertEquals([terminated], delta.modified)
+            self.assertEquals('terminated', ec2.instances.get(id='i-abc0').state)
+
+    def test_refresh_while_reading(self):
+        def get_all(filters=None):
+            # New copies every time, some of them renamed
+            reservation = MagicMock()
+            reservation.instances = []
+            for n in xrange(200):
+                i = Instance()
+                i.id = 'i-abc%d' % n
+                i._state = RUNNING_STATE
+                i.tags = {'Name': 'instance-%d' % (n + len(get_all.calls) % 2)}
+                reservation.instances.append(i)
+            get_all.calls.append(filters)
+            return [reservation]
+        get_all.calls = []
+        self.connection.get_all_instances.side_effect = get_all
+
+        with self._patch_connection():
+            ec2.instances.all()
+            errors = []
+            done = threading.Event()
+
+            def read():
+                try:
+                    while not done.is_set():
+                        list(ec2.instances.filter(name__startswith='instance-1'))
+                        list(ec2.instances.filter(name__in=['instance-1', 'instance-2']))
+                except Exception as e:
+                    errors.append(e)
+            readers = [threading.Thread(target=read) for _ in xrange(3)]
+            for reader in readers:
+                reader.start()
+            try:
+                for _ in xrange(30):
+                    ec2.instances.refresh(delta=True)
+            finally:
+                done.set()
+                for reader in readers:
+                    reader.join()
+            self.assertEquals([], errors)
+
+    def test_incremental_cold(self):
+        with self._patch_connection():
+            delta = ec2.instances.refresh(incremental=True)
+            self.assertEquals(4, len(delta.added))
+            self.assertEquals(4, len(ec2.instances.all()))
+            self.connection.get_all_instances.assert_called_once_with(filters=None)
+
+    def test_pushdown(self):
+        with self._patch_connection():
+            get_all = self.connection.get_all_instances
+            instances = list(ec2.instances.filter(state='running', name__startswith='instance-*'))
+            get_all.assert_called_once_with(filters={
+                'instance-state-name': 'running',
+                'tag-value': 'instance-\\**',
+            })
+            self.assertEquals(0, len(instances))
+            self.assertEquals(None, ec2.instances._cache)
+
+            # Lookups the API can't answer are still applied locally
+            get_all.reset_mock()
+            instances = list(ec2.instances.filter(id='i-abc0', name__iexact='INSTANCE-0'))
+            get_all.assert_called_once_with(filters={'instance-id': 'i-abc0'})
+            self.assertEquals(['i-abc0'], [i.id for i in instances])
+
+            # Wildcards and escapes in exact and in values are escaped
+            ec2.instances.clear()
+            get_all.reset_mock()
+            list(ec2.instances.filter(name='CORP\\web01', key_name__in=['build*1', 'a?']))
+            get_all.assert_called_once_with(filters={
+                'tag-value': 'CORP\\\\web01',
+                'key-name': ['build\\*1', 'a\\?'],
+            })
+
+            # Nothing to push down, so everything is fetched and cached
+            get_all.reset_mock()
+            list(ec2.instances.filter(name__iexact='INSTANCE-0'))
+            get_all.assert_called_once_with(filters=None)
+
+            # Warm cache, so no more API calls at all
+            get_all.reset_mock()
+            ec2.instances.filter(state='running')
+            self.assertFalse(get_all.called)
+
+    def test_in_bulk(self):
+        with self._patch_connection():
+            get_all = self.connection.get_all_instances
+            found = ec2.instances.in_bulk(['i-abc2', 'i-abc0', 'i-nope'])
+            get_all.assert_called_once_with(filters={'instance-id': ['i-abc2', 'i-abc0', 'i-nope']})
+            self.assertEquals(['i-abc0', 'i-abc2'], sorted(found))
+            self.assertEquals('i-abc2', found['i-abc2'].id)
+            self.assertEquals(None, ec2.instances._cache)
+            self.assertEquals({}, ec2.instances.in_bulk([]))
+
+            # Once cached, the id index answers without any API calls
+            ec2.instances.all()
+            get_all.reset_mock()
+            found = ec2.instances.in_bulk(iter(['i-abc3', 'i-abc1']))
+            self.assertEquals(['i-abc1', 'i-abc3'], sorted(found))
+            self.assertFalse(get_all.called)
+            self.assertEquals(
+                ['i-abc1', 'i-abc3'],
+                [i.id for i in ec2.instances._candidates((ec2.instances.compile(id__in=['i-abc3', 'i-abc1']),))],
+            )
+
+    def test_in_chunked(self):
+        ec2.instances.max_filter_values = 2
+        try:
+            with self._patch_connection():
+                get_all = self.connection.get_all_instances
+                ids = ['i-abc0', 'i-abc1', 'i-abc2', 'i-abc3', 'i-abc4']
+                matches = ec2.instances.filter(id__in=ids, state='running')
+                self.assertEquals(['i-abc0', 'i-abc2'], [i.id for i in matches])
+                self.assertEquals(3, get_all.call_count)
+                chunks = sorted(call[1]['filters']['instance-id'] for call in get_all.call_args_list)
+                self.assertEquals([ids[:2], ids[2:4], ids[4:]], chunks)
+                for call in get_all.call_args_list:
+                    self.assertEquals('running', call[1]['filters']['instance-state-name'])
+
+                # Pages can't be chunked, so the filter is left out
+                self.connection.get_all_reservations.return_value = get_all.return_value
+                self.assertEquals(2, len(list(ec2.instances.iterator(id__in=ids, state='running'))))
+                self.connection.get_all_reservations.assert_called_once_with(
+                    filters={'instance-state-name': 'running'}, max_results=1000, next_token=None)
+        finally:
+            del ec2.instances.max_filter_values
+
+    def test_pushdown_limit(self):
+        "Repeated queries on a cold cache end up filling it"
+        with self._patch_connection():
+            get_all = self.connection.get_all_instances
+            for _ in xrange(5):
+                self.assertEquals('i-abc0', ec2.instances.get(id='i-abc0').id)
+            self.assertEquals(3, get_all.call_count)
+            get_all.assert_called_with(filters=None)
+            self.assertEquals(4, len(ec2.instances._cache))
+
+            ec2.instances.clear()
+            ec2.instances.pushdown_limit = None
+            try:
+                for _ in xrange(3):
+                    ec2.instances.get(id='i-abc0')
+            finally:
+                del ec2.instances.pushdown_limit
+            self.assertEquals(6, get_all.call_count)
+            self.assertEquals(None, ec2.instances._cache)
+
+    def test_pushdown_disabled(self):
+        with self._patch_connection():
+            ec2.instances.pushdown = False
+            try:
+                list(ec2.instances.filter(state='running'))
+            finally:
+                ec2.instances.pushdown = True
+            self.connection.get_all_instances.assert_called_once_with(filters=None)
+
+    def test_iterator(self):
+        first, second = self.connection.get_all_instances.return_value
+        pages = [ResultSet(), ResultSet()]
+        pages[0].append(first)
+        pages[0].next_token = 'page-2'
+        pages[1].append(second)
+        self.connection.get_all_reservations = MagicMock(side_effect=pages)
+
+        with self._patch_connection():
+            instances = ec2.instances.iterator(state='running', id__startswith='i-abc')
+            # Results from the first page are yielded before the next is fetched
+            self.assertEquals('i-abc0', next(instances).id)
+            self.connection.get_all_reservations.assert_called_once_with(
+                filters={'instance-state-name': 'running', 'instance-id': 'i-abc*'},
+                max_results=1000,
+                next_token=None,
+            )
+            self.assertEquals(['i-abc2'], [i.id for i in instances])
+            self.connection.get_all_reservations.assert_called_with(
+                filters={'instance-state-name': 'running', 'instance-id': 'i-abc*'},
+                max_results=1000,
+                next_token='page-2',
+            )
+            self.assertEquals(None, ec2.instances._cache)
+
+    def test_iterator_single_page(self):
+        with self._patch_connection():
+            groups = ec2.security_groups.iterator(name__endswith='-1')
+            self.assertEquals(['sg-abc1'], [g.id for g in groups])
+            self.connection.get_all_security_groups.assert_called_once_with(filters=None)
+
     def test_get_raises(self):
         with self._patch_connection():
             self.assertRaises(
@@ -99,6 +598,34 @@ class SecurityGroupsTestCase(BaseTestCase):
             ec2.security_groups.all()
             mock.assert_called_once()
 
+    def test_incremental_refresh(self):
+        "Without a cheaper way to find changes, everything is listed and compared"
+        with self._patch_connection():
+            old = ec2.security_groups.all()
+            index = ec2.security_groups.index('name')
+            changed = SecurityGroup()
+            changed.id = 'sg-abc1'
+            changed.name = 'group-1'
+            changed.description = 'Renamed'
+            self.connection.get_all_security_groups.return_value = [changed]
+            delta = ec2.security_groups.refresh(incremental=True)
+            self.assertEquals(([], [old[0]], [changed]), (delta.added, delta.removed, delta.modified))
+            self.assertEquals([changed], ec2.security_groups.all())
+            patched = ec2.security_groups._indexes[('name', False)]
+            self.assertFalse(patched is index)
+            self.assertEquals([changed], patched.get('group-1'))
+            self.assertEquals([], patched.get('group-0'))
+            self.assertEquals([old[0]], index.get('group-0'))
+
+    def test_pushdown(self):
+        with self._patch_connection():
+            groups = list(ec2.security_groups.filter(name='group-1', vpc_id__startswith='vpc-'))
+            self.connection.get_all_security_groups.assert_called_once_with(filters={
+                'group-name': 'group-1',
+                'vpc-id': 'vpc-*',
+            })
+            self.assertEquals(0, len(groups))
+
     def test_filters_integration(self):
         with self._patch_connection():
             groups = ec2.security_groups.filter(name='crap')
@@ -170,6 +697,15 @@ class VPCTestCase(BaseTestCase):
             ec2.vpcs.all()
             mock.assert_called_once()
 
+    def test_pushdown(self):
+        with self._patch_vpc_connection():
+            vpcs = list(ec2.vpcs.filter(cidr_block='10.1.0.0/16', state='pending'))
+            self.vpc_connection.get_all_vpcs.assert_called_once_with(filters={
+                'cidr': '10.1.0.0/16',
+                'state': 'pending',
+            })
+            self.assertEquals(['vpc-abc1'], [v.id for v in vpcs])
+
     def test_filters_integration(self):
         with self._patch_vpc_connection():
             groups = ec2.vpcs.filter(id__exact='vpc-abc0')
@@ -228,3 +764,113 @@ class VPCTestCase(BaseTestCase):
     def test_get(self):
         with self._patch_vpc_connection():
             self.assertEquals(ec2.vpcs.get(id='vpc-abc0').id, 'vpc-abc0')
+
+
+class SubnetTestCase(BaseTestCase):
+    def test_all(self):
+        with self._patch_vpc_connection() as mock:
+            self.assertEquals(2, len(ec2.subnets.all()))
+            ec2.subnets.all()
+            mock.assert_called_once()
+
+    def test_pushdown(self):
+        with self._patch_vpc_connection():
+            subnets = list(ec2.subnets.filter(vpc_id='vpc-abc1'))
+            self.vpc_connection.get_all_subnets.assert_called_once_with(filters={'vpc-id': 'vpc-abc1'})
+            self.assertEquals(['subnet-abc1'], [s.id for s in subnets])
+
+
+class VolumeTestCase(BaseTestCase):
+    def test_all(self):
+        with self._patch_connection():
+            self.assertEquals(4, len(ec2.volumes.all()))
+            self.connection.get_all_volumes.assert_called_once_with(filters=None)
+
+    def test_filter(self):
+        with self._patch_connection():
+            self.assertEquals(['vol-abc3'], [v.id for v in ec2.volumes.filter(status='available')])
+            self.connection.get_all_volumes.assert_called_once_with(filters={'status': 'available'})
+
+
+class NetworkInterfaceTestCase(BaseTestCase):
+    def test_all(self):
+        with self._patch_connection():
+            self.assertEquals(['eni-abc0'], [n.id for n in ec2.network_interfaces.all()])
+
+    def test_get(self):
+        with self._patch_connection():
+            self.assertEquals('eni-abc0', ec2.network_interfaces.get(subnet_id='subnet-abc0').id)
+            self.connection.get_all_network_interfaces.assert_called_once_with(filters={'subnet-id': 'subnet-abc0'})
+
+
+class ImageTestCase(BaseTestCase):
+    def test_all(self):
+        "Only the account's own images are listed"
+        with self._patch_connection():
+            self.assertEquals(2, len(ec2.images.all()))
+            self.connection.get_all_images.assert_called_once_with(owners=['self'], filters=None)
+
+    def test_by_id(self):
+        "Any image can be looked up by id, public ones included"
+        with self._patch_connection():
+            ec2.images.get(id='ami-abc1')
+            self.connection.get_all_images.assert_called_once_with(owners=None, filters={'image-id': 'ami-abc1'})
+
+
+class MultiRegionTestCase(BaseTestCase):
+    def setUp(self):
+        super(MultiRegionTestCase, self).setUp()
+        self.west = MagicMock()
+        self.west.get_all_instances = MagicMock(return_value=[])
+        self.connections = {None: self.connection, 'us-east-1': self.connection, 'us-west-2': self.west}
+
+    def _patch_connection(self):
+        return patch('ec2.types.acquire_connection', side_effect=lambda region_name=None, session=None: self.connections[region_name])
+
+    def test_in_region(self):
+        west = ec2.instances.in_region('us-west-2')
+        self.assertTrue(west is ec2.instances.in_region('us-west-2'))
+        self.assertTrue(issubclass(west, ec2.instances))
+        self.assertTrue(issubclass(west.DoesNotExist, ec2.instances.DoesNotExist))
+        self.assertEquals('us-west-2', west.region_name)
+        self.assertEquals(None, ec2.instances.region_name)
+
+        with self._patch_connection():
+            self.assertEquals(0, len(west.all()))
+            self.assertEquals(None, ec2.instances._cache)
+            self.assertEquals(4, len(ec2.instances.all()))
+            self.assertEquals('us-east-1', ec2.instances.all()[0].region_name)
+            self.assertRaises(ec2.instances.DoesNotExist, west.get, id='i-abc0')
+
+    def test_fan_out(self):
+        with self._patch_connection():
+            instances = ec2.instances.filter(state='running', regions=['us-east-1', 'us-west-2'])
+            self.assertEquals(['i-abc0', 'i-abc2'], [i.id for i in instances])
+            self.assertEquals(['us-east-1', 'us-east-1'], [i.region_name for i in instances])
+            self.west.get_all_instances.assert_called_once_with(filters={'instance-state-name': 'running'})
+
+            self.assertEquals(4, len(ec2.instances.all(regions=['us-east-1', 'us-west-2'])))
+            self.assertEquals('i-abc1', ec2.instances.get(id='i-abc1', regions=['us-east-1', 'us-west-2']).id)
+            self.assertEquals([], ec2.instances.filter(regions=[]))
+
+            # Each region keeps its own cache, which clear() also throws away
+            self.assertEquals(4, len(ec2.instances.in_region('us-east-1')._cache))
+            ec2.instances.clear()
+            self.assertEquals(None, ec2.instances.in_region('us-east-1')._cache)
+
+    def test_all_regions(self):
+        with self._patch_connection():
+            with patch('ec2.base.get_regions', return_value=['us-east-1', 'us-west-2']):
+                self.assertEquals(4, len(ec2.instances.all(regions='all')))
+
+    def test_region_errors(self):
+        self.west.get_all_instances.side_effect = ValueError('boom')
+        with self._patch_connection():
+            try:
+                ec2.instances.all(regions=['us-east-1', 'us-west-2'])
+            except ec2.instances.RegionError as e:
+                self.assertEquals(['us-west-2'], list(e.errors))
+                self.assertTrue(isinstance(e.errors['us-west-2'], ValueError))
+                self.assertEquals(4, len(e.results))
+            else:
+                self.fail('RegionError not raised')